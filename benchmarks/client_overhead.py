@@ -0,0 +1,85 @@
+"""
+Per-call overhead of GPUClient: a new connection per call (the old bare
+requests.get) vs the pooled keep-alive session, and many concurrent calls
+through AsyncGPUClient.
+
+Against a local agent started in-process (plain HTTP, so the gap is smaller
+than through a TLS tunnel), or a real one with --url:
+
+    python benchmarks/client_overhead.py --calls 200
+    python benchmarks/client_overhead.py --url "https://xxxx.ngrok.app/?key=..."
+"""
+import argparse
+import asyncio
+import statistics
+import threading
+import time
+
+import requests
+import uvicorn
+
+from gpuhost.api import app, set_auth_token
+from gpuhost.client import AsyncGPUClient, GPUClient
+from gpuhost.devices import SimulatedBackend
+from gpuhost.gpu import set_backend
+
+PORT = 8849
+
+
+def start_local_agent() -> str:
+    set_auth_token("bench")
+    set_backend(SimulatedBackend()) # No NVML noise on machines without a GPU
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=PORT, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{PORT}/?key=bench"
+
+
+def timed(call, n: int):
+    latencies = []
+    for _ in range(n):
+        start = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def report(name: str, latencies):
+    print(f"{name:<28} mean {statistics.mean(latencies) * 1000:7.2f} ms   p50 {statistics.median(latencies) * 1000:7.2f} ms")
+
+
+async def concurrent(url: str, n: int, concurrency: int) -> float:
+    async with AsyncGPUClient(url) as gpu:
+        slots = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with slots:
+                await gpu.get_info()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(n)))
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", help="Agent share link (default: start one locally)")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    url = args.url or start_local_agent()
+    gpu = GPUClient(url)
+    gpu.get_info() # Warm up both sides
+
+    # Before: a new connection (and TLS handshake) for every call
+    report("new connection per call", timed(lambda: requests.get(f"{gpu.url}/info", headers=gpu.headers).raise_for_status(), args.calls))
+    report("pooled session", timed(gpu.get_info, args.calls))
+
+    elapsed = asyncio.run(concurrent(url, args.calls, args.concurrency))
+    print(f"{'async, ' + str(args.concurrency) + ' concurrent':<28} {args.calls / elapsed:7.0f} calls/s ({elapsed:.2f} s total)")
+
+
+if __name__ == "__main__":
+    main()
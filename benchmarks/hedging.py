@@ -0,0 +1,72 @@
+"""
+Tail latency with and without hedging, on simulated clan workers.
+
+Each request can go to any of N workers. Latencies are lognormal, and
+each worker occasionally stalls (a home-internet tunnel hiccup). Requests run a
+few at a time; reports p50/p99 and the extra requests hedging cost.
+
+    python benchmarks/hedging.py --requests 2000 --workers 3
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from gpuhost.hedging import Hedger
+
+
+def make_worker(name: str, median: float, stall_rate: float, stall: float):
+    async def call():
+        latency = random.lognormvariate(0, 0.3) * median
+        if random.random() < stall_rate:
+            latency += stall
+        await asyncio.sleep(latency)
+        return name
+    return call
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+async def run(requests: int, workers: int, concurrency: int, hedge: bool, budget: float, args):
+    random.seed(1)
+    nodes = [(f"w{i}", make_worker(f"w{i}", args.median * (1 + 0.2 * i), args.stall_rate, args.stall))
+             for i in range(workers)]
+    hedger = Hedger(budget_ratio=budget)
+    latencies = []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with slots:
+            start = time.perf_counter()
+            await hedger.run(nodes, hedge=hedge)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return latencies, hedger
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--median", type=float, default=0.02, help="Median latency (s)")
+    parser.add_argument("--stall-rate", type=float, default=0.03)
+    parser.add_argument("--stall", type=float, default=0.5, help="Extra latency of a stall (s)")
+    parser.add_argument("--budget", type=float, default=0.1, help="Max extra load from hedges")
+    args = parser.parse_args()
+
+    for label, hedge in (("no hedging", False), ("hedged", True)):
+        latencies, hedger = asyncio.run(run(args.requests, args.workers, args.concurrency, hedge, args.budget, args))
+        print(
+            f"{label:>10}: p50 {percentile(latencies, 50) * 1000:7.1f} ms"
+            f"  p99 {percentile(latencies, 99) * 1000:7.1f} ms"
+            f"  extra load {hedger.stats()['extra_load']:.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
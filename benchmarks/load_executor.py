@@ -0,0 +1,65 @@
+"""
+Load test: blocking subprocess.run in a threadpool vs. the asyncio executor.
+
+Runs N jobs that each sleep for a fixed time and reports wall time and
+peak thread count. The threadpool is sized like Starlette's default (40),
+so once N exceeds it the blocking version starts queueing jobs.
+
+    python benchmarks/load_executor.py --jobs 200 --sleep 1
+"""
+import argparse
+import asyncio
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from gpuhost.job_manager import run_code, pidfd_child_watcher
+
+THREADPOOL_SIZE = 40
+
+
+def blocking_job(code: str):
+    return subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+
+
+def run_blocking(jobs: int, code: str):
+    peak = threading.active_count()
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=THREADPOOL_SIZE) as pool:
+        futures = [pool.submit(blocking_job, code) for _ in range(jobs)]
+        while not all(f.done() for f in futures):
+            peak = max(peak, threading.active_count())
+            time.sleep(0.05)
+    return time.time() - start, peak
+
+
+def run_async(jobs: int, code: str):
+    peak = threading.active_count()
+
+    async def main():
+        nonlocal peak
+        with pidfd_child_watcher():
+            tasks = [asyncio.ensure_future(run_code(code)) for _ in range(jobs)]
+            while not all(t.done() for t in tasks):
+                peak = max(peak, threading.active_count())
+                await asyncio.sleep(0.05)
+            results = await asyncio.gather(*tasks)
+        assert all(r["status"] == "success" for r in results), results[0]
+
+    start = time.time()
+    asyncio.run(main())
+    return time.time() - start, peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=120)
+    parser.add_argument("--sleep", type=float, default=1.0)
+    args = parser.parse_args()
+
+    code = f"import time; time.sleep({args.sleep})"
+    for name, fn in [("threadpool + subprocess.run", run_blocking), ("asyncio executor", run_async)]:
+        elapsed, peak = fn(args.jobs, code)
+        print(f"{name:<28} jobs={args.jobs:<5} wall={elapsed:6.2f}s  peak_threads={peak}")
@@ -0,0 +1,136 @@
+import asyncio
+import collections
+import logging
+from typing import Callable, Dict, Any, Optional
+
+from gpuhost.gpu import get_backend
+
+logger = logging.getLogger("gpuhost.admission")
+
+# Headroom kept free on top of the declared budgets (CUDA context, fragmentation)
+DEFAULT_SAFETY_MARGIN = 512 * 1024 * 1024
+
+# How often queued jobs re-check live free memory (memory can be freed by
+# processes we don't track, not only by our own jobs finishing)
+RECHECK_INTERVAL = 1.0
+
+
+def read_primary_device() -> Dict[str, Any]:
+    """The primary GPU's live memory. Raises DeviceError: never the mock card get_gpu_info() may fall back to."""
+    return get_backend().device_info(0)
+
+
+class AdmissionController:
+    """
+    Packs several jobs onto one GPU in shared mode.
+
+    Each job declares the VRAM it expects to use. A job is admitted when
+      - all declared budgets plus this one plus the safety margin fit in
+        the card's total memory, and
+      - this budget plus the margin fits in the *live* free memory NVML
+        reports, minus what admitted jobs haven't allocated yet (catches
+        memory used by processes outside gpuhost without counting jobs
+        that were just admitted as free space).
+    Jobs that don't fit wait in a FIFO queue; the head of the queue blocks
+    the jobs behind it so large jobs can't be starved by small ones.
+
+    NVML is read off the event loop, on each acquire and re-check; the
+    queue is pumped from the last reading. A failed reading counts as no
+    free memory: jobs wait until the device answers again.
+    """
+
+    def __init__(
+        self,
+        memory_probe: Callable[[], Optional[Dict[str, Any]]] = read_primary_device,
+        safety_margin: int = DEFAULT_SAFETY_MARGIN,
+    ):
+        self.memory_probe = memory_probe
+        self.safety_margin = safety_margin
+        self._running: Dict[str, int] = {}
+        self._queue: "collections.deque" = collections.deque() # (job_id, vram, future)
+        self._memory: Dict[str, Any] = {} # Last NVML reading
+        # Memory used outside gpuhost, measured while none of our jobs ran
+        self._external = 0
+
+    @property
+    def reserved_bytes(self) -> int:
+        return sum(self._running.values())
+
+    async def _read_memory(self) -> Dict[str, Any]:
+        """The probe's reading, {} if it failed."""
+        try:
+            info = await asyncio.get_running_loop().run_in_executor(None, self.memory_probe) or {}
+        except Exception as e:
+            if self._memory:
+                logger.warning("GPU memory query failed, admitting nothing until it answers: %s", e)
+            info = {}
+        self._memory = info
+        if info and not self._running:
+            self._external = info.get("memory_total", 0) - info.get("memory_free", 0)
+        return info
+
+    def _fits(self, vram: int) -> bool:
+        total = self._memory.get("memory_total", 0)
+        free = self._memory.get("memory_free", 0)
+        reserved = self.reserved_bytes
+        if reserved + vram + self.safety_margin > total:
+            return False
+        # Our jobs' share of the used memory (whatever grew since they started), up to their budgets
+        resident = min(reserved, max(0, total - free - self._external))
+        return vram + self.safety_margin <= free - (reserved - resident)
+
+    def _pump(self):
+        while self._queue:
+            job_id, vram, fut = self._queue[0]
+            if fut.done(): # Cancelled while waiting
+                self._queue.popleft()
+                continue
+            if not self._fits(vram):
+                return
+            self._queue.popleft()
+            self._running[job_id] = vram
+            fut.set_result(True)
+
+    async def acquire(self, job_id: str, vram: int):
+        """Waits until the job's VRAM budget can be admitted."""
+        info = await self._read_memory()
+        if info and vram + self.safety_margin > info.get("memory_total", 0):
+            raise ValueError("Requested VRAM exceeds GPU capacity")
+
+        fut = asyncio.get_running_loop().create_future()
+        self._queue.append((job_id, vram, fut))
+        self._pump()
+        try:
+            while not fut.done():
+                try:
+                    await asyncio.wait_for(asyncio.shield(fut), RECHECK_INTERVAL)
+                except asyncio.TimeoutError:
+                    info = await self._read_memory()
+                    if info and vram + self.safety_margin > info.get("memory_total", 0):
+                        # Queued while the device didn't answer, and it turns out it can never fit
+                        fut.cancel()
+                        self._pump()
+                        raise ValueError("Requested VRAM exceeds GPU capacity")
+                    self._pump()
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release(job_id) # Admitted just as we were cancelled
+            else:
+                fut.cancel()
+            raise
+
+    def release(self, job_id: str):
+        if self._running.pop(job_id, None) is not None:
+            self._pump()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "running_jobs": len(self._running),
+            "queued_jobs": sum(1 for _, _, f in self._queue if not f.done()),
+            "reserved_bytes": self.reserved_bytes,
+            "safety_margin": self.safety_margin,
+        }
+
+
+# Global Controller Instance
+admission = AdmissionController()
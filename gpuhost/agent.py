@@ -1,48 +1,233 @@
-from gpuhost.api import app, set_auth_token
+from gpuhost.api import app, set_auth_token, set_worker_processes
 from gpuhost.state import state
-from gpuhost.gpu import init_gpu, shutdown_gpu
+from gpuhost.gpu import init_gpu, shutdown_gpu, set_backend
+from gpuhost.devices import simulated_backend
 from gpuhost.tunnel import start_tunnel, stop_tunnels
+from gpuhost.job_store import job_store, GPUHOST_HOME
+from gpuhost.resources import reserve_agent_cores, inherit_reserved_cores, available_cores
+from gpuhost.envs import env_cache
+from gpuhost.live import live_feed, SHARED_POLL_INTERVAL
+from gpuhost.ratelimit import rate_limiter
+from gpuhost.lan import lan_urls
+from gpuhost.state_backend import STATE_DB_ENV, SqliteBackend, state_backend
+from gpuhost.tracing import tracer
+from gpuhost.chat_cache import chat_cache
+from gpuhost.preemption import preemption
+from gpuhost.state import PRIORITY_CLASSES
 import uvicorn
+import logging
+import os
 import secrets
+import signal
 import webbrowser
 import threading
 import time
-from typing import Optional
+from typing import Optional, List, Dict, Any
 
+# Backend key the agent publishes its settings under for its worker processes
+SETTINGS_KEY = "agent_settings"
 
-def start_agent(tunnel: bool = False, token: Optional[str] = None):
+
+def _apply_settings(settings: Dict[str, Any]):
+    """Configures this process: the agent itself, or each of its worker processes."""
+    set_auth_token(settings["token"])
+    state.auth_token = settings["token"]
+    state.public_url = settings["public_url"]
+    state.lan_urls = settings["lan_urls"]
+    if settings["shared"]:
+        state.mode = "shared"
+
+    if settings["env_cache_gb"] is not None:
+        env_cache.max_bytes = int(settings["env_cache_gb"] * 1024 ** 3)
+    env_cache.offline = settings["offline"]
+
+    if settings["live_rate"]:
+        live_feed.max_rate = settings["live_rate"]
+
+    if settings["rate_limit"]:
+        rate_limiter.key_rate = settings["rate_limit"]
+        rate_limiter.key_burst = 2 * settings["rate_limit"]
+    if settings["max_inflight"]:
+        rate_limiter.max_inflight = settings["max_inflight"]
+    set_worker_processes(settings["workers"])
+    if settings["workers"] > 1:
+        rate_limiter.split(settings["workers"])
+        live_feed.poll_interval = SHARED_POLL_INTERVAL # Changes made by the other processes
+
+    if settings["trace"]:
+        tracer.path = settings["trace"]
+
+    if settings["chat_cache_ttl"]:
+        chat_cache.enabled = True
+        chat_cache.ttl = settings["chat_cache_ttl"]
+        chat_cache.clan_wide = settings["chat_cache_clan"]
+        if settings["chat_cache_mb"]:
+            chat_cache.max_bytes = int(settings["chat_cache_mb"] * 1024 ** 2)
+
+    preemption.enabled = settings["preempt"]
+    if settings["preempt_grace"] is not None:
+        preemption.grace = settings["preempt_grace"]
+    if settings["preempt_signal"]:
+        preemption.signal = signal.Signals[settings["preempt_signal"]]
+    if settings["preempt_client_max"]:
+        preemption.max_priority["client"] = settings["preempt_client_max"]
+
+
+def worker_app():
+    """
+    uvicorn app factory for `--workers`: sets up one API worker process from
+    the settings the agent published, then serves the same app.
+    """
+    settings = state_backend.get(SETTINGS_KEY)
+    job_store.recover_on_open = False # The agent already did, the running jobs are our siblings'
+    inherit_reserved_cores(settings["reserved_cores"], settings["all_cores"])
+    if settings["simulate"]:
+        set_backend(simulated_backend(settings["simulate"]))
+    else:
+        init_gpu()
+    _apply_settings(settings)
+    return app
+
+
+def _serve_workers(settings: Dict[str, Any], workers: int):
+    """
+    Runs `workers` uvicorn processes on port 8848. The GPU lock and the clan
+    live in a SQLite file they all open (see state_backend); rate limits
+    and caches stay per process, and object refs, DAGs and shared jobs are
+    refused (see api.set_worker_processes).
+    """
+    path = os.path.join(GPUHOST_HOME, f"state-{os.getpid()}.db")
+    os.environ[STATE_DB_ENV] = path # Inherited by the workers
+    backend = SqliteBackend(path)
+    backend.set(SETTINGS_KEY, settings)
+    job_store.open() # Recover jobs a previous agent left behind, once, before the workers start
+    try:
+        uvicorn.run("gpuhost.agent:worker_app", factory=True, host="0.0.0.0", port=8848, workers=workers)
+    finally:
+        backend.close()
+        for leftover in (path, path + "-wal", path + "-shm"):
+            try:
+                os.remove(leftover)
+            except OSError:
+                pass
+
+
+def start_agent(
+    tunnel: bool = False,
+    token: Optional[str] = None,
+    reserved_cores: Optional[List[int]] = None,
+    shared: bool = False,
+    env_cache_gb: Optional[float] = None,
+    offline: bool = False,
+    live_rate: Optional[float] = None,
+    simulate: Optional[str] = None,
+    rate_limit: Optional[float] = None,
+    max_inflight: Optional[int] = None,
+    workers: int = 1,
+    trace: Optional[str] = None,
+    chat_cache_ttl: Optional[float] = None,
+    chat_cache_mb: Optional[float] = None,
+    chat_cache_clan: bool = False,
+    preempt: bool = False,
+    preempt_grace: Optional[float] = None,
+    preempt_signal: Optional[str] = None,
+    preempt_client_max: Optional[str] = None,
+    lan: bool = False
+):
     """
     Starts the local GPU host agent
     """
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if workers > 1 and shared:
+        # VRAM packing is decided in-process by the admission controller
+        print("❌ --shared needs a single worker process")
+        return
+    if workers > 1 and preempt:
+        # Each worker only sees the jobs it runs itself
+        print("❌ --preempt needs a single worker process")
+        return
+    if preempt_signal:
+        preempt_signal = preempt_signal.upper()
+        if not preempt_signal.startswith("SIG"):
+            preempt_signal = "SIG" + preempt_signal
+        if preempt_signal not in signal.Signals.__members__:
+            print(f"❌ Unknown signal: {preempt_signal}")
+            return
+    if preempt_client_max is not None and preempt_client_max not in PRIORITY_CLASSES:
+        print(f"❌ Unknown priority: {preempt_client_max} (expected one of: {', '.join(PRIORITY_CLASSES)})")
+        return
+
     # 1. Setup Authentication
     if not token:
         token = secrets.token_hex(4) + "-" + secrets.token_hex(4)
     
-    set_auth_token(token)
-    state.auth_token = token
     print(f"\n🔑 API Key: {token}")
 
     # 2. Initialize GPU
     print("Initializing GPU connection...")
-    if init_gpu():
+    if simulate:
+        backend = simulated_backend(simulate)
+        set_backend(backend)
+        print(f"🧪 Simulating {backend.device_count()} GPU(s)")
+    elif init_gpu():
         print("✅ GPU detected and initialized.")
     else:
         print("⚠️  Warning: Real NVIDIA GPU not detected (or drivers missing). Using Mock/Fallback.")
 
+    if shared:
+        print("🤝 Shared mode: jobs declare vram_bytes and are packed onto the GPU")
+
+    if offline:
+        print(f"📦 Offline: job environments are built from {env_cache.wheel_dir}")
+
+    if trace:
+        trace = os.path.abspath(trace)
+        print(f"🔎 Tracing requests to {trace} (open in chrome://tracing or ui.perfetto.dev)")
+
+    if chat_cache_ttl:
+        scope = "shared by all keys" if chat_cache_clan else "per API key"
+        print(f"🗃️  Caching temperature-0 chat completions for {chat_cache_ttl:g}s ({scope})")
+
+    if preempt:
+        grace = preempt_grace if preempt_grace is not None else preemption.grace
+        print(f"⏸️  Preemption on: higher priority locks stop running jobs ({preempt_signal or 'SIGTERM'}, {grace:g}s grace) and requeue them")
+
+    # Keep some cores for the API so busy jobs can't starve the event loop
+    reserved = reserve_agent_cores(reserved_cores, count=workers)
+    if reserved:
+        print(f"🧷 Agent pinned to cores {reserved} (reserved from jobs)")
+
     # 3. Start Tunnel (Optional)
     public_url = None
     if tunnel:
         print("🚇 Starting secure tunnel...")
         try:
             public_url = start_tunnel(8848)
-            state.public_url = public_url
             print(f"\n🌍 Public Share Link: {public_url}/?key={token}")
         except Exception as e:
             print(f"❌ Failed to start tunnel: {e}")
 
+    # Opt-in: nearby clients and clan hosts connect directly (unencrypted) instead of through the tunnel
+    direct = lan_urls(8848) if lan else []
+    if direct:
+        print(f"🏠 LAN addresses (plain HTTP): {', '.join(direct)}")
+
+    settings = {
+        "token": token, "public_url": public_url, "lan_urls": direct, "shared": shared,
+        "env_cache_gb": env_cache_gb, "offline": offline, "live_rate": live_rate,
+        "rate_limit": rate_limit, "max_inflight": max_inflight, "workers": workers,
+        "trace": trace, "chat_cache_ttl": chat_cache_ttl, "chat_cache_mb": chat_cache_mb,
+        "chat_cache_clan": chat_cache_clan, "preempt": preempt, "preempt_grace": preempt_grace,
+        "preempt_signal": preempt_signal, "preempt_client_max": preempt_client_max, "simulate": simulate, "reserved_cores": reserved, "all_cores": available_cores(),
+    }
+    _apply_settings(settings)
+
     # 4. Start Server
     local_url = f"http://localhost:8848/?key={token}"
     print(f"🚀 gpuhost agent starting on {local_url}")
+    if workers > 1:
+        print(f"🧵 {workers} API worker processes")
     
     # 4. Auto-Open Browser (Delayed to wait for uvicorn start)
     def open_browser():
@@ -53,7 +238,10 @@ def start_agent(tunnel: bool = False, token: Optional[str] = None):
     threading.Thread(target=open_browser, daemon=True).start()
 
     try:
-        uvicorn.run(app, host="0.0.0.0", port=8848)
+        if workers > 1:
+            _serve_workers(settings, workers)
+        else:
+            uvicorn.run(app, host="0.0.0.0", port=8848)
     finally:
         print("Shutting down...")
         if tunnel:
@@ -61,3 +249,5 @@ def start_agent(tunnel: bool = False, token: Optional[str] = None):
             stop_tunnels()
         print("Shutting down GPU connection...")
         shutdown_gpu()
+        job_store.close()
+        tracer.close()
@@ -1,17 +1,64 @@
-from fastapi import FastAPI, HTTPException, Request, Depends, status
+from fastapi import FastAPI, HTTPException, Request, Depends, Query, status
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
+from contextlib import asynccontextmanager, AsyncExitStack
+from typing import Optional, List, Union
+import asyncio
+import hashlib
+import hmac
+import httpx
+import json
 import os
+import re
 import secrets
 import time
+import uuid
 
-from gpuhost.state import state
-from gpuhost.gpu import get_gpu_info
-from gpuhost.job_manager import execute_code
+from gpuhost.state import state, DEFAULT_PRIORITY
+from gpuhost.gpu import get_gpu_info, list_devices
+from gpuhost.job_manager import run_code, run_pickle, stream_pickle, pidfd_child_watcher
+from gpuhost.job_store import job_store
+from gpuhost.resources import ResourceBudget, prepare as prepare_resources
+from gpuhost.admission import admission
+from gpuhost.dag import DagRequest, DagRun, dag_runs
+from gpuhost.objects import object_store, SWEEP_INTERVAL
+from gpuhost.envs import env_cache, EnvBuildError, normalize_requirements
+from gpuhost.code_cache import code_cache
+from gpuhost.single_flight import single_flight
+from gpuhost.live import live_feed, DEFAULT_SAMPLE_INTERVAL
+from gpuhost.ratelimit import rate_limiter, RateLimited, retry_after_header
+from gpuhost.clan import clan, Node
+from gpuhost.lan import AGENT_ID, MAX_LAN_URLS, hello_proof, valid_lan_url
+from gpuhost.tracing import ServerTimingMiddleware, span
+from gpuhost.streams import ITEM, END, STREAM_MEDIA_TYPE, encode_frame
+from gpuhost.chat_cache import chat_cache
+from gpuhost.preemption import preemption
+
+async def _sweep_expired():
+    """Frees expired host-side results, whether or not new ones come in"""
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        object_store.expire()
+        dag_runs.expire()
+        dag_runs.remove_orphans()
+        code_cache.expire()
 
-app = FastAPI(title="gpuhost")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Results of an earlier run nobody can reference anymore
+    object_store.remove_orphans()
+    dag_runs.remove_orphans()
+    sweeper = asyncio.ensure_future(_sweep_expired())
+    with pidfd_child_watcher():
+        yield
+    sweeper.cancel()
+    await close_async_client()
+    job_store.flush() # Worker processes exit right after this
+
+app = FastAPI(title="gpuhost", lifespan=lifespan)
+# Trace spans per request, summed up in a Server-Timing header
+app.add_middleware(ServerTimingMiddleware)
 
 # Authentication
 AUTH_TOKEN = None
@@ -20,7 +67,24 @@ def set_auth_token(token: str):
     global AUTH_TOKEN
     AUTH_TOKEN = token
 
+# API worker processes serving this agent. Object refs, DAG runs and shared
+# (deduplicated/idempotent) jobs live in one process's memory: refused with several
+WORKER_PROCESSES = 1
+
+def set_worker_processes(count: int):
+    global WORKER_PROCESSES
+    WORKER_PROCESSES = count
+
+def _single_process_only(feature: str):
+    if WORKER_PROCESSES > 1:
+        raise HTTPException(status_code=400, detail=f"{feature} can't be used with --workers > 1 (kept per process)")
+
 async def verify_token(request: Request):
+    with span("auth"):
+        return _check_token(request)
+
+def _check_token(request: Request):
+    clan.sync() # Joins/keys from other worker processes
     if AUTH_TOKEN is None:
         return # Dev mode / Unprotected if no token set (should not happen in prod flow)
     
@@ -29,18 +93,13 @@ async def verify_token(request: Request):
     if token == AUTH_TOKEN:
         return token
 
-    # 2. Check Header (for Programmatic access)
+    # 2. Check Header (for Programmatic access): this agent's key or one of the clan's
     auth_header = request.headers.get("Authorization")
     if auth_header and auth_header.startswith("Bearer "):
         parts = auth_header.split(" ")
         if len(parts) == 2:
             token = parts[1]
-            # V1 Check
-            if token == AUTH_TOKEN:
-                return token
-            # V2 Clan Checks
-            from gpuhost.clan import clan
-            if token in [clan.admin_key, clan.worker_join_key, clan.client_access_key]:
+            if token == AUTH_TOKEN or token in clan.key_roles:
                 return token
             
     # 3. GUI Static files - Allow (but data endpoints will fail)
@@ -53,6 +112,56 @@ async def verify_token(request: Request):
         detail="Invalid or missing API Key" 
     )
 
+def node_key() -> Optional[str]:
+    """
+    The key a clan host sends this agent work with (map shards, forwarded
+    chat), instead of the agent key: only the node endpoints accept it.
+    Derived from the agent key, so every worker process agrees on it and
+    changing the agent key revokes it.
+    """
+    if AUTH_TOKEN is None:
+        return None
+    return hmac.new(AUTH_TOKEN.encode(), b"gpuhost node key", hashlib.sha256).hexdigest()
+
+async def verify_node_key(request: Request):
+    """verify_token for the node endpoints: also takes this agent's node key."""
+    with span("auth"):
+        key = node_key()
+        if key and hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {key}"):
+            return key
+        return _check_token(request)
+
+@asynccontextmanager
+async def _admission(request: Request, token: Optional[str]):
+    with span("admit"):
+        ticket = await rate_limiter.admit(token)
+    request.state.ticket = ticket
+    try:
+        yield
+    finally:
+        rate_limiter.release(ticket)
+
+async def admitted(request: Request, token: Optional[str] = Depends(verify_token)):
+    """
+    verify_token plus backpressure for expensive endpoints (see RateLimiter).
+    The ticket is on request.state for endpoints that also limit by owner.
+    """
+    async with _admission(request, token):
+        yield token
+
+async def node_admitted(request: Request, token: Optional[str] = Depends(verify_node_key)):
+    """admitted() for the node endpoints (see node_key)."""
+    async with _admission(request, token):
+        yield token
+
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request: Request, exc: RateLimited):
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": exc.detail},
+        headers={"Retry-After": retry_after_header(exc.retry_after)}
+    )
+
 # Ensure static directory exists
 static_dir = os.path.join(os.path.dirname(__file__), "static")
 if not os.path.exists(static_dir):
@@ -60,14 +169,29 @@ if not os.path.exists(static_dir):
 
 app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
+JOB_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
 class LockRequest(BaseModel):
     owner_id: str
+    priority: str = DEFAULT_PRIORITY # Class (see PRIORITY_CLASSES); a higher one may preempt the holder
 
 class SubmitRequest(BaseModel):
     owner_id: str
     code: Optional[str] = None
     pickle_data: Optional[str] = None
     type: str = "code" # "code" or "pickle"
+    job_id: Optional[str] = None # Client-chosen ID so results can be fetched after a disconnect
+    cancel_on_disconnect: bool = False # Kill the job if the HTTP client goes away
+    resources: Optional[ResourceBudget] = None
+    vram_bytes: Optional[int] = None # Expected VRAM use, required in shared mode
+    refs: List[str] = [] # Host objects passed to the pickled function as positional args
+    return_ref: bool = False # Keep the result on the host and return a reference to it
+    requirements: List[str] = [] # pip requirements: run in a cached environment built from them
+    # Single flight: identical jobs share one execution. Either name the work
+    # (scoped to owner_id) or set dedupe to key it by its content
+    idempotency_key: Optional[str] = None
+    dedupe: bool = False
+    memo_ttl: Optional[float] = None # Also reuse a successful result this many seconds after it finished
 
 @app.get("/")
 def read_root():
@@ -79,63 +203,611 @@ def get_info():
     status = state.get_status()
     return {
         "gpu": gpu_info,
+        "devices": list_devices(),
         "status": status,
+        "admission": admission.snapshot() if state.mode == "shared" else None,
+        "envs": env_cache.stats(),
+        "code_cache": code_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "live": live_feed.stats(),
+        "hedging": {kind: h.stats() for kind, h in hedgers.items()},
+        "rate_limits": rate_limiter.stats(),
+        "chat_cache": chat_cache.stats(),
+        "preemption": preemption.stats(),
         "agent_version": "0.1.0",
         "connection": {
             "public_url": state.public_url,
+            "lan_urls": state.lan_urls,
+            "agent_id": AGENT_ID,
             "token": state.auth_token
         }
     }
 
-@app.post("/lock", dependencies=[Depends(verify_token)])
-def lock_gpu(req: LockRequest):
-    # Check if already locked by someone else
+@app.get("/endpoints", dependencies=[Depends(verify_token)])
+def get_endpoints():
+    """Where this agent can be reached. Cheap: clients probe it to pick the fastest route."""
+    return {"agent_id": AGENT_ID, "public_url": state.public_url, "lan_urls": state.lan_urls}
+
+@app.get("/lan/hello")
+def lan_hello(nonce: str = Query(..., min_length=16, max_length=64)):
+    """
+    Unauthenticated: a probe of a LAN address checks it's really this agent
+    before sending its key there. One proof per key this agent accepts.
+    """
+    clan.sync()
+    keys = ([AUTH_TOKEN, node_key()] if AUTH_TOKEN else []) + list(clan.key_roles)
+    return {"agent_id": AGENT_ID, "proofs": [hello_proof(k, AGENT_ID, nonce) for k in keys]}
+
+# --- LIVE DASHBOARD (server-sent events) ---
+
+# Clan nodes included in the live feed (the full list is paginated at /v2/clan/status)
+LIVE_CLAN_NODES = 50
+
+def _live_status():
     status = state.get_status()
-    if status["is_locked"] and status["owner_id"] != req.owner_id:
-        raise HTTPException(
-            status_code=503, # Service Unavailable / Busy
-            detail="Link is being used" 
-        )
+    # Ticks every second: send the start time and let the page count
+    del status["workload_duration"]
+    status["workload_start"] = state.workload_start_time.timestamp() if state.workload_start_time else None
+    return status
+
+def _live_queue():
+    return {
+        # Other worker processes' jobs too
+        "running_jobs": job_store.count("running") if WORKER_PROCESSES > 1 else len(_running_jobs),
+        "admission": admission.snapshot() if state.mode == "shared" else None,
+    }
+
+def _live_clan():
+    clan.sync()
+    return clan.get_aggregated_stats(limit=LIVE_CLAN_NODES) if clan.clan_id else None
+
+live_feed.add_section("status", _live_status)
+live_feed.add_section("queue", _live_queue)
+live_feed.add_section("clan", _live_clan)
+live_feed.add_section("connection", lambda: {"public_url": state.public_url, "token": state.auth_token})
+live_feed.add_section("gpu", get_gpu_info, interval=DEFAULT_SAMPLE_INTERVAL, blocking=True)
+
+@app.get("/events", dependencies=[Depends(verify_token)])
+async def events():
+    """
+    Dashboard updates: the full state first, then only the sections that
+    changed. EventSource can't send headers, use ?key=.
+    """
+    async def stream():
+        queue = await live_feed.subscribe()
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            live_feed.unsubscribe(queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def _key_role(token: Optional[str]) -> str:
+    """"admin" for this agent's own key, else the clan role of the key"""
+    if token is None or token == AUTH_TOKEN:
+        return "admin"
+    return clan.key_roles.get(token, "client")
 
-    success = state.lock(req.owner_id)
+@app.post("/lock")
+async def lock_gpu(req: LockRequest, token: Optional[str] = Depends(verify_token)):
+    if state.mode == "shared":
+        raise HTTPException(status_code=409, detail="GPU is in shared mode: submit jobs with vram_bytes instead of locking")
+    try:
+        allowed = preemption.allowed(req.priority, _key_role(token))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not allowed:
+        raise HTTPException(status_code=403, detail=f"This key can't lock at {req.priority!r} priority")
+
+    # Check if already locked by someone else
+    holder = state.holder()
+    if holder and holder["owner_id"] != req.owner_id:
+        if not preemption.can_preempt(holder, req.priority):
+            raise HTTPException(
+                status_code=503, # Service Unavailable / Busy
+                detail="Link is being used" 
+            )
+        # Higher priority: the holder's jobs are stopped and requeued (see Preemption)
+        stopped = await preemption.preempt(holder, req.owner_id, req.priority)
+        live_feed.notify()
+        if stopped is None:
+            raise HTTPException(status_code=503, detail="Link is being used")
+        return {"status": "locked", "owner_id": req.owner_id, "priority": req.priority,
+                "preempted": {"owner_id": holder["owner_id"], "jobs": stopped}}
+
+    success = state.lock(req.owner_id, req.priority)
+    live_feed.notify()
     if not success:
          # Should be covered above, but race condition safety
         raise HTTPException(status_code=503, detail="Link is being used")
-    return {"status": "locked", "owner_id": req.owner_id}
+    return {"status": "locked", "owner_id": req.owner_id, "priority": req.priority}
 
 @app.post("/unlock", dependencies=[Depends(verify_token)])
-def unlock_gpu(req: LockRequest):
-    success = state.unlock(req.owner_id)
+async def unlock_gpu(req: LockRequest):
+    # Preempted: giving up the lock it was waiting to get back
+    success = preemption.release(req.owner_id) or state.unlock(req.owner_id)
+    preemption.resume()
+    live_feed.notify()
     if not success:
         raise HTTPException(status_code=403, detail="Unauthorized unlock attempt")
     return {"status": "unlocked"}
 
-@app.post("/submit", dependencies=[Depends(verify_token)])
-def submit_job(req: SubmitRequest):
+def _check_job_access(owner_id: str, vram_bytes: Optional[int]):
+    if state.mode == "shared":
+        # Shared GPU: admission control instead of the lock
+        if not vram_bytes or vram_bytes <= 0:
+            raise HTTPException(status_code=400, detail="Shared mode: vram_bytes is required")
+        return
+
     # Enforce Locking
     status = state.get_status()
+    if preemption.is_waiting(owner_id):
+        raise HTTPException(status_code=409, detail="Preempted by a higher priority lock: submit again once it's given back")
     if not status["is_locked"]:
          raise HTTPException(status_code=400, detail="GPU must be locked to submit jobs")
-    
-    if status["owner_id"] != req.owner_id:
+
+    if status["owner_id"] != owner_id:
         raise HTTPException(status_code=403, detail="Unauthorized: You do not own the lock")
 
+def _check_job_id(job_id: str):
+    if not JOB_ID_RE.match(job_id):
+        raise HTTPException(status_code=400, detail="Invalid job_id")
+    if job_store.exists(job_id): # Client-chosen ids can't overwrite another job's record
+        raise HTTPException(status_code=409, detail="job_id already used")
+
+@app.post("/submit", dependencies=[Depends(admitted)])
+async def submit_job(req: SubmitRequest, request: Request):
+    rate_limiter.claim(request.state.ticket, req.owner_id)
+    with span("lock_check"):
+        _check_job_access(req.owner_id, req.vram_bytes)
+
+    if req.type == "pickle" and not req.pickle_data:
+        raise HTTPException(status_code=400, detail="Missing pickle_data")
+    if req.type != "pickle" and not req.code:
+        raise HTTPException(status_code=400, detail="Missing code")
+    try:
+        apply_limits, env = prepare_resources(req.resources)
+        normalize_requirements(req.requirements)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Record the job before running it so a disconnected client can find it again
+    job_id = req.job_id or str(uuid.uuid4())
+    if req.job_id:
+        _check_job_id(job_id)
+
+    if req.return_ref or req.refs:
+        _single_process_only("Object refs")
+    flight_key = _flight_key(req)
+    if flight_key:
+        _single_process_only("dedupe/idempotency_key")
+        if req.return_ref or req.cancel_on_disconnect:
+            raise HTTPException(status_code=400, detail="Shared jobs can't use return_ref or cancel_on_disconnect")
+        memo = single_flight.recall(flight_key, req.memo_ttl)
+        if memo is not None:
+            job_store.record_submit(job_id, req.owner_id, req.type)
+            job_store.record_result(job_id, memo)
+            return dict(memo, job_id=job_id)
+        shared = single_flight.join(flight_key)
+        if shared:
+            leader_id, leader = shared
+            result = await asyncio.shield(_follow_job(job_id, req.owner_id, req.type, leader))
+            return dict(result, job_id=job_id, shared_with=leader_id)
+
     # Execute based on Type
     if req.type == "pickle":
-        if not req.pickle_data:
-             raise HTTPException(status_code=400, detail="Missing pickle_data")
-        from gpuhost.job_manager import execute_pickle
-        return execute_pickle(req.pickle_data)
-        
+        for ref in req.refs:
+            if object_store.info(ref, req.owner_id) is None:
+                raise HTTPException(status_code=404, detail=f"Unknown or expired object: {ref}")
+        run = lambda: _in_env(req.requirements, lambda python: _run_pickle_job(req, apply_limits, env, python))
     else:
         # Default: Code
-        if not req.code:
-             raise HTTPException(status_code=400, detail="Missing code")
-        result = execute_code(req.code)
+        run = lambda: _in_env(req.requirements, lambda python: run_code(req.code, apply_limits=apply_limits, env=env, python=python))
+
+    vram_bytes = req.vram_bytes if state.mode == "shared" else None
+    job = _start_job(job_id, req.owner_id, req.type, run, vram_bytes)
+    if flight_key:
+        single_flight.start(flight_key, job_id, job, req.memo_ttl)
+
+    if not req.cancel_on_disconnect:
+        # Keep running (and get recorded) even if this request goes away
+        result = await asyncio.shield(job)
+    else:
+        watcher = asyncio.ensure_future(_cancel_on_disconnect(request, job))
+        try:
+            result = await job
+        except asyncio.CancelledError:
+            if not job.cancelled():
+                raise
+            return JSONResponse(status_code=499, content={"job_id": job_id, "status": "cancelled"})
+        finally:
+            watcher.cancel()
+
+    # Copy: the result dict may be shared with duplicate submissions
+    return dict(result, job_id=job_id)
+
+def _flight_key(req: SubmitRequest) -> Optional[str]:
+    if req.idempotency_key:
+        return f"key:{req.owner_id}:{req.idempotency_key}"
+    if req.dedupe:
+        # Everything that affects what the job computes, not who asked
+        content = req.model_dump(include={"type", "code", "pickle_data", "refs", "requirements", "resources"})
+        return "sha256:" + hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+    return None
+
+# Jobs in flight, referenced here so shielded tasks outlive their request
+_running_jobs: set = set()
+
+def _follow_job(job_id: str, owner_id: str, job_type: str, leader: asyncio.Future) -> asyncio.Future:
+    """A duplicate of a running job: recorded under its own id, result taken from the leader."""
+    async def follow():
+        result = dict(await asyncio.shield(leader))
+        job_store.record_result(job_id, result)
         return result
 
+    job_store.record_submit(job_id, owner_id, job_type)
+    job = asyncio.ensure_future(follow())
+    _running_jobs.add(job)
+    job.add_done_callback(_running_jobs.discard)
+    return job
+
+def _start_job(job_id: str, owner_id: str, job_type: str, run, vram_bytes: Optional[int]) -> asyncio.Future:
+    job_store.record_submit(job_id, owner_id, job_type, status="queued" if vram_bytes else "running")
+    job = asyncio.ensure_future(_execute_job(job_id, owner_id, run, vram_bytes))
+    _running_jobs.add(job)
+    job.add_done_callback(_running_jobs.discard)
+    job.add_done_callback(lambda _: live_feed.notify())
+    live_feed.notify()
+    return job
+
+async def _execute_job(job_id: str, owner_id: str, run, vram_bytes: Optional[int]) -> dict:
+    """
+    Admission (shared mode) and job store bookkeeping around one executor
+    call, run again after a preemption (exclusive mode).
+    """
+    started_at = None
+    admitted = False
+    preemptions, lost_seconds = 0, 0.0
+    try:
+        if vram_bytes:
+            try:
+                with span("admission"):
+                    await admission.acquire(job_id, vram_bytes)
+            except ValueError as e:
+                result = {"status": "rejected", "stdout": "", "stderr": str(e), "return_code": -1}
+                job_store.record_result(job_id, result)
+                return result
+            admitted = True
+            job_store.record_started(job_id)
+        # The owner may have been preempted before this job even started (e.g. while its env was built)
+        if preemption.is_waiting(owner_id) and not await preemption.wait_turn(owner_id):
+            result = {"status": "preempted", "stdout": "",
+                      "stderr": "Preempted, and the lock was released before it came back", "return_code": -1}
+            job_store.record_result(job_id, result)
+            return result
+        while True:
+            started_at = time.time()
+            with preemption.attempt(job_id, owner_id) as attempt:
+                result = await run()
+            if not attempt.signalled:
+                break
+            # Stopped for a higher priority lock: requeued until the owner gets it back
+            preemptions += 1
+            lost_seconds += attempt.duration
+            job_store.record_preempted(job_id, attempt.duration)
+            live_feed.notify()
+            if not await preemption.wait_turn(owner_id):
+                result = {"status": "preempted", "stdout": result.get("stdout", ""),
+                          "stderr": "Preempted, and the lock was released before it came back", "return_code": -1}
+                break
+            job_store.record_started(job_id)
+    except asyncio.CancelledError:
+        job_store.record_result(
+            job_id,
+            {"status": "cancelled", "stdout": "", "stderr": "Cancelled: client disconnected", "return_code": -1},
+            started_at
+        )
+        raise
+    finally:
+        if admitted:
+            admission.release(job_id)
+
+    if preemptions:
+        result = dict(result, preemptions=preemptions, lost_seconds=round(lost_seconds, 3))
+    job_store.record_result(job_id, result, started_at)
+    return result
+
+async def _in_env(requirements: List[str], run) -> dict:
+    """Calls run(python) with the job environment's interpreter (None: the agent's own)."""
+    if not requirements:
+        return await run(None)
+    try:
+        async with env_cache.use(requirements) as python:
+            return await run(python)
+    except EnvBuildError as e:
+        return {"status": "env_error", "stdout": "", "stderr": str(e), "return_code": -1}
+
+async def _run_pickle_job(req: SubmitRequest, apply_limits, env, python: Optional[str] = None) -> dict:
+    """Resolves object refs to files on the host and optionally keeps the result there."""
+    arg_paths = []
+    try:
+        for ref in req.refs:
+            path = object_store.acquire(ref, req.owner_id)
+            if path is None:
+                return {"status": "error", "stdout": "", "stderr": f"Object expired: {ref}", "return_code": -1}
+            arg_paths.append((ref, path))
+
+        result_path = object_store.new_path() if req.return_ref else None
+        result = await run_pickle(
+            req.pickle_data, apply_limits=apply_limits, env=env,
+            arg_paths=[p for _, p in arg_paths], result_path=result_path, python=python
+        )
+    finally:
+        for ref, _ in arg_paths:
+            object_store.unpin(ref)
+
+    if result_path:
+        if result.get("status") == "success":
+            ref = object_store.put(result.pop("result_path"), req.owner_id)
+            result["ref"] = ref
+            result["size"] = object_store.info(ref)["size"]
+        elif os.path.exists(result_path):
+            os.remove(result_path)
+    return result
+
+@app.post("/submit/stream", dependencies=[Depends(admitted)])
+async def submit_stream(req: SubmitRequest, request: Request):
+    """
+    Runs a pickled generator function, sending each item back as soon as
+    it is yielded: ITEM frames, then one END frame with the job's result
+    (see gpuhost.streams). The job is killed if the client disconnects.
+    """
+    rate_limiter.claim(request.state.ticket, req.owner_id)
+    with span("lock_check"):
+        _check_job_access(req.owner_id, req.vram_bytes)
+
+    if req.type != "pickle" or not req.pickle_data:
+        raise HTTPException(status_code=400, detail="Only pickled generator functions can stream")
+    if req.return_ref or req.dedupe or req.idempotency_key:
+        raise HTTPException(status_code=400, detail="Streamed jobs can't use return_ref or be shared")
+    if req.refs:
+        _single_process_only("Object refs")
+    try:
+        apply_limits, env = prepare_resources(req.resources)
+        normalize_requirements(req.requirements)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    job_id = req.job_id or str(uuid.uuid4())
+    if req.job_id:
+        _check_job_id(job_id)
+    for ref in req.refs:
+        if object_store.info(ref, req.owner_id) is None:
+            raise HTTPException(status_code=404, detail=f"Unknown or expired object: {ref}")
+
+    vram_bytes = req.vram_bytes if state.mode == "shared" else None
+    job_store.record_submit(job_id, req.owner_id, "stream", status="queued" if vram_bytes else "running")
+    live_feed.notify()
+    return StreamingResponse(
+        _stream_job(job_id, req, apply_limits, env, vram_bytes, request),
+        media_type=STREAM_MEDIA_TYPE,
+        headers={"X-Job-Id": job_id, "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _wait_disconnect(request: Request):
+    # The body has been read: the next message is the disconnect
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+def _end_stream(job_id: str, result: dict, started_at: Optional[float]) -> bytes:
+    # Recorded before the client sees the END frame
+    job_store.record_result(job_id, result, started_at)
+    live_feed.notify()
+    return encode_frame(END, json.dumps(result).encode())
+
+async def _stream_job(job_id: str, req: SubmitRequest, apply_limits, env, vram_bytes: Optional[int], request: Request):
+    """Frames for submit_stream, with the bookkeeping of _execute_job around stream_pickle."""
+    started_at = None
+    ended = False
+    disconnected = asyncio.ensure_future(_wait_disconnect(request))
+    try:
+        async with AsyncExitStack() as stack:
+            if vram_bytes:
+                try:
+                    await admission.acquire(job_id, vram_bytes)
+                except ValueError as e:
+                    ended = True
+                    yield _end_stream(job_id, {"status": "rejected", "stdout": "", "stderr": str(e), "return_code": -1}, None)
+                    return
+                stack.callback(admission.release, job_id)
+                job_store.record_started(job_id)
+
+            python = None
+            if req.requirements:
+                try:
+                    python = await stack.enter_async_context(env_cache.use(req.requirements))
+                except EnvBuildError as e:
+                    ended = True
+                    yield _end_stream(job_id, {"status": "env_error", "stdout": "", "stderr": str(e), "return_code": -1}, None)
+                    return
+
+            arg_paths = []
+            for ref in req.refs:
+                path = object_store.acquire(ref, req.owner_id)
+                if path is None:
+                    ended = True
+                    yield _end_stream(job_id, {"status": "error", "stdout": "", "stderr": f"Object expired: {ref}", "return_code": -1}, None)
+                    return
+                stack.callback(object_store.unpin, ref)
+                arg_paths.append(path)
+
+            started_at = time.time()
+            # Items already sent can't be taken back: a preempted stream ends there, without a grace period
+            attempt = stack.enter_context(preemption.track(job_id, req.owner_id))
+            frames = stream_pickle(req.pickle_data, apply_limits=apply_limits, env=env, arg_paths=arg_paths, python=python)
+            step = None
+            try:
+                while True:
+                    # Wait for the next item, the client leaving or a preemption, whichever comes first
+                    step = asyncio.ensure_future(frames.__anext__())
+                    await asyncio.wait({step, disconnected, attempt.stop}, return_when=asyncio.FIRST_COMPLETED)
+                    if not step.done() and attempt.stop.done():
+                        attempt.signalled = True
+                        step.cancel() # Kills the job
+                        job_store.record_preempted(job_id, attempt.duration)
+                        ended = True
+                        yield _end_stream(job_id, {"status": "preempted", "stdout": "", "return_code": -1,
+                                                   "stderr": "Preempted by a higher priority lock"}, started_at)
+                        return
+                    if not step.done():
+                        return # Client gone
+                    try:
+                        kind, payload = step.result()
+                    except Exception as e:
+                        kind, payload = END, {"status": "internal_error", "stdout": "", "stderr": str(e), "return_code": -1}
+                    if kind == END:
+                        ended = True
+                        yield _end_stream(job_id, payload, started_at)
+                        return
+                    yield encode_frame(ITEM, payload)
+            finally:
+                if step is not None and not step.done():
+                    # Cancelling the pending read runs stream_pickle's cleanup (killing
+                    # the job) in that task, so nothing needs awaiting here: the server
+                    # may be cancelling us too
+                    step.cancel()
+                else:
+                    await frames.aclose()
+    finally:
+        disconnected.cancel()
+        if not ended:
+            _end_stream(job_id, {"status": "cancelled", "stdout": "", "stderr": "Cancelled: client disconnected", "return_code": -1}, started_at)
+
+async def _cancel_on_disconnect(request: Request, job: asyncio.Future):
+    while not job.done():
+        if await request.is_disconnected():
+            job.cancel()
+            return
+        await asyncio.sleep(0.5)
+
+# Jobs are only visible to the owner that submitted them
+
+@app.get("/jobs", dependencies=[Depends(verify_token)])
+def list_jobs(
+    owner_id: str,
+    status: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    limit: int = 100
+):
+    jobs = job_store.list(owner_id=owner_id, status=status, since=since, until=until, limit=min(limit, 1000))
+    return {"jobs": jobs}
+
+@app.get("/jobs/{job_id}", dependencies=[Depends(verify_token)])
+def get_job(job_id: str, owner_id: str):
+    job = job_store.get(job_id)
+    if not job or job["owner_id"] != owner_id:
+        raise HTTPException(status_code=404, detail="Unknown job")
+
+    # Same shape as the /submit response, plus the stored record
+    job.update(job_store.read_output(job))
+    result = job_store.read_result(job)
+    if result is not None:
+        job["result"] = result.hex()
+    return job
+
+# --- OBJECT REFS ---
+
+# Someone else's objects are as good as unknown
+
+@app.get("/objects/{ref}", dependencies=[Depends(verify_token)])
+def get_object(ref: str, owner_id: str):
+    data = object_store.read(ref, owner_id)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired object")
+    return {"ref": ref, "result": data.hex()}
+
+class ReleaseRequest(BaseModel):
+    owner_id: str
+
+@app.post("/objects/{ref}/release", dependencies=[Depends(verify_token)])
+def release_object(ref: str, req: ReleaseRequest):
+    if not object_store.release(ref, req.owner_id):
+        raise HTTPException(status_code=404, detail="Unknown or expired object")
+    return {"status": "released"}
+
+# --- DAG API ---
+
+@app.post("/dag/submit", dependencies=[Depends(admitted)])
+async def submit_dag(req: DagRequest, request: Request):
+    rate_limiter.claim(request.state.ticket, req.owner_id)
+    _single_process_only("DAGs")
+    shared = state.mode == "shared"
+    for node in req.nodes:
+        _check_job_access(req.owner_id, node.vram_bytes)
+    try:
+        for node in req.nodes:
+            normalize_requirements(node.requirements)
+        run = DagRun(req.owner_id, req.nodes, req.outputs)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    apply_limits, env = prepare_resources(None)
+
+    async def run_node(node, dep_paths, result_path):
+        job = _start_job(
+            f"{run.dag_id}-{node.id}", req.owner_id, "dag",
+            lambda: _in_env(node.requirements, lambda python: run_pickle(
+                node.pickle_data, apply_limits=apply_limits, env=env,
+                arg_paths=dep_paths, result_path=result_path, python=python)),
+            node.vram_bytes if shared else None
+        )
+        return await job
+
+    dag_runs.add(run)
+    # Like /submit: finish the graph even if the client goes away
+    task = asyncio.ensure_future(run.execute(run_node, req.max_parallel))
+    _running_jobs.add(task)
+    task.add_done_callback(_running_jobs.discard)
+    await asyncio.shield(task)
+
+    response = run.summary()
+    response["results"] = {}
+    for node_id in run.outputs:
+        data = run.read_result(node_id)
+        if data is not None:
+            response["results"][node_id] = data.hex()
+    return response
+
+@app.get("/dag/{dag_id}", dependencies=[Depends(verify_token)])
+def dag_status(dag_id: str, owner_id: str):
+    run = dag_runs.get(dag_id, owner_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Unknown or expired DAG")
+    return run.summary()
+
+@app.get("/dag/{dag_id}/results/{node_id}", dependencies=[Depends(verify_token)])
+def dag_result(dag_id: str, node_id: str, owner_id: str):
+    run = dag_runs.get(dag_id, owner_id)
+    if not run or node_id not in run.status:
+        raise HTTPException(status_code=404, detail="Unknown or expired DAG node")
+    data = run.read_result(node_id)
+    if data is None:
+        raise HTTPException(status_code=409, detail=f"Node is {run.status[node_id]}")
+    return {"node_id": node_id, "result": data.hex()}
+
+@app.delete("/dag/{dag_id}", dependencies=[Depends(verify_token)])
+def dag_delete(dag_id: str, owner_id: str):
+    if not dag_runs.get(dag_id, owner_id) or not dag_runs.remove(dag_id):
+        raise HTTPException(status_code=404, detail="Unknown or expired DAG")
+    return {"status": "deleted"}
+
 # --- V2 CLAN API ---
-from gpuhost.clan import clan, Node
+from gpuhost.clan_map import ClanMap, ShardError, run_shard_locally, run_shard_on_node, post_to_node, close_async_client
+from gpuhost.hedging import hedgers
 
 @app.post("/v2/clan/create")
 def create_clan():
@@ -145,6 +817,8 @@ def create_clan():
     
     # Refresh GPU info to be sure
     gpu_info = get_gpu_info()
+    if gpu_info is None:
+        raise HTTPException(status_code=503, detail="GPU query failed, see the agent's log")
     
     host_node = Node(
         id=state.owner_id if state.owner_id else "host-node-" + secrets.token_hex(4),
@@ -155,39 +829,238 @@ def create_clan():
     )
     
     keys = clan.create_clan(host_node, state.auth_token)
+    live_feed.notify()
     return {"status": "Clan Created", "keys": keys, "host_info": host_node.model_dump()}
 
 class JoinRequest(BaseModel):
     name: str
     url: str
     hardware: dict
+    token: Optional[str] = None # Worker's node key (GET /v2/node/key), lets the host dispatch work to it
+    lan_urls: List[str] = [] # Worker's direct addresses, used instead of `url` when reachable
+    agent_id: Optional[str] = None # Worker's agent, which its LAN addresses must answer as
+
+@app.get("/v2/node/key")
+def get_node_key(token: str = Depends(verify_token)):
+    """This agent's node key, for `gpuhost clan-join` to hand to the host instead of the agent key."""
+    if token != AUTH_TOKEN:
+        raise HTTPException(status_code=403, detail="Agent key required")
+    return {"node_key": node_key()}
 
 @app.post("/v2/clan/join")
 def join_clan(req: JoinRequest, token: str = Depends(verify_token)):
     # Validate Worker Key
     if token != clan.worker_join_key:
         raise HTTPException(status_code=403, detail="Invalid Worker Join Key")
+    # The host probes these: private addresses only, nothing it shouldn't be talking to
+    if len(req.lan_urls) > MAX_LAN_URLS or not all(valid_lan_url(u) for u in req.lan_urls):
+        raise HTTPException(status_code=400, detail=f"lan_urls must be at most {MAX_LAN_URLS} http://<private IPv4>:<port> addresses")
         
     worker_node = Node(
         id="worker-" + secrets.token_hex(4),
         role="worker",
         name=req.name,
         url=req.url,
-        hardware=req.hardware
+        hardware=req.hardware,
+        token=req.token,
+        lan_urls=req.lan_urls,
+        agent_id=req.agent_id,
+        secret=secrets.token_urlsafe(32)
     )
     
     success = clan.add_worker(worker_node)
+    live_feed.notify()
     if not success:
         raise HTTPException(status_code=400, detail="Hardware Incompatible with Clan Host")
         
-    return {"status": "Joined", "node_id": worker_node.id}
+    # Only this node knows its secret: heartbeats and leaves for it need it
+    return {"status": "Joined", "node_id": worker_node.id, "node_secret": worker_node.secret}
 
 @app.get("/v2/clan/status")
-def clan_status(token: str = Depends(verify_token)):
+def clan_status(
+    request: Request,
+    offset: int = 0,
+    limit: Optional[int] = None,
+    role: Optional[str] = None,
+    status: Optional[str] = None,
+    token: str = Depends(verify_token)
+):
     # Allow Admin or Client to see status (maybe restricted view for client later)
     if token not in [clan.admin_key, clan.client_access_key]:
         raise HTTPException(status_code=403, detail="Unauthorized")
-    return clan.get_aggregated_stats()
+
+    etag, body = clan.status_page(offset=max(offset, 0), limit=limit, role=role, status=status)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+def _check_node_secret(node_id: str, node_secret: str):
+    node = clan.nodes.get(node_id)
+    if node is None:
+        raise HTTPException(status_code=404, detail="Unknown node")
+    if not node.secret or not hmac.compare_digest(node.secret, node_secret):
+        raise HTTPException(status_code=403, detail="Invalid Node Secret")
+
+class HeartbeatRequest(BaseModel):
+    node_id: str
+    node_secret: str # As returned by /v2/clan/join
+    hardware: Optional[dict] = None
+    status: str = "active"
+
+@app.post("/v2/clan/heartbeat")
+def clan_heartbeat(req: HeartbeatRequest, token: str = Depends(verify_token)):
+    if token != clan.worker_join_key:
+        raise HTTPException(status_code=403, detail="Invalid Worker Join Key")
+    _check_node_secret(req.node_id, req.node_secret)
+    live_feed.notify()
+    if not clan.heartbeat(req.node_id, req.hardware, req.status):
+        raise HTTPException(status_code=404, detail="Unknown node")
+    return {"status": "ok", "version": clan.version}
+
+class LeaveRequest(BaseModel):
+    node_id: str
+    node_secret: Optional[str] = None # Needed with the worker key, the admin key removes any node
+
+@app.post("/v2/clan/leave")
+def clan_leave(req: LeaveRequest, token: str = Depends(verify_token)):
+    if token not in [clan.worker_join_key, clan.admin_key]:
+        raise HTTPException(status_code=403, detail="Unauthorized")
+    if token != clan.admin_key:
+        _check_node_secret(req.node_id, req.node_secret or "")
+    live_feed.notify()
+    if not clan.remove_node(req.node_id):
+        raise HTTPException(status_code=404, detail="Unknown node")
+    return {"status": "Left"}
+
+class MapRequest(BaseModel):
+    pickle_data: str # Callable mapping a list of pickled items to a list of pickled results
+    items: List[str] # Each item pickled separately (hex)
+    shard_size: Optional[int] = None
+    vram_bytes: Optional[int] = None # Per shard, needed by nodes in shared mode
+
+@app.post("/v2/clan/map")
+async def clan_map(req: MapRequest, request: Request, token: str = Depends(admitted)):
+    if token not in [clan.admin_key, clan.client_access_key]:
+        raise HTTPException(status_code=403, detail="Invalid Client Key")
+
+    # Workers that joined without a key can't be sent work
+    nodes = [n for n in clan.healthy_nodes() if n.id == clan.host_id or n.token]
+    try:
+        job = ClanMap(nodes, clan.host_id, req.pickle_data, [bytes.fromhex(i) for i in req.items],
+                      req.shard_size, vram_bytes=req.vram_bytes,
+                      run_local=lambda pickle_hex, items: _run_host_shard(pickle_hex, items, req.vram_bytes))
+    except ValueError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    # Client gone: stop the shards running on every node
+    run = asyncio.ensure_future(job.run())
+    watcher = asyncio.ensure_future(_cancel_on_disconnect(request, run))
+    try:
+        results = await run
+    except ShardError as e:
+        return {"status": "error", "stderr": str(e), "nodes": job.stats}
+    except asyncio.CancelledError:
+        if not run.cancelled():
+            raise
+        return JSONResponse(status_code=499, content={"status": "cancelled"})
+    finally:
+        watcher.cancel()
+    return {"status": "success", "results": [r.hex() for r in results], "nodes": job.stats}
+
+# Owner of clan shards run here: in the job store and, while they run, of the lock
+CLAN_OWNER = "clan"
+# Shards of CLAN_OWNER running in this process (exclusive mode)
+_clan_shards = 0
+
+async def _run_host_shard(pickle_hex: str, items: List[bytes], vram_bytes: Optional[int] = None) -> List[bytes]:
+    """
+    One shard on this machine, run as a job of CLAN_OWNER. Shared mode:
+    admitted like any job. Exclusive: shards share a "batch" lock, so
+    local users can preempt them (the map requeues what's still waiting).
+    """
+    global _clan_shards
+    shared = state.mode == "shared"
+    if shared:
+        if not vram_bytes or vram_bytes <= 0:
+            raise ShardError("Shared mode: vram_bytes is required")
+    elif state.owner_id != CLAN_OWNER and not state.lock(CLAN_OWNER, "batch"):
+        raise ShardError("Host GPU is locked by a local user")
+    else:
+        _clan_shards += 1
+
+    shard = {}
+    async def run():
+        try:
+            shard["results"] = await run_shard_locally(pickle_hex, items)
+        except ShardError as e:
+            return {"status": "error", "stdout": "", "stderr": str(e), "return_code": -1}
+        return {"status": "success", "stdout": "", "stderr": "", "return_code": 0}
+
+    try:
+        result = await _start_job("shard-" + uuid.uuid4().hex, CLAN_OWNER, "shard", run, vram_bytes if shared else None)
+    finally:
+        if not shared:
+            _clan_shards -= 1
+            if not _clan_shards:
+                # Preempted shards may still be waiting for the lock: nobody's left to give it back to
+                preemption.release(CLAN_OWNER) or state.unlock(CLAN_OWNER)
+                preemption.resume()
+                live_feed.notify()
+    if result["status"] != "success":
+        raise ShardError(result.get("stderr") or result["status"])
+    return shard["results"]
+
+class ShardRequest(BaseModel):
+    pickle_data: str
+    items: List[str]
+    vram_bytes: Optional[int] = None # Needed by agents in shared mode
+
+@app.post("/v2/node/map_shard")
+async def node_map_shard(req: ShardRequest, request: Request, token: str = Depends(node_admitted)):
+    # Only the clan host holds this agent's node key
+    if token not in [AUTH_TOKEN, node_key()]:
+        raise HTTPException(status_code=403, detail="Node key required")
+    # The host drops the connection when a hedged copy won elsewhere: stop the work too
+    job = asyncio.ensure_future(_run_host_shard(req.pickle_data, [bytes.fromhex(i) for i in req.items], req.vram_bytes))
+    watcher = asyncio.ensure_future(_cancel_on_disconnect(request, job))
+    try:
+        results = await job
+    except ShardError as e:
+        return {"status": "error", "stderr": str(e)}
+    except asyncio.CancelledError:
+        if not job.cancelled():
+            raise
+        return JSONResponse(status_code=499, content={"status": "cancelled"})
+    finally:
+        watcher.cancel()
+    return {"status": "success", "results": [r.hex() for r in results]}
+
+class CallRequest(BaseModel):
+    pickle_data: str # Like MapRequest.pickle_data, called with a one-item list
+    item: str
+    hedge: bool = True # Idempotent: may run on two nodes at once
+    vram_bytes: Optional[int] = None # Needed by nodes in shared mode
+
+@app.post("/v2/clan/call")
+async def clan_call(req: CallRequest, token: str = Depends(admitted)):
+    """One remote call on whichever clan node answers first (see Hedger)."""
+    if token not in [clan.admin_key, clan.client_access_key]:
+        raise HTTPException(status_code=403, detail="Invalid Client Key")
+    nodes = [n for n in clan.healthy_nodes() if n.id == clan.host_id or n.token]
+    if not nodes:
+        raise HTTPException(status_code=503, detail="No healthy nodes in the clan")
+
+    items = [bytes.fromhex(req.item)]
+    def attempt(node):
+        if node.id == clan.host_id:
+            return lambda: _run_host_shard(req.pickle_data, items, req.vram_bytes)
+        return lambda: run_shard_on_node(node, req.pickle_data, items, req.vram_bytes)
+
+    try:
+        results = await hedgers["call"].run([(n.id, attempt(n)) for n in nodes], hedge=req.hedge)
+    except (ShardError, httpx.HTTPError, OSError) as e:
+        return {"status": "error", "stderr": str(e) or type(e).__name__}
+    return {"status": "success", "result": results[0].hex()}
 
 # --- V2 CLIENT API (Standardized) ---
 
@@ -195,21 +1068,67 @@ class ChatCompletionRequest(BaseModel):
     model: str
     messages: list
     max_tokens: Optional[int] = 100
+    temperature: Optional[float] = None
+    top_p: Optional[float] = None
+    n: Optional[int] = None
+    stop: Optional[Union[str, List[str]]] = None
+    seed: Optional[int] = None
+    presence_penalty: Optional[float] = None
+    frequency_penalty: Optional[float] = None
+    hedge: bool = False # Idempotent request: route to clan workers, hedged (see Hedger)
 
 @app.post("/v1/chat/completions")
-async def chat_completions(req: ChatCompletionRequest, token: str = Depends(verify_token)):
-    if token != clan.client_access_key and token != clan.admin_key:
+async def chat_completions(req: ChatCompletionRequest, request: Request, response: Response,
+                           token: str = Depends(node_admitted)):
+    # Clan clients, or a clan host forwarding to this worker (not the agent key: it isn't a clan client)
+    if token not in [clan.client_access_key, clan.admin_key, node_key()]:
          raise HTTPException(status_code=403, detail="Invalid Client Key")
 
+    # Deterministic requests are answered from the cache when it's on (see ChatCache)
+    cache_control = request.headers.get("cache-control", "").lower()
+    body = req.model_dump()
+    if not chat_cache.cacheable(body) or "no-store" in cache_control:
+        if chat_cache.enabled:
+            chat_cache.bypass()
+            response.headers["X-Cache"] = "BYPASS"
+        return await _complete(req, token)
+
+    result, outcome, age = await chat_cache.run(
+        chat_cache.key(body, token), lambda: _complete(req, token), refresh="no-cache" in cache_control
+    )
+    response.headers["X-Cache"] = outcome
+    if outcome == "HIT":
+        response.headers["Age"] = str(int(age))
+    return result
+
+async def _complete(req: ChatCompletionRequest, token: str) -> dict:
+    # Forwarded by a clan host (it holds our node key): answer here
+    if token == node_key():
+        return _local_chat(req)
+
     # Distributed Logic Placeholder
     # 1. Check if we have nodes
     if not clan.nodes:
         raise HTTPException(status_code=503, detail="No active GPU nodes in Clan")
 
-    # 2. Naive Scheduling: Send to Host (System A) or Worker (System B)
+    # 2. Hedged: the fastest worker answers, a slow one gets a backup
+    if req.hedge:
+        workers = [n for n in clan.healthy_nodes() if n.id != clan.host_id and n.token]
+        if workers:
+            body = req.model_dump()
+            body["hedge"] = False
+            attempt = lambda node: (lambda: post_to_node(node, "/v1/chat/completions", body))
+            try:
+                return await hedgers["chat"].run([(n.id, attempt(n)) for n in workers])
+            except (ShardError, httpx.HTTPError, OSError) as e:
+                raise HTTPException(status_code=502, detail=f"All clan workers failed: {e}")
+
+    # 3. Naive Scheduling: Send to Host (System A) or Worker (System B)
     # Real logic would check load/availability.
     # For this MVP, we just verify we CAN run it.
-    
+    return _local_chat(req)
+
+def _local_chat(req: ChatCompletionRequest) -> dict:
     return {
         "id": "chatcmpl-" + secrets.token_hex(4),
         "object": "chat.completion",
@@ -0,0 +1,161 @@
+import asyncio
+import collections
+import hashlib
+import json
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+DEFAULT_TTL = 3600.0
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Request fields that change the completion. Anything else (hedge...) only
+# changes how it's computed, so it's left out of the key
+KEY_FIELDS = (
+    "model", "messages", "max_tokens", "temperature", "top_p", "n", "stop", "seed",
+    "presence_penalty", "frequency_penalty",
+)
+
+
+def cache_key(body: Dict[str, Any], scope: str = "") -> str:
+    """Canonical hash of the completion-relevant fields (key order and whitespace don't matter)."""
+    content = {field: body.get(field) for field in KEY_FIELDS}
+    data = json.dumps([scope, content], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class ChatCache:
+    """
+    Responses to deterministic (temperature 0) chat completions, so repeated
+    prompts don't take GPU time again.
+
+    Off until enabled (`gpuhost start --chat-cache TTL`). Entries expire
+    after `ttl` seconds and are bounded by `max_bytes` of serialized
+    responses, least recently used first. Concurrent identical misses share
+    one computation. Entries are scoped to the caller's API key, unless
+    `clan_wide`: then every key on this host (the clan host answering for
+    all its workers) shares them.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_bytes: int = DEFAULT_MAX_BYTES,
+                 clan_wide: bool = False, clock: Callable[[], float] = time.time):
+        self.enabled = False
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.clan_wide = clan_wide
+        self.clock = clock
+        self._entries: "collections.OrderedDict[str, Dict[str, Any]]" = collections.OrderedDict()
+        self._bytes = 0
+        self._pending: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self.seconds_saved = 0.0
+
+    def cacheable(self, body: Dict[str, Any]) -> bool:
+        return self.enabled and body.get("temperature") == 0 and body.get("n") in (None, 1)
+
+    def key(self, body: Dict[str, Any], api_key: Optional[str]) -> str:
+        return cache_key(body, "" if self.clan_wide else (api_key or ""))
+
+    def get(self, key: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        """(response, age in seconds) if cached and fresh."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        now = self.clock()
+        if now - entry["stored_at"] >= self.ttl:
+            self._forget(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry["response"], now - entry["stored_at"]
+
+    def put(self, key: str, response: Dict[str, Any], seconds: float = 0.0):
+        """Stores a response; `seconds` is what computing it took (reported as saved on hits)."""
+        size = len(json.dumps(response))
+        if size > self.max_bytes:
+            return
+        self._forget(key)
+        self._entries[key] = {"response": response, "size": size, "stored_at": self.clock(), "seconds": seconds}
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            self._forget(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _forget(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._bytes -= entry["size"]
+
+    async def run(self, key: str, compute: Callable[[], Awaitable[Dict[str, Any]]],
+                  refresh: bool = False) -> Tuple[Dict[str, Any], str, float]:
+        """
+        (response, "HIT" or "MISS", age). Computes on a miss, or always with
+        `refresh` (storing the new response). Failures aren't cached.
+        """
+        if not refresh:
+            cached = self.get(key)
+            if cached is not None:
+                self.hits += 1
+                self.seconds_saved += self._entries[key]["seconds"]
+                return dict(cached[0]), "HIT", cached[1]
+            pending = self._pending.get(key)
+            if pending is not None:
+                # Same prompt already being answered: wait for that answer
+                try:
+                    response = await asyncio.shield(pending)
+                except asyncio.CancelledError:
+                    if not pending.cancelled():
+                        raise # We were cancelled, not the one answering
+                else:
+                    self.hits += 1
+                    return dict(response), "HIT", 0.0
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        start = time.perf_counter()
+        try:
+            response = await compute()
+        except asyncio.CancelledError:
+            future.cancel() # Whoever was waiting computes it themselves
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception() # Retrieved: nobody may be waiting
+            raise
+        else:
+            self.put(key, response, time.perf_counter() - start)
+            future.set_result(response)
+            return dict(response), "MISS", 0.0
+        finally:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+
+    def bypass(self):
+        self.bypassed += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "clan_wide": self.clan_wide,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "seconds_saved": round(self.seconds_saved, 3),
+        }
+
+
+# Global Cache Instance
+chat_cache = ChatCache()
@@ -1,7 +1,14 @@
-from pydantic import BaseModel
-from typing import List, Dict, Optional, Any
+from pydantic import BaseModel, Field
+from typing import List, Dict, Optional, Any, Tuple
+import json
+import logging
 import time
 import uuid
+import zlib
+
+from gpuhost.state_backend import StateBackend, state_backend
+
+logger = logging.getLogger("gpuhost.clan")
 
 class Node(BaseModel):
     id: str
@@ -11,23 +18,176 @@ class Node(BaseModel):
     hardware: Dict[str, Any]
     status: str = "active"
     last_heartbeat: float = 0.0
+    token: Optional[str] = Field(default=None, exclude=True) # Node's own agent key, for dispatching work
+    lan_urls: List[str] = [] # Direct addresses, preferred over `url` by the host when reachable
+    agent_id: Optional[str] = None # Node's agent, which its LAN addresses must answer as
+    secret: Optional[str] = Field(default=None, exclude=True) # Issued at join, proves heartbeats and leaves come from the node
+
+# Heartbeats only refresh the published node list (and its ETag) when a
+# node's timestamp is at least this stale, so frequent heartbeats don't
+# invalidate every dashboard's cache
+HEARTBEAT_RESOLUTION = 10.0
+# Backend keys of a shared clan (see ClanState.sync): one row for its ids and keys, one per node
+CLAN_PREFIX = "clan/"
+META_KEY = CLAN_PREFIX + "meta"
+NODE_PREFIX = CLAN_PREFIX + "node/"
 
 class ClanState:
-    def __init__(self):
+    """
+    Clan membership plus aggregates kept up to date incrementally on join,
+    leave and heartbeat. Every visible change bumps `version`; serialized
+    status pages are cached per version so unchanged polls cost nothing.
+
+    With a shared backend (several agent worker processes) the clan is
+    published there as one row per node plus one for its ids and keys,
+    each visible change rewriting only the rows it touched. Every row
+    written is stamped; sync() checks the latest stamp and loads just the
+    rows changed since, and `version` is that stamp.
+    """
+    def __init__(self, backend: Optional[StateBackend] = None):
+        self.backend = backend or state_backend
+        self._rows: Dict[str, Any] = {} # backend key -> row as last loaded/published (what CAS expects)
+        self._stamp = 0 # Latest backend change loaded
+        self._dirty: set = set() # Rows changed locally, to publish
         self.clan_id: Optional[str] = None
         self.host_id: Optional[str] = None
-        self.nodes: Dict[str, Node] = {}
+        self._nodes: Dict[str, Node] = {}
         self.admin_key: Optional[str] = None
         self.worker_join_key: Optional[str] = None
         self.client_access_key: Optional[str] = None
+        self.key_roles: Dict[str, str] = {} # key -> "admin" / "worker" / "client", for O(1) auth checks
+
+        self.version = 0
+        self.total_vram = 0
+        self._dumps: Dict[str, Dict[str, Any]] = {} # node id -> published model_dump()
+        self._page_cache: Dict[tuple, bytes] = {} # (version, query) -> serialized page
+
+    @property
+    def nodes(self) -> Dict[str, Node]:
+        return self._nodes
+
+    @nodes.setter
+    def nodes(self, nodes: Dict[str, Node]):
+        # Wholesale replacement (e.g. tests resetting state): rebuild aggregates
+        def replace():
+            self._dirty.update(NODE_PREFIX + node_id for node_id in list(self._nodes) + list(nodes))
+            self._clear_nodes()
+            for node in nodes.values():
+                self._put_node(node)
+            self._changed()
+        self._update(replace)
+
+    def _clear_nodes(self):
+        self._nodes = {}
+        self._dumps = {}
+        self.total_vram = 0
+
+    # --- Sharing between processes ---
+
+    def _row(self, key: str) -> Optional[Dict[str, Any]]:
+        if key == META_KEY:
+            return {
+                "clan_id": self.clan_id,
+                "host_id": self.host_id,
+                "admin_key": self.admin_key,
+                "worker_join_key": self.worker_join_key,
+                "client_access_key": self.client_access_key,
+                "key_roles": self.key_roles,
+            }
+        node = self._nodes.get(key[len(NODE_PREFIX):])
+        return dict(node.model_dump(), token=node.token, secret=node.secret) if node else None
+
+    def _load_row(self, key: str, row: Optional[Dict[str, Any]]):
+        self._rows[key] = row
+        if key == META_KEY:
+            for field, value in (row or {}).items():
+                setattr(self, field, value)
+        elif row is None:
+            self._drop_node(key[len(NODE_PREFIX):])
+        else:
+            self._put_node(Node(**row))
+
+    def sync(self):
+        """Pick up changes other worker processes published. A no-op with the in-memory backend."""
+        if not self.backend.shared:
+            return
+        latest = self.backend.last_stamp()
+        if latest == self._stamp:
+            return
+        for key, row, stamp in self.backend.changed_since(CLAN_PREFIX, self._stamp):
+            self._load_row(key, row)
+            latest = max(latest, stamp)
+        self._stamp = latest
+        self.version = latest
+        self._page_cache.clear()
+
+    def _reload(self):
+        """Everything from the backend again (after losing a race for a row)."""
+        self._rows = {}
+        self._stamp = 0
+        self._clear_nodes()
+        self.sync()
+
+    def _publish(self) -> bool:
+        dirty, self._dirty = self._dirty, set()
+        for key in sorted(dirty):
+            row = self._row(key)
+            if self.backend.compare_and_stamp(key, self._rows.get(key), row) is None:
+                return False
+            self._rows[key] = row
+        return True
+
+    def _update(self, mutate):
+        """
+        Runs `mutate` and publishes the rows it changed. If another process
+        changed one of them first, reloads and runs `mutate` again on top.
+        """
+        while True:
+            self.sync()
+            version = self.version
+            self._dirty.clear()
+            result = mutate()
+            if not self.backend.shared or self.version == version:
+                return result
+            if self._publish():
+                self.sync() # Our own rows, and any published meanwhile
+                return result
+            self._reload()
+
+    def _changed(self):
+        self.version += 1
+        self._page_cache.clear()
+
+    def _put_node(self, node: Node):
+        old = self._nodes.get(node.id)
+        if old:
+            self.total_vram -= old.hardware.get("memory_total", 0)
+        self._nodes[node.id] = node
+        self._dumps[node.id] = node.model_dump()
+        self.total_vram += node.hardware.get("memory_total", 0)
+
+    def _drop_node(self, node_id: str) -> Optional[Node]:
+        node = self._nodes.pop(node_id, None)
+        if node:
+            self._dumps.pop(node_id, None)
+            self.total_vram -= node.hardware.get("memory_total", 0)
+        return node
     
     def create_clan(self, host_node: Node, admin_key: str):
+        return self._update(lambda: self._create_clan(host_node, admin_key))
+
+    def _create_clan(self, host_node: Node, admin_key: str):
         self.clan_id = str(uuid.uuid4())
         self.host_id = host_node.id
-        self.nodes[host_node.id] = host_node
+        self._dirty.update((META_KEY, NODE_PREFIX + host_node.id))
+        self._put_node(host_node)
         self.admin_key = admin_key
         self.worker_join_key = str(uuid.uuid4())
         self.client_access_key = str(uuid.uuid4())
+        self.key_roles = {self.worker_join_key: "worker", self.client_access_key: "client"}
+        if admin_key:
+            self.key_roles[admin_key] = "admin"
+        self._changed()
         return {
             "clan_id": self.clan_id,
             "worker_key": self.worker_join_key,
@@ -35,19 +195,62 @@ class ClanState:
         }
 
     def add_worker(self, worker_node: Node) -> bool:
+        return self._update(lambda: self._add_worker(worker_node))
+
+    def _add_worker(self, worker_node: Node) -> bool:
         # Check Hardware Compatibility with Host
-        host = self.nodes.get(self.host_id)
+        host = self._nodes.get(self.host_id)
         if not host:
             return False # Should not happen
 
         if not self.check_compatibility(host.hardware, worker_node.hardware):
-            print(f"[FAIL] Worker {worker_node.name} rejected: Incompatible Hardware.")
+            logger.warning("Worker %s rejected: Incompatible Hardware.", worker_node.name)
+            return False
+
+        worker_node.last_heartbeat = time.time()
+        self._put_node(worker_node)
+        self._dirty.add(NODE_PREFIX + worker_node.id)
+        self._changed()
+        logger.info("Worker %s joined the Clan!", worker_node.name)
+        return True
+
+    def remove_node(self, node_id: str) -> bool:
+        return self._update(lambda: self._remove_node(node_id))
+
+    def _remove_node(self, node_id: str) -> bool:
+        if node_id == self.host_id or not self._drop_node(node_id):
             return False
+        self._dirty.add(NODE_PREFIX + node_id)
+        self._changed()
+        return True
 
-        self.nodes[worker_node.id] = worker_node
-        print(f"[OK] Worker {worker_node.name} joined the Clan!")
+    def heartbeat(self, node_id: str, hardware: Optional[Dict[str, Any]] = None, status: str = "active") -> bool:
+        return self._update(lambda: self._heartbeat(node_id, hardware, status))
+
+    def _heartbeat(self, node_id: str, hardware: Optional[Dict[str, Any]], status: str) -> bool:
+        node = self._nodes.get(node_id)
+        if not node:
+            return False
+        now = time.time()
+        published = self._dumps[node_id]["last_heartbeat"]
+        visible_change = (
+            node.status != status
+            or (hardware is not None and hardware != node.hardware)
+            or now - published >= HEARTBEAT_RESOLUTION
+        )
+        node.last_heartbeat = now
+        node.status = status
+        if hardware is not None:
+            node.hardware = hardware
+        if visible_change:
+            self._put_node(node)
+            self._dirty.add(NODE_PREFIX + node_id)
+            self._changed()
         return True
 
+    def healthy_nodes(self) -> List[Node]:
+        return [n for n in self._nodes.values() if n.status == "active"]
+
     def check_compatibility(self, host_hw: Dict, worker_hw: Dict) -> bool:
         """
         Enforce strict safety checks to prevent crashes/errors.
@@ -55,12 +258,12 @@ class ClanState:
         # 1. Architecture Check (Must match for safe tensor parallelism usually, or at least feature set)
         # For this strict implementation, we require same Arch family.
         if host_hw.get("arch") != worker_hw.get("arch"):
-            print(f"Compat Fail: Arch Mismatch ({host_hw.get('arch')} vs {worker_hw.get('arch')})")
+            logger.info("Compat Fail: Arch Mismatch (%s vs %s)", host_hw.get('arch'), worker_hw.get('arch'))
             return False
             
         # 2. CUDA Capability (Must be very close, ideally identical)
         if host_hw.get("cuda_capability") != worker_hw.get("cuda_capability"):
-             print(f"Compat Fail: CUDA Cap Mismatch")
+             logger.info("Compat Fail: CUDA Cap Mismatch")
              return False
 
         # 3. VRAM (Should be somewhat balanced, but strict equality not always required. 
@@ -74,19 +277,43 @@ class ClanState:
 
         ratio = worker_mem / host_mem
         if ratio < 0.9 or ratio > 1.1:
-             print(f"Compat Fail: VRAM Imbalance ({host_mem} vs {worker_mem})")
+             logger.info("Compat Fail: VRAM Imbalance (%s vs %s)", host_mem, worker_mem)
              return False
 
         return True
 
-    def get_aggregated_stats(self):
-        total_vram = sum(n.hardware.get("memory_total", 0) for n in self.nodes.values())
-        active_nodes = len(self.nodes)
+    def get_aggregated_stats(
+        self,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        role: Optional[str] = None,
+        status: Optional[str] = None
+    ) -> Dict[str, Any]:
+        nodes = [
+            d for d in self._dumps.values()
+            if (role is None or d["role"] == role) and (status is None or d["status"] == status)
+        ]
+        page = nodes[offset:offset + limit if limit is not None else None]
         return {
-            "total_vram": total_vram,
-            "active_nodes": active_nodes,
-            "nodes": [n.model_dump() for n in self.nodes.values()]
+            "total_vram": self.total_vram,
+            "active_nodes": len(self._nodes),
+            "version": self.version,
+            "matching_nodes": len(nodes),
+            "offset": offset,
+            "nodes": page
         }
 
+    def status_page(self, **query) -> Tuple[str, bytes]:
+        """Serialized get_aggregated_stats() and its ETag, cached until the next change."""
+        key = (self.version, tuple(sorted(query.items())))
+        body = self._page_cache.get(key)
+        if body is None:
+            body = json.dumps(self.get_aggregated_stats(**query)).encode("utf-8")
+            if len(self._page_cache) >= 256:
+                self._page_cache.clear()
+            self._page_cache[key] = body
+        etag = '"%s-%d-%08x"' % (self.clan_id, self.version, zlib.crc32(repr(key[1]).encode()))
+        return etag, body
+
 # Global State Instance
 clan = ClanState()
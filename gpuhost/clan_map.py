@@ -0,0 +1,292 @@
+import asyncio
+import io
+import os
+import pickle
+import tempfile
+import time
+import uuid
+from typing import List, Dict, Optional, Any, Callable, Awaitable, Tuple
+
+import httpx
+
+from gpuhost.clan import Node
+from gpuhost.job_manager import run_pickle
+from gpuhost.lan import node_routes
+
+# Concurrent shards per node of average capacity
+SLOTS_PER_NODE = 2
+# Aim for this many shards per slot so fast nodes can take more of them
+SHARDS_PER_SLOT = 4
+# A shard is retried on another node this many times before the map fails
+MAX_ATTEMPTS = 3
+# Consecutive failures before a node is dropped from the rest of the map
+MAX_NODE_FAILURES = 2
+SHARD_TIMEOUT = 600
+
+
+class ShardError(Exception):
+    pass
+
+
+class _ResultsUnpickler(pickle.Unpickler):
+    """Shard results are a plain list of bytes: refuse anything that needs a global."""
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(f"Unexpected global in shard result: {module}.{name}")
+
+def _load_results(data: bytes) -> List[bytes]:
+    results = _ResultsUnpickler(io.BytesIO(data)).load()
+    if not isinstance(results, list) or not all(isinstance(r, bytes) for r in results):
+        raise ShardError("Malformed shard result")
+    return results
+
+
+async def run_shard_locally(pickle_hex: str, items: List[bytes], timeout: float = SHARD_TIMEOUT) -> List[bytes]:
+    """
+    Runs one shard on this machine. `pickle_hex` is a callable taking the
+    list of pickled items and returning a list of pickled results (the
+    client's _MapShard), so the agent itself never unpickles user objects.
+    """
+    job_id = str(uuid.uuid4())
+    temp_dir = tempfile.gettempdir()
+    shard_path = os.path.join(temp_dir, f"shard_{job_id}.pkl")
+    result_path = os.path.join(temp_dir, f"shard_out_{job_id}.pkl")
+    try:
+        with open(shard_path, "wb") as f:
+            pickle.dump(items, f, protocol=4)
+        result = await run_pickle(pickle_hex, timeout, arg_paths=[shard_path], result_path=result_path)
+        if result["status"] != "success":
+            raise ShardError(result.get("stderr") or result["status"])
+        with open(result_path, "rb") as f:
+            results = _load_results(f.read())
+        if len(results) != len(items):
+            raise ShardError("Shard returned the wrong number of results")
+        return results
+    finally:
+        for p in (shard_path, result_path):
+            if os.path.exists(p):
+                try: os.remove(p)
+                except OSError: pass
+
+
+# Shared by every async call to other nodes (keep-alive pool), one per event loop
+_async_http: Optional[Tuple[asyncio.AbstractEventLoop, httpx.AsyncClient]] = None
+
+def _async_client() -> httpx.AsyncClient:
+    global _async_http
+    loop = asyncio.get_running_loop()
+    if _async_http is None or _async_http[0] is not loop:
+        _async_http = (loop, httpx.AsyncClient(timeout=SHARD_TIMEOUT))
+    return _async_http[1]
+
+async def close_async_client() -> None:
+    """Closes the shared client, if this loop made one (agent shutdown)."""
+    global _async_http
+    if _async_http is not None and _async_http[0] is asyncio.get_running_loop():
+        await _async_http[1].aclose()
+        _async_http = None
+
+async def post_to_node(node: Node, path: str, body: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    POSTs to another agent with its node key. Can be cancelled mid-request:
+    the connection is closed and the node stops the work.
+    """
+    url = await node_routes.url(node)
+    headers = {"Authorization": f"Bearer {node.token}"}
+    try:
+        res = await _async_client().post(f"{url.rstrip('/')}{path}", json=body, headers=headers)
+    except (httpx.ConnectError, httpx.ConnectTimeout):
+        if url == node.url:
+            raise
+        # Nothing was sent over the LAN route: resend through the public URL
+        node_routes.failed(node, url)
+        res = await _async_client().post(f"{node.url.rstrip('/')}{path}", json=body, headers=headers)
+    if res.status_code != 200:
+        raise ShardError(f"{node.name}: {res.status_code}: {res.text[:200]}")
+    return res.json()
+
+async def run_shard_on_node(node: Node, pickle_hex: str, items: List[bytes], vram_bytes: Optional[int] = None) -> List[bytes]:
+    data = await post_to_node(node, "/v2/node/map_shard",
+                              {"pickle_data": pickle_hex, "items": [i.hex() for i in items], "vram_bytes": vram_bytes})
+    if data["status"] != "success":
+        raise ShardError(data.get("stderr") or data["status"])
+    results = [bytes.fromhex(r) for r in data["results"]]
+    if len(results) != len(items):
+        raise ShardError("Shard returned the wrong number of results")
+    return results
+
+
+def node_capacity(node: Node) -> float:
+    return float(node.hardware.get("memory_total") or 1)
+
+
+class ClanMap:
+    """
+    Data-parallel map over the clan's healthy nodes.
+
+    Items are cut into shards and put on a shared queue. Every node gets a
+    number of worker slots proportional to its capacity (VRAM) and pulls
+    shards as it goes, so fast nodes naturally take more. A failed shard is
+    requeued for another node; a node that keeps failing is dropped. When
+    the queue runs dry, idle slots re-run shards still in flight elsewhere
+    (work stealing for stragglers) and the first result wins: the other
+    copy is cancelled, which stops it on its node. So are the shards still
+    running on a node that gets dropped, and everything when the map ends.
+    """
+
+    def __init__(
+        self,
+        nodes: List[Node],
+        host_id: Optional[str],
+        pickle_hex: str,
+        items: List[bytes],
+        shard_size: Optional[int] = None,
+        run_local: Callable[[str, List[bytes]], Awaitable[List[bytes]]] = run_shard_locally,
+        vram_bytes: Optional[int] = None,
+    ):
+        if not nodes:
+            raise ValueError("No healthy nodes in the clan")
+        self.nodes = nodes
+        self.host_id = host_id
+        self.pickle_hex = pickle_hex
+        self.items = items
+        self.run_local = run_local
+        self.vram_bytes = vram_bytes # Per shard, for worker nodes in shared mode
+
+        mean = sum(node_capacity(n) for n in nodes) / len(nodes)
+        self.slots = {n.id: max(1, round(SLOTS_PER_NODE * node_capacity(n) / mean)) for n in nodes}
+        total_slots = sum(self.slots.values())
+        if not shard_size:
+            shard_size = max(1, -(-len(items) // (total_slots * SHARDS_PER_SLOT)))
+        self.shards = [(i, items[i:i + shard_size]) for i in range(0, len(items), shard_size)]
+
+        self.results: Dict[int, List[bytes]] = {}
+        self.attempts: Dict[int, int] = {}
+        self.in_flight: Dict[int, float] = {} # shard start -> first dispatch time
+        self.copies: Dict[int, int] = {} # shard start -> copies running right now
+        self.running_on: Dict[str, set] = {n.id: set() for n in nodes}
+        self.node_failures: Dict[str, int] = {n.id: 0 for n in nodes}
+        self.stats: Dict[str, Dict[str, Any]] = {
+            n.id: {"name": n.name, "slots": self.slots[n.id], "shards": 0, "items": 0, "failures": 0, "steals": 0}
+            for n in nodes
+        }
+        self.error: Optional[str] = None
+        self._tasks: Dict[asyncio.Future, Tuple[str, int]] = {} # shard copy running -> (node id, shard start)
+        self._stopped: set = set() # Copies cancelled by the map itself (lost the race, node dropped)
+
+    def _healthy(self, node_id: str) -> bool:
+        return self.node_failures[node_id] < MAX_NODE_FAILURES
+
+    def _next_shard(self, node_id: str, queue: List[int]) -> Optional[int]:
+        while queue:
+            start = queue.pop(0)
+            if start not in self.results:
+                return start
+        # Queue drained: steal the longest-running shard that isn't already
+        # duplicated or running on this node
+        candidates = [
+            s for s, copies in self.copies.items()
+            if s not in self.results and copies == 1 and s not in self.running_on[node_id]
+        ]
+        if candidates:
+            return min(candidates, key=lambda s: self.in_flight[s])
+        return None
+
+    async def _execute(self, node: Node, shard: List[bytes]) -> List[bytes]:
+        if node.id == self.host_id:
+            return await self.run_local(self.pickle_hex, shard)
+        return await run_shard_on_node(node, self.pickle_hex, shard, self.vram_bytes)
+
+    def _stop(self, match: Callable[[str, int], bool]):
+        """Cancels the running copies whose (node id, shard start) match."""
+        for task, (node_id, start) in self._tasks.items():
+            if match(node_id, start) and not task.done():
+                self._stopped.add(task)
+                task.cancel()
+
+    async def _worker(self, node: Node, queue: List[int], done: asyncio.Event):
+        shards = dict(self.shards)
+        while not done.is_set() and self._healthy(node.id):
+            start = self._next_shard(node.id, queue)
+            if start is None:
+                if not self.copies:
+                    return
+                # Shards still running elsewhere may fail and come back
+                await asyncio.sleep(0.1)
+                continue
+            stolen = self.copies.get(start, 0) > 0
+            self.in_flight.setdefault(start, time.time())
+            self.copies[start] = self.copies.get(start, 0) + 1
+            self.running_on[node.id].add(start)
+            task = asyncio.ensure_future(self._execute(node, shards[start]))
+            self._tasks[task] = (node.id, start)
+            try:
+                results = await task
+            except asyncio.CancelledError:
+                if task not in self._stopped:
+                    raise # The map itself is over
+                # Lost to another copy, or this node was dropped: requeued unless it's running elsewhere
+                if start not in self.results and self.copies[start] == 1:
+                    self.in_flight.pop(start, None)
+                    queue.append(start)
+                continue
+            except Exception as e:
+                self.node_failures[node.id] += 1
+                self.stats[node.id]["failures"] += 1
+                self.attempts[start] = self.attempts.get(start, 0) + 1
+                if not self._healthy(node.id):
+                    self._stop(lambda node_id, _: node_id == node.id) # Dropped: don't wait on its other shards
+                if start not in self.results and self.copies[start] == 1:
+                    if self.attempts[start] >= MAX_ATTEMPTS:
+                        self.error = f"Shard at item {start} failed {MAX_ATTEMPTS} times: {e}"
+                        done.set()
+                        return
+                    self.in_flight.pop(start, None)
+                    queue.append(start)
+                continue
+            finally:
+                del self._tasks[task]
+                self._stopped.discard(task)
+                self.copies[start] -= 1
+                if not self.copies[start]:
+                    del self.copies[start]
+                self.running_on[node.id].discard(start)
+
+            self.node_failures[node.id] = 0
+            self._stop(lambda _, other: other == start) # The other copy of a stolen shard lost
+            if start not in self.results:
+                self.results[start] = results
+                self.stats[node.id]["shards"] += 1
+                self.stats[node.id]["items"] += len(results)
+                if stolen:
+                    self.stats[node.id]["steals"] += 1
+            if len(self.results) == len(self.shards):
+                done.set()
+
+    async def run(self) -> List[bytes]:
+        """Returns the pickled results in input order. Raises ShardError."""
+        queue = [start for start, _ in self.shards]
+        done = asyncio.Event()
+        workers = [
+            asyncio.ensure_future(self._worker(n, queue, done))
+            for n in self.nodes for _ in range(self.slots[n.id])
+        ]
+        waiter = asyncio.ensure_future(done.wait())
+        pending = set(workers) | {waiter}
+        try:
+            # Until every shard is in, or every worker gave up (all nodes failing)
+            while not done.is_set() and any(w in pending for w in workers):
+                _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            waiter.cancel()
+            # Shards still running anywhere (stragglers' losing copies included) are stopped
+            done.set()
+            for w in workers:
+                w.cancel()
+            for task in self._tasks:
+                task.cancel()
+
+        if self.error:
+            raise ShardError(self.error)
+        if len(self.results) != len(self.shards):
+            raise ShardError("All nodes failed before the map completed")
+        return [r for start, _ in self.shards for r in self.results[start]]
@@ -1,5 +1,4 @@
 import typer
-from gpuhost.agent import start_agent
 
 app = typer.Typer(help="gpuhost – self-hosted GPU sharing agent")
 
@@ -15,15 +14,51 @@ def main():
 @app.command()
 def start(
     tunnel: bool = typer.Option(False, "--tunnel", help="Expose agent via secure tunnel"),
-    token: str = typer.Option(None, "--token", help="Manually set API Key")
+    token: str = typer.Option(None, "--token", help="Manually set API Key"),
+    reserved_cores: str = typer.Option(None, "--reserved-cores", help="CPU cores kept for the agent, e.g. '0,1' (default: one core on 4+ core hosts, 'none' to disable)"),
+    shared: bool = typer.Option(False, "--shared", help="Pack several jobs onto the GPU by declared VRAM instead of exclusive locking"),
+    env_cache_gb: float = typer.Option(None, "--env-cache-gb", help="Disk budget for job dependency environments (default: 20)"),
+    offline: bool = typer.Option(False, "--offline", help="Build job environments from the local wheel cache only"),
+    live_rate: float = typer.Option(None, "--live-rate", help="Max dashboard pushes per second (default: 2)"),
+    simulate: str = typer.Option(None, "--simulate", help="Simulated GPUs instead of NVML: a device count or a JSON config file"),
+    rate_limit: float = typer.Option(None, "--rate-limit", help="Job/chat requests per second allowed per API key, bursts of twice that (default: 20)"),
+    max_inflight: int = typer.Option(None, "--max-inflight", help="Job/chat requests served at once before new ones queue (default: 64)"),
+    workers: int = typer.Option(1, "--workers", help="API worker processes sharing the GPU lock and clan state (object refs, DAGs and dedupe/idempotency keys are unavailable then)"),
+    trace: str = typer.Option(None, "--trace", help="Append request trace spans to this file (Chrome trace format)"),
+    chat_cache: float = typer.Option(None, "--chat-cache", help="Cache temperature-0 chat completions for this many seconds (off by default; per worker process)"),
+    chat_cache_mb: float = typer.Option(None, "--chat-cache-mb", help="Memory budget for cached chat completions (default: 64)"),
+    chat_cache_clan: bool = typer.Option(False, "--chat-cache-clan", help="Share cached chat completions between all API keys (clan-wide on the host)"),
+    preempt: bool = typer.Option(False, "--preempt", help="Let higher priority lock requests preempt the holder: its jobs are stopped and requeued"),
+    preempt_grace: float = typer.Option(None, "--preempt-grace", help="Seconds a preempted job gets to checkpoint and exit before it's killed (default: 30)"),
+    preempt_signal: str = typer.Option(None, "--preempt-signal", help="Signal sent to preempted jobs (default: SIGTERM)"),
+    preempt_client_max: str = typer.Option(None, "--preempt-client-max", help="Highest lock priority clan client keys may ask for (default: normal; the agent's own key may use interactive)"),
+    lan: bool = typer.Option(False, "--lan", help="Advertise this machine's LAN addresses so nearby clients and clan hosts skip the tunnel (plain HTTP on the LAN)")
 ):
     """Start the GPU host agent"""
-    start_agent(tunnel=tunnel, token=token)
+    # Imported here: the agent pulls in fastapi, uvicorn, NVML and ngrok,
+    # which the other commands don't need
+    from gpuhost.agent import start_agent
+
+    cores = None
+    if reserved_cores is not None:
+        cores = [] if reserved_cores == "none" else [int(c) for c in reserved_cores.split(",") if c.strip()]
+    start_agent(tunnel=tunnel, token=token, reserved_cores=cores, shared=shared,
+                env_cache_gb=env_cache_gb, offline=offline, live_rate=live_rate,
+                simulate=simulate, rate_limit=rate_limit, max_inflight=max_inflight,
+                workers=max(1, workers), trace=trace, chat_cache_ttl=chat_cache,
+                chat_cache_mb=chat_cache_mb, chat_cache_clan=chat_cache_clan, preempt=preempt,
+                preempt_grace=preempt_grace, preempt_signal=preempt_signal,
+                preempt_client_max=preempt_client_max, lan=lan)
 
-import requests
 import json
 import sys
 
+from gpuhost.lazy import lazy_import
+from gpuhost.lan import valid_lan_url
+
+# Only the clan commands talk HTTP
+requests = lazy_import("requests")
+
 @app.command(name="clan-create")
 def clan_create():
     """[Host] Initialize a Clan on this machine."""
@@ -73,11 +108,20 @@ def clan_join(host_url: str, worker_key: str):
             if not confirm: return
             local_public_url = "http://localhost:8848"
 
+        # The host gets a key that can only send this agent work, not the agent key
+        key_resp = requests.get("http://localhost:8848/v2/node/key", headers={"Authorization": f"Bearer {local_token}"})
+        if key_resp.status_code != 200:
+             print("❌ Could not get the node key. Check key/server.")
+             return
+
         # 2. Join Remote
         payload = {
             "name": local_info["gpu"]["name"] + "-Worker",
             "url": local_public_url,
-            "hardware": local_info["gpu"]
+            "hardware": local_info["gpu"],
+            "token": key_resp.json()["node_key"],
+            "lan_urls": [u for u in local_info["connection"].get("lan_urls", []) if valid_lan_url(u)],
+            "agent_id": local_info["connection"].get("agent_id")
         }
         
         print(f"Connecting to Clan Host at {host_url}...")
@@ -88,7 +132,9 @@ def clan_join(host_url: str, worker_key: str):
         )
         
         if join_resp.status_code == 200:
-            print(f"✅ Successfully joined Clan as node {join_resp.json()['node_id']}!")
+            joined = join_resp.json()
+            print(f"✅ Successfully joined Clan as node {joined['node_id']}!")
+            print(f"🔑 Node Secret (needed for heartbeats and leaving): {joined['node_secret']}")
         else:
             print(f"❌ Setup Failed: {join_resp.text}")
             
@@ -1,5 +1,2 @@
-<<<<<<< HEAD
-from .client import GPUClient
-=======
-from .client import GPUClient
->>>>>>> 4b092473e6530ba53ab90c2e3dca88d9034ff8f5
+from .client import GPUClient, ObjectRef
+from .async_client import AsyncGPUClient, AsyncObjectRef
@@ -0,0 +1,280 @@
+import asyncio
+import inspect
+import json
+import time
+from typing import Optional, Dict, Any, AsyncIterator, List
+
+from gpuhost.lazy import lazy_import
+from gpuhost.lan import probe
+from gpuhost.tracing import span
+from gpuhost.streams import FrameDecoder, ITEM, END, STREAM_CHUNK
+from gpuhost.client.client import (
+    _ClientBase, _func_name, _loads_hex, Dag, DagNodeHandle, ObjectRef,
+    RETRY_STATUSES, DEFAULT_RETRIES, DEFAULT_BACKOFF, DEFAULT_TIMEOUT
+)
+
+httpx = lazy_import("httpx")
+dill = lazy_import("dill")
+
+# Enough for hundreds of concurrent calls from one process
+DEFAULT_ASYNC_POOL_SIZE = 100
+
+class AsyncObjectRef(ObjectRef):
+    """ObjectRef for AsyncGPUClient: get() and release() are coroutines, `async with` releases it"""
+
+    async def get(self):
+        return self._value(await self.client._request("GET", f"/objects/{self.ref}", params=self._owner()))
+
+    async def release(self):
+        if self._released:
+            return
+        self._released = True
+        await self.client._request("POST", f"/objects/{self.ref}/release", json=self._owner())
+
+    close = aclose = release
+
+    def __enter__(self):
+        raise TypeError("Use 'async with' for an AsyncObjectRef")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.release()
+
+class AsyncDag(Dag):
+    """Dag for AsyncGPUClient: run() and fetch() are coroutines"""
+
+    async def run(self, *outputs: DagNodeHandle):
+        res = await self.client._request("POST", "/dag/submit", json=self._payload(outputs))
+        res.raise_for_status()
+        return self._results(res.json())
+
+    async def fetch(self, node: DagNodeHandle):
+        res = await self.client._request("GET", self._fetch_path(node), params={"owner_id": self.client.owner_id})
+        res.raise_for_status()
+        return _loads_hex(res.json()["result"])
+
+class AsyncGPUClient(_ClientBase):
+    """
+    GPUClient for asyncio code, same methods as coroutines:
+
+        async with AsyncGPUClient(url) as gpu:
+            @gpu.remote
+            def square(x):
+                return x * x
+            results = await asyncio.gather(*(square(i) for i in range(500)))
+
+    All calls share one pooled httpx client, so many concurrent calls reuse
+    a few keep-alive connections. Retries and the LAN fast path as in GPUClient.
+    """
+
+    def __init__(self, url: str, token: Optional[str] = None, vram_bytes: Optional[int] = None,
+                 session=None, retries: int = DEFAULT_RETRIES, backoff: float = DEFAULT_BACKOFF,
+                 timeout=DEFAULT_TIMEOUT, pool_size: int = DEFAULT_ASYNC_POOL_SIZE, lan: bool = False):
+        super().__init__(url, token, vram_bytes, lan)
+        self._choosing: Optional[asyncio.Future] = None
+        self.retries = retries
+        self.backoff = backoff
+        if session is None:
+            connect, read = timeout
+            session = httpx.AsyncClient(
+                timeout=httpx.Timeout(read, connect=connect),
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+            )
+        self.session = session
+
+    async def aclose(self):
+        """Close the pooled connections"""
+        await self.session.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def select_endpoint(self) -> str:
+        """Pick the fastest route to the host (see GPUClient.select_endpoint)"""
+        self.url = self.public_url
+        try:
+            if self._should_probe():
+                start = time.perf_counter()
+                res = await self.session.get(f"{self.public_url}/endpoints", headers=self.headers)
+                tunnel = time.perf_counter() - start
+                endpoints = res.json() if res.status_code == 200 else {}
+                lan_urls = endpoints.get("lan_urls") or []
+                latencies = await asyncio.gather(*(
+                    probe(self.session, u, self.token, endpoints.get("agent_id")) for u in lan_urls
+                ))
+                self._choose(lan_urls, latencies, tunnel)
+        except (httpx.HTTPError, ValueError): # Best effort: the public URL always works
+            pass
+        finally:
+            self._route_chosen = True
+        return self.url
+
+    async def _request(self, method: str, path: str, stream: bool = False, **kwargs):
+        if not self._route_chosen:
+            # Concurrent first calls share one probe
+            if self._choosing is None:
+                self._choosing = asyncio.ensure_future(self.select_endpoint())
+            await asyncio.shield(self._choosing)
+        if self.url == self.public_url:
+            return await self._send(method, path, self.retries, stream, **kwargs)
+        try:
+            # No retries on the LAN route: a failure falls back to the tunnel right away
+            return await self._send(method, path, 0, stream, **kwargs)
+        except (httpx.ConnectError, httpx.ConnectTimeout):
+            self.url = self.public_url
+            return await self._send(method, path, self.retries, stream, **kwargs)
+
+    async def _send(self, method: str, path: str, retries: int, stream: bool = False, **kwargs):
+        for attempt in range(retries + 1):
+            try:
+                request = self.session.build_request(method, f"{self.url}{path}", headers=self._trace_headers(), **kwargs)
+                res = await self.session.send(request, stream=stream)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                # Nothing was sent: safe to retry any method
+                if attempt == retries:
+                    raise
+            else:
+                if method != "GET" or res.status_code not in RETRY_STATUSES or attempt == retries:
+                    return res
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def get_info(self) -> Dict[str, Any]:
+        """Fetch GPU status"""
+        res = await self._request("GET", "/info")
+        if res.status_code == 403:
+            raise PermissionError("Invalid API Key")
+        res.raise_for_status()
+        return res.json()
+
+    async def lock(self, priority: str = "normal") -> bool:
+        """Attempt to lock the GPU (`priority` as in GPUClient.lock)"""
+        res = await self._request("POST", "/lock", json={"owner_id": self.owner_id, "priority": priority})
+        if res.status_code == 503:
+            print("❌ Link is being used (GPU is busy).")
+            return False
+        try:
+            res.raise_for_status()
+            return True
+        except httpx.HTTPStatusError as e:
+            print(f"Lock failed: {e}")
+            return False
+
+    async def unlock(self) -> bool:
+        """Unlock the GPU"""
+        try:
+            res = await self._request("POST", "/unlock", json={"owner_id": self.owner_id})
+            res.raise_for_status()
+            return True
+        except Exception as e:
+            print(f"Unlock failed: {e}")
+            return False
+
+    async def submit_job(self, code: str, dedupe: bool = False, memo_ttl: Optional[float] = None,
+                         idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        """Submit python code for execution (see GPUClient.submit_job)"""
+        res = await self._request("POST", "/submit", json=self._job_payload(code, dedupe, memo_ttl, idempotency_key))
+        res.raise_for_status()
+        return res.json()
+
+    async def get_job(self, job_id: Optional[str] = None) -> Dict[str, Any]:
+        """Fetch a job's record and output, defaults to the last submitted job"""
+        res = await self._request("GET", f"/jobs/{self._job_id(job_id)}", params={"owner_id": self.owner_id})
+        res.raise_for_status()
+        return res.json()
+
+    async def list_jobs(self, status: Optional[str] = None, since: Optional[float] = None,
+                        until: Optional[float] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """List this client's jobs, newest first"""
+        res = await self._request("GET", "/jobs", params=self._jobs_params(status, since, until, limit))
+        res.raise_for_status()
+        return res.json()["jobs"]
+
+    async def fetch_result(self, job_id: Optional[str] = None):
+        """Deserialize the stored result of a finished remote() call"""
+        return self._stored_result(await self.get_job(job_id))
+
+    async def run_file(self, file_path: str, **kwargs) -> Dict[str, Any]:
+        """Read and submit a local python file (kwargs as in submit_job)"""
+        with open(file_path, "r") as f:
+            code = f.read()
+        return await self.submit_job(code, **kwargs)
+
+    async def _clan_call(self, job_func) -> Any:
+        res = await self._request("POST", "/v2/clan/call", json=self._call_payload(job_func))
+        res.raise_for_status()
+        return self._call_result(res.json())
+
+    async def map(self, func, items, shard_size: Optional[int] = None) -> List[Any]:
+        """Data-parallel map over every node of a clan (see GPUClient.map)"""
+        res = await self._request("POST", "/v2/clan/map", json=self._map_payload(func, items, shard_size))
+        res.raise_for_status()
+        return self._map_results(res.json())
+
+    def dag(self, max_parallel: int = 4) -> AsyncDag:
+        """Start building a graph of remote functions (see Dag)"""
+        return AsyncDag(self, max_parallel)
+
+    async def _stream(self, payload: Dict[str, Any]) -> AsyncIterator[Any]:
+        res = await self._request("POST", "/submit/stream", stream=True, json=payload)
+        try:
+            res.raise_for_status()
+            decoder = FrameDecoder()
+            async for chunk in res.aiter_bytes(STREAM_CHUNK):
+                for kind, data in decoder.feed(chunk):
+                    if kind == ITEM:
+                        yield dill.loads(data)
+                    elif kind == END:
+                        self._stream_end(json.loads(data))
+                        return
+            raise ConnectionError("Stream ended before the remote function finished")
+        finally:
+            # Early exit: dropping the connection stops the job on the host
+            await res.aclose()
+
+    def remote(self, func=None, *, return_ref: bool = False, requirements: Optional[List[str]] = None,
+               dedupe: bool = False, memo_ttl: Optional[float] = None, hedge: bool = False,
+               stream: Optional[bool] = None):
+        """
+        As GPUClient.remote, but calling the decorated function returns a
+        coroutine (and return_ref=True gives an AsyncObjectRef). Streamed
+        functions return an async iterator: `async for item in gen(...)`.
+        """
+        if func is None:
+            return lambda f: self.remote(f, return_ref=return_ref, requirements=requirements,
+                                         dedupe=dedupe, memo_ttl=memo_ttl, hedge=hedge, stream=stream)
+
+        if hedge:
+            self._check_hedgeable(requirements, dedupe, memo_ttl)
+        if stream is None:
+            stream = inspect.isgeneratorfunction(func)
+        if stream:
+            self._check_streamable(return_ref, dedupe, memo_ttl, hedge)
+
+            async def stream_wrapper(*args, **kwargs):
+                job_func, refs = self._prepare_remote(func, args, kwargs, False, False)
+                async for item in self._stream(self._remote_payload(job_func, refs, False, requirements, False, None)):
+                    yield item
+
+            return stream_wrapper
+
+        async def wrapper(*args, **kwargs):
+            with span("remote", function=_func_name(func)):
+                job_func, refs = self._prepare_remote(func, args, kwargs, return_ref, hedge)
+                if hedge:
+                    return await self._clan_call(job_func)
+
+                with span("serialize"):
+                    payload = self._remote_payload(job_func, refs, return_ref, requirements, dedupe, memo_ttl)
+                with span("request") as s:
+                    res = await self._request("POST", "/submit", json=payload)
+                    s.attrs["server_timing"] = res.headers.get("Server-Timing")
+                res.raise_for_status()
+                with span("deserialize"):
+                    return self._remote_result(res.json(), return_ref, AsyncObjectRef)
+
+        return wrapper
@@ -1,172 +1,482 @@
-<<<<<<< HEAD
-import requests
+import inspect
+import json
 import uuid
 import time
-import dill
-from typing import Optional, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Iterator, List
 from urllib.parse import urlparse, parse_qs
 
-class GPUClient:
-    def __init__(self, url: str, token: Optional[str] = None):
-        # Robust URL parsing to handle "Free-link" copy-hasting
-        parsed = urlparse(url)
-        
-        # 1. Extract token from URL if not explicitly provided
-        if not token and parsed.query:
-            qs = parse_qs(parsed.query)
-            if "key" in qs:
-                token = qs["key"][0]
-
-        # 2. Clean Base URL (remove query params and trailing slash)
-        # Reconstruct: scheme://netloc/path
-        clean_url = f"{parsed.scheme}://{parsed.netloc}{parsed.path}"
-        self.url = clean_url.rstrip("/")
-        
-        if not token:
-            raise ValueError("API Token is required (either passed as arg or in URL ?key=)")
-            
-        self.token = token
-        self.owner_id = str(uuid.uuid4())
-        self.headers = {"Authorization": f"Bearer {token}"}
-        
-    def get_info(self) -> Dict[str, Any]:
-        """Fetch GPU status"""
-        res = requests.get(f"{self.url}/info", headers=self.headers)
-        if res.status_code == 403:
-            raise PermissionError("Invalid API Key")
-        res.raise_for_status()
-        return res.json()
+from gpuhost.lazy import lazy_import
+from gpuhost.lan import is_local_url, new_nonce, verify_hello, PROBE_TIMEOUT
+from gpuhost.tracing import span, current_traceparent
+from gpuhost.streams import FrameDecoder, ITEM, END, STREAM_CHUNK
 
-    def lock(self) -> bool:
-        """Attempt to lock the GPU"""
-        try:
-            res = requests.post(
-                f"{self.url}/lock", 
-                json={"owner_id": self.owner_id},
-                headers=self.headers
-            )
-            if res.status_code == 503:
-                print("❌ Link is being used (GPU is busy).")
-                return False
-            res.raise_for_status()
-            return True
-        except requests.exceptions.HTTPError as e:
-            print(f"Lock failed: {e}")
-            return False
+# Loaded on first use: importing the client stays cheap for short scripts
+requests = lazy_import("requests")
+dill = lazy_import("dill")
 
-    def unlock(self) -> bool:
-        """Unlock the GPU"""
-        try:
-            res = requests.post(
-                f"{self.url}/unlock", 
-                json={"owner_id": self.owner_id},
-                headers=self.headers
-            )
-            res.raise_for_status()
-            return True
-        except Exception as e:
-            print(f"Unlock failed: {e}")
-            return False
+# Retried with backoff (GETs only: a POST may have reached the host). Connection
+# failures are retried for every method, nothing was sent yet.
+RETRY_STATUSES = (502, 504)
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+# (connect, read) seconds. No read timeout by default: jobs can run for hours
+DEFAULT_TIMEOUT = (10.0, None)
+DEFAULT_POOL_SIZE = 10
+# Connect timeout on a LAN address: failing fast matters more there, the tunnel is the fallback
+LAN_CONNECT_TIMEOUT = 1.0
+
+def _new_session(retries: int, backoff: float, timeout, pool_size: int):
+    """
+    A keep-alive session: one TCP/TLS handshake per pooled connection
+    instead of one per call (expensive through a tunnel).
+    """
+    session = requests.Session()
+    retry = requests.adapters.Retry(
+        total=retries, backoff_factor=backoff, status_forcelist=RETRY_STATUSES, raise_on_status=False
+    )
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # Default timeout for every call (requests has no session-wide setting)
+    request = session.request
+    def request_with_timeout(method, url, **kwargs):
+        kwargs.setdefault("timeout", timeout)
+        return request(method, url, **kwargs)
+    session.request = request_with_timeout
+    return session
+
+def _parse_url(url: str, token: Optional[str]):
+    """(base url, token) from a share link like https://host/?key=..."""
+    # Robust URL parsing to handle "Free-link" copy-hasting
+    parsed = urlparse(url)
+
+    # 1. Extract token from URL if not explicitly provided
+    if not token and parsed.query:
+        qs = parse_qs(parsed.query)
+        if "key" in qs:
+            token = qs["key"][0]
+
+    # 2. Clean Base URL (remove query params and trailing slash)
+    # Reconstruct: scheme://netloc/path
+    clean_url = f"{parsed.scheme}://{parsed.netloc}{parsed.path}"
+
+    if not token:
+        raise ValueError("API Token is required (either passed as arg or in URL ?key=)")
+    return clean_url.rstrip("/"), token
+
+def _loads_hex(data: str):
+    return dill.loads(bytes.fromhex(data))
+
+def _func_name(func) -> str:
+    return getattr(func, "__qualname__", None) or repr(func)
+
+def _probe(url: str, token: str, agent_id: Optional[str]) -> Optional[float]:
+    """Round trip to a LAN address in seconds, None if it doesn't prove it's the same agent (no key sent)"""
+    nonce = new_nonce()
+    start = time.perf_counter()
+    try:
+        res = requests.get(f"{url}/lan/hello", params={"nonce": nonce}, timeout=PROBE_TIMEOUT)
+        if res.status_code != 200 or not verify_hello(res.json(), token, nonce, agent_id):
+            return None
+    except (requests.exceptions.RequestException, ValueError):
+        return None
+    return time.perf_counter() - start
+
+def _never_sent(e: Exception) -> bool:
+    """The connection failed before the request went out: safe to resend, even a POST"""
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(e.args[0], "reason", None) if e.args else None
+    return type(reason).__name__ in ("NewConnectionError", "ConnectTimeoutError")
+
+class _Dep:
+    """Placeholder for a host-side value (DAG result or object ref) in an argument list"""
 
-    def submit_job(self, code: str) -> Dict[str, Any]:
-        """Submit python code for execution"""
-        res = requests.post(
-            f"{self.url}/submit",
-            json={"owner_id": self.owner_id, "code": code},
-            headers=self.headers
-        )
+class _BoundCall:
+    """
+    Callable sent to the host: the runner passes host-side values (DAG
+    dependency results, object refs) positionally and they are slotted back
+    in where the placeholders were, positional args first, then kwargs.
+    """
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __call__(self, *host_values):
+        values = iter(host_values)
+        args = [next(values) if isinstance(a, _Dep) else a for a in self.args]
+        kwargs = {k: next(values) if isinstance(v, _Dep) else v for k, v in self.kwargs.items()}
+        return self.func(*args, **kwargs)
+
+def _bind(func, args, kwargs, is_host_value):
+    """Returns (callable, host values in the order the runner will pass them)"""
+    host_values = [a for a in args if is_host_value(a)] + [v for v in kwargs.values() if is_host_value(v)]
+    call = _BoundCall(
+        func,
+        [_Dep() if is_host_value(a) else a for a in args],
+        {k: _Dep() if is_host_value(v) else v for k, v in kwargs.items()}
+    )
+    return call, host_values
+
+class _MapShard:
+    """Shard callable for GPUClient.map: pickled items in, pickled results out"""
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, items):
+        return [dill.dumps(self.func(dill.loads(item))) for item in items]
+
+class ObjectRef:
+    """
+    Handle to a result kept on the host (see GPUClient.remote(return_ref=True)).
+    Pass it to another remote call to use the value host-side without any
+    transfer; call get() to download it. Only the client that made it can
+    use it. The host copy is freed by release() (or at the end of a `with`
+    block), or after the host's TTL if it's never released.
+    """
+    def __init__(self, client: "GPUClient", ref: str, size: int = 0):
+        self.client = client
+        self.ref = ref
+        self.size = size
+        self._released = False
+
+    def get(self):
+        return self._value(self.client._request("GET", f"/objects/{self.ref}", params=self._owner()))
+
+    def _owner(self) -> Dict[str, str]:
+        return {"owner_id": self.client.owner_id}
+
+    def _value(self, res):
+        if res.status_code == 404:
+            raise KeyError(f"Object {self.ref} expired on the host")
         res.raise_for_status()
-        return res.json()
-    
-    def run_file(self, file_path: str) -> Dict[str, Any]:
-        """Read and submit a local python file"""
-        with open(file_path, "r") as f:
-            code = f.read()
-        return self.submit_job(code)
+        return _loads_hex(res.json()["result"])
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self.client._request("POST", f"/objects/{self.ref}/release", json=self._owner())
+
+    close = release
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def __repr__(self):
+        return f"<ObjectRef {self.ref} ({self.size} bytes)>"
 
-    def remote(self, func):
+class DagNodeHandle:
+    def __init__(self, node_id: str):
+        self.id = node_id
+
+    def __repr__(self):
+        return f"<DagNode {self.id}>"
+
+class Dag:
+    """
+    A graph of remote functions whose edges are results.
+
+        g = client.dag()
+        docs = g.add(preprocess, raw_path)
+        emb = g.add(embed, docs)
+        idx = g.add(build_index, emb)
+        index = g.run(idx)   # docs/emb never leave the host
+
+    Independent nodes run concurrently on the host; only the requested
+    outputs are downloaded. Intermediates can be fetched later with fetch().
+    """
+    def __init__(self, client: "GPUClient", max_parallel: int = 4):
+        self.client = client
+        self.max_parallel = max_parallel
+        self.nodes: List[Dict[str, Any]] = []
+        self.dag_id: Optional[str] = None
+
+    def add(self, func, *args, vram_bytes: Optional[int] = None, **kwargs) -> DagNodeHandle:
+        """Add a node. DagNodeHandle args are replaced by that node's result on the host."""
+        handle = DagNodeHandle(f"n{len(self.nodes)}")
+        call, deps = _bind(func, args, kwargs, lambda a: isinstance(a, DagNodeHandle))
+        self.nodes.append({
+            "id": handle.id,
+            "pickle_data": dill.dumps(call).hex(),
+            "deps": [d.id for d in deps],
+            "vram_bytes": vram_bytes or self.client.vram_bytes
+        })
+        return handle
+
+    def run(self, *outputs: DagNodeHandle):
         """
-        Decorator to execute a function on the remote GPU.
-        The function and its closure are serialized and sent to the host.
-        Returns the result of the function execution.
+        Submit the graph and wait for it. Returns the result of each output
+        (a single value for one output, a tuple otherwise). Defaults to the
+        nodes nothing depends on.
         """
-        def wrapper(*args, **kwargs):
-            # Serialize the function execution (closure + args)
-            if args or kwargs:
-                job_func = lambda: func(*args, **kwargs)
-            else:
-                job_func = func
-            
-            # Pickle
-            pickle_hex = dill.dumps(job_func).hex()
-            
-            # Submit
-            res = requests.post(
-                f"{self.url}/submit",
-                json={
-                    "owner_id": self.owner_id, 
-                    "type": "pickle", 
-                    "pickle_data": pickle_hex
-                },
-                headers=self.headers
-            )
-            res.raise_for_status()
-            data = res.json()
-            
-            if data["status"] == "success":
-                # Deserialize Result
-                return dill.loads(bytes.fromhex(data["result"]))
-            else:
-                raise RuntimeError(f"Remote execution failed:\n{data['stderr']}")
-                
-        return wrapper
-=======
-import requests
-import uuid
-import time
-import dill
-from typing import Optional, Dict, Any
-from urllib.parse import urlparse, parse_qs
+        res = self.client._request("POST", "/dag/submit", json=self._payload(outputs))
+        res.raise_for_status()
+        return self._results(res.json())
 
-class GPUClient:
-    def __init__(self, url: str, token: Optional[str] = None):
-        # Robust URL parsing to handle "Free-link" copy-hasting
-        parsed = urlparse(url)
-        
-        # 1. Extract token from URL if not explicitly provided
-        if not token and parsed.query:
-            qs = parse_qs(parsed.query)
-            if "key" in qs:
-                token = qs["key"][0]
-
-        # 2. Clean Base URL (remove query params and trailing slash)
-        # Reconstruct: scheme://netloc/path
-        clean_url = f"{parsed.scheme}://{parsed.netloc}{parsed.path}"
-        self.url = clean_url.rstrip("/")
-        
-        if not token:
-            raise ValueError("API Token is required (either passed as arg or in URL ?key=)")
-            
-        self.token = token
+    def _payload(self, outputs) -> Dict[str, Any]:
+        return {
+            "owner_id": self.client.owner_id,
+            "nodes": self.nodes,
+            "outputs": [o.id for o in outputs] if outputs else None,
+            "max_parallel": self.max_parallel
+        }
+
+    def _results(self, data: Dict[str, Any]):
+        self.dag_id = data["dag_id"]
+
+        if data["errors"]:
+            failed = "\n".join(f"[{n}] {err}" for n, err in data["errors"].items())
+            raise RuntimeError(f"Remote DAG failed:\n{failed}")
+
+        values = tuple(_loads_hex(data["results"][o]) for o in data["outputs"])
+        return values[0] if len(values) == 1 else values
+
+    def fetch(self, node: DagNodeHandle):
+        """Download an intermediate result kept on the host after run()"""
+        res = self.client._request("GET", self._fetch_path(node), params={"owner_id": self.client.owner_id})
+        res.raise_for_status()
+        return _loads_hex(res.json()["result"])
+
+    def _fetch_path(self, node: DagNodeHandle) -> str:
+        if not self.dag_id:
+            raise RuntimeError("DAG has not been run yet")
+        return f"/dag/{self.dag_id}/results/{node.id}"
+
+class _ClientBase:
+    """Everything but the I/O, shared by GPUClient and AsyncGPUClient"""
+
+    def __init__(self, url: str, token: Optional[str] = None, vram_bytes: Optional[int] = None, lan: bool = False):
+        self.url, self.token = _parse_url(url, token)
+        # `url` is switched to a LAN address of the host when one is faster (see select_endpoint)
+        self.public_url = self.url
+        self.lan = lan
+        self._route_chosen = False
         self.owner_id = str(uuid.uuid4())
-        self.headers = {"Authorization": f"Bearer {token}"}
-        
+        self.headers = {"Authorization": f"Bearer {self.token}"}
+        self.last_job_id: Optional[str] = None
+        # Declared VRAM per job, required when the host runs in shared mode
+        self.vram_bytes = vram_bytes
+
+    def _should_probe(self) -> bool:
+        return self.lan and not is_local_url(self.public_url)
+
+    def _choose(self, lan_urls: List[str], latencies: List[Optional[float]], tunnel: float):
+        reachable = [(latency, url) for url, latency in zip(lan_urls, latencies) if latency is not None]
+        if reachable and min(reachable)[0] < tunnel:
+            self.url = min(reachable)[1]
+
+    def _job_payload(self, code: str, dedupe: bool, memo_ttl: Optional[float], idempotency_key: Optional[str]) -> Dict[str, Any]:
+        self.last_job_id = str(uuid.uuid4())
+        return {
+            "owner_id": self.owner_id, "code": code, "job_id": self.last_job_id, "vram_bytes": self.vram_bytes,
+            "dedupe": dedupe, "memo_ttl": memo_ttl, "idempotency_key": idempotency_key
+        }
+
+    def _jobs_params(self, status, since, until, limit) -> Dict[str, Any]:
+        params = {"owner_id": self.owner_id, "limit": limit}
+        if status: params["status"] = status
+        if since is not None: params["since"] = since
+        if until is not None: params["until"] = until
+        return params
+
+    def _job_id(self, job_id: Optional[str]) -> str:
+        job_id = job_id or self.last_job_id
+        if not job_id:
+            raise ValueError("No job_id given and no job submitted yet")
+        return job_id
+
+    @staticmethod
+    def _stored_result(data: Dict[str, Any]):
+        if data["status"] in ("queued", "running"):
+            raise RuntimeError(f"Job is still {data['status']}")
+        if data["status"] != "success" or "result" not in data:
+            raise RuntimeError(f"Remote execution failed:\n{data['stderr']}")
+        return _loads_hex(data["result"])
+
+    def _call_payload(self, job_func) -> Dict[str, Any]:
+        return {
+            "pickle_data": dill.dumps(_MapShard(lambda _: job_func())).hex(),
+            "item": dill.dumps(None).hex(),
+            "vram_bytes": self.vram_bytes
+        }
+
+    @staticmethod
+    def _call_result(data: Dict[str, Any]):
+        if data["status"] != "success":
+            raise RuntimeError(f"Remote execution failed:\n{data['stderr']}")
+        return _loads_hex(data["result"])
+
+    @staticmethod
+    def _map_payload(func, items, shard_size: Optional[int]) -> Dict[str, Any]:
+        return {
+            "pickle_data": dill.dumps(_MapShard(func)).hex(),
+            "items": [dill.dumps(item).hex() for item in items],
+            "shard_size": shard_size
+        }
+
+    @staticmethod
+    def _map_results(data: Dict[str, Any]) -> List[Any]:
+        if data["status"] != "success":
+            raise RuntimeError(f"Clan map failed:\n{data['stderr']}")
+        return [_loads_hex(r) for r in data["results"]]
+
+    def _prepare_remote(self, func, args, kwargs, return_ref: bool, hedge: bool):
+        """(job callable, ObjectRefs it uses)"""
+        # Serialize the function execution (closure + args)
+        is_ref = lambda a: isinstance(a, ObjectRef)
+        refs = []
+        if any(map(is_ref, args)) or any(map(is_ref, kwargs.values())):
+            job_func, refs = _bind(func, args, kwargs, is_ref)
+        elif args or kwargs:
+            job_func = lambda: func(*args, **kwargs)
+        else:
+            job_func = func
+        if hedge and (refs or return_ref):
+            raise ValueError("Hedged calls can't use ObjectRefs: they live on one host")
+        return job_func, refs
+
+    def _remote_payload(self, job_func, refs, return_ref: bool, requirements: Optional[List[str]],
+                        dedupe: bool, memo_ttl: Optional[float]) -> Dict[str, Any]:
+        self.last_job_id = str(uuid.uuid4())
+        return {
+            "owner_id": self.owner_id,
+            "type": "pickle",
+            "pickle_data": dill.dumps(job_func).hex(),
+            "job_id": self.last_job_id,
+            "vram_bytes": self.vram_bytes,
+            "refs": [r.ref for r in refs],
+            "return_ref": return_ref,
+            "requirements": requirements or [],
+            "dedupe": dedupe,
+            "memo_ttl": memo_ttl
+        }
+
+    @staticmethod
+    def _check_hedgeable(requirements: Optional[List[str]], dedupe: bool, memo_ttl: Optional[float]):
+        # Shards run in the node's own python, outside the job store
+        if requirements or dedupe or memo_ttl:
+            raise ValueError("Hedged calls can't use requirements, dedupe or memo_ttl")
+
+    @staticmethod
+    def _check_streamable(return_ref: bool, dedupe: bool, memo_ttl: Optional[float], hedge: bool):
+        if return_ref or dedupe or memo_ttl or hedge:
+            raise ValueError("Streamed calls can't use return_ref, dedupe, memo_ttl or hedge")
+
+    @staticmethod
+    def _stream_end(data: Dict[str, Any]):
+        if data["status"] != "success":
+            raise RuntimeError(f"Remote execution failed:\n{data['stderr']}")
+
+    def _trace_headers(self) -> Dict[str, str]:
+        """Auth headers, plus a traceparent when called inside a span (the host's spans join the trace)."""
+        traceparent = current_traceparent()
+        return dict(self.headers, traceparent=traceparent) if traceparent else self.headers
+
+    def _remote_result(self, data: Dict[str, Any], return_ref: bool, ref_class):
+        if data["status"] == "success":
+            if return_ref:
+                return ref_class(self, data["ref"], data.get("size", 0))
+            # Deserialize Result
+            return _loads_hex(data["result"])
+        else:
+            raise RuntimeError(f"Remote execution failed:\n{data['stderr']}")
+
+
+class GPUClient(_ClientBase):
+    """
+    Client for a gpuhost agent. Calls share a pooled keep-alive session;
+    failed connections (and 502/504 on reads) are retried with exponential
+    backoff. Pass `session` to use your own (anything with requests' get/post).
+
+    With lan=True, on the host's network calls go straight to its LAN
+    address instead of through the tunnel, falling back to the tunnel if it
+    stops answering. Opt-in: the LAN route is plain HTTP, so jobs, results
+    and the key travel unencrypted there (the address has to prove it's the
+    same agent before the key is sent; the host advertises it with --lan).
+    """
+
+    def __init__(self, url: str, token: Optional[str] = None, vram_bytes: Optional[int] = None,
+                 session=None, retries: int = DEFAULT_RETRIES, backoff: float = DEFAULT_BACKOFF,
+                 timeout=DEFAULT_TIMEOUT, pool_size: int = DEFAULT_POOL_SIZE, lan: bool = False):
+        super().__init__(url, token, vram_bytes, lan)
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.session = session if session is not None else _new_session(retries, backoff, timeout, pool_size)
+
+    def select_endpoint(self) -> str:
+        """
+        Pick the fastest route to the host: one of the LAN addresses it
+        advertises, if reachable from here, else the public URL. Runs once
+        before the first call; call again after moving networks.
+        """
+        self.url = self.public_url
+        self._route_chosen = True
+        if not self._should_probe():
+            return self.url
+        try:
+            start = time.perf_counter()
+            res = self.session.get(f"{self.public_url}/endpoints", headers=self.headers)
+            tunnel = time.perf_counter() - start
+            endpoints = res.json() if res.status_code == 200 else {}
+        except Exception: # Best effort: the public URL always works
+            return self.url
+        lan_urls = endpoints.get("lan_urls") or []
+        if lan_urls:
+            with ThreadPoolExecutor(len(lan_urls)) as pool:
+                latencies = list(pool.map(lambda u: _probe(u, self.token, endpoints.get("agent_id")), lan_urls))
+            self._choose(lan_urls, latencies, tunnel)
+        if self.url != self.public_url and hasattr(self.session, "mount"):
+            # No retries on the LAN route: a failure falls back to the tunnel right away
+            self.session.mount(self.url, requests.adapters.HTTPAdapter(pool_maxsize=self.pool_size, max_retries=0))
+        return self.url
+
+    def _request(self, method: str, path: str, **kwargs):
+        if not self._route_chosen:
+            self.select_endpoint()
+        if self.url == self.public_url:
+            return self.session.request(method, f"{self.url}{path}", headers=self._trace_headers(), **kwargs)
+        try:
+            return self.session.request(method, f"{self.url}{path}", headers=self._trace_headers(),
+                                        timeout=(LAN_CONNECT_TIMEOUT, self.timeout[1]), **kwargs)
+        except requests.exceptions.ConnectionError as e:
+            if method != "GET" and not _never_sent(e):
+                raise
+            # Left the host's network (or it moved): back to the tunnel
+            self.url = self.public_url
+            return self.session.request(method, f"{self.url}{path}", headers=self._trace_headers(), **kwargs)
+
+    def close(self):
+        """Close the pooled connections"""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
     def get_info(self) -> Dict[str, Any]:
         """Fetch GPU status"""
-        res = requests.get(f"{self.url}/info", headers=self.headers)
+        res = self._request("GET", "/info")
         if res.status_code == 403:
             raise PermissionError("Invalid API Key")
         res.raise_for_status()
         return res.json()
 
-    def lock(self) -> bool:
-        """Attempt to lock the GPU"""
+    def lock(self, priority: str = "normal") -> bool:
+        """
+        Attempt to lock the GPU. `priority`: "batch", "normal" or
+        "interactive"; on hosts started with --preempt a higher class takes
+        the lock from a lower one, whose jobs are stopped and requeued.
+        """
         try:
-            res = requests.post(
-                f"{self.url}/lock", 
-                json={"owner_id": self.owner_id},
-                headers=self.headers
-            )
+            res = self._request("POST", "/lock", json={"owner_id": self.owner_id, "priority": priority})
             if res.status_code == 503:
                 print("❌ Link is being used (GPU is busy).")
                 return False
@@ -179,67 +489,136 @@ class GPUClient:
     def unlock(self) -> bool:
         """Unlock the GPU"""
         try:
-            res = requests.post(
-                f"{self.url}/unlock", 
-                json={"owner_id": self.owner_id},
-                headers=self.headers
-            )
+            res = self._request("POST", "/unlock", json={"owner_id": self.owner_id})
             res.raise_for_status()
             return True
         except Exception as e:
             print(f"Unlock failed: {e}")
             return False
 
-    def submit_job(self, code: str) -> Dict[str, Any]:
-        """Submit python code for execution"""
-        res = requests.post(
-            f"{self.url}/submit",
-            json={"owner_id": self.owner_id, "code": code},
-            headers=self.headers
-        )
+    def submit_job(self, code: str, dedupe: bool = False, memo_ttl: Optional[float] = None,
+                   idempotency_key: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Submit python code for execution.
+        With dedupe=True (or an idempotency_key) identical jobs already
+        running on the host are joined instead of run again; memo_ttl also
+        reuses a result that finished up to that many seconds ago.
+        """
+        res = self._request("POST", "/submit", json=self._job_payload(code, dedupe, memo_ttl, idempotency_key))
         res.raise_for_status()
         return res.json()
+
+    def get_job(self, job_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Fetch a job's record and output from the host's job store.
+        Defaults to the last submitted job, e.g. after a dropped connection.
+        """
+        res = self._request("GET", f"/jobs/{self._job_id(job_id)}", params={"owner_id": self.owner_id})
+        res.raise_for_status()
+        return res.json()
+
+    def list_jobs(self, status: Optional[str] = None, since: Optional[float] = None,
+                  until: Optional[float] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """List this client's jobs, newest first"""
+        res = self._request("GET", "/jobs", params=self._jobs_params(status, since, until, limit))
+        res.raise_for_status()
+        return res.json()["jobs"]
+
+    def fetch_result(self, job_id: Optional[str] = None):
+        """Deserialize the stored result of a finished remote() call"""
+        return self._stored_result(self.get_job(job_id))
     
-    def run_file(self, file_path: str) -> Dict[str, Any]:
-        """Read and submit a local python file"""
+    def run_file(self, file_path: str, **kwargs) -> Dict[str, Any]:
+        """Read and submit a local python file (kwargs as in submit_job)"""
         with open(file_path, "r") as f:
             code = f.read()
-        return self.submit_job(code)
+        return self.submit_job(code, **kwargs)
 
-    def remote(self, func):
+    def _clan_call(self, job_func) -> Any:
+        res = self._request("POST", "/v2/clan/call", json=self._call_payload(job_func))
+        res.raise_for_status()
+        return self._call_result(res.json())
+
+    def map(self, func, items, shard_size: Optional[int] = None) -> List[Any]:
+        """
+        Data-parallel map over every node of a clan (use the clan's client
+        key). The host shards `items` across nodes by capacity, retries
+        failed shards elsewhere and returns the results in input order.
+        """
+        res = self._request("POST", "/v2/clan/map", json=self._map_payload(func, items, shard_size))
+        res.raise_for_status()
+        return self._map_results(res.json())
+
+    def dag(self, max_parallel: int = 4) -> Dag:
+        """Start building a graph of remote functions (see Dag)"""
+        return Dag(self, max_parallel)
+
+    def _stream(self, payload: Dict[str, Any]) -> Iterator[Any]:
+        res = self._request("POST", "/submit/stream", json=payload, stream=True)
+        try:
+            res.raise_for_status()
+            decoder = FrameDecoder()
+            for chunk in res.iter_content(STREAM_CHUNK):
+                for kind, data in decoder.feed(chunk):
+                    if kind == ITEM:
+                        yield dill.loads(data)
+                    elif kind == END:
+                        self._stream_end(json.loads(data))
+                        return
+            raise ConnectionError("Stream ended before the remote function finished")
+        finally:
+            # Early exit: dropping the connection stops the job on the host
+            res.close()
+
+    def remote(self, func=None, *, return_ref: bool = False, requirements: Optional[List[str]] = None,
+               dedupe: bool = False, memo_ttl: Optional[float] = None, hedge: bool = False,
+               stream: Optional[bool] = None):
         """
         Decorator to execute a function on the remote GPU.
         The function and its closure are serialized and sent to the host.
-        Returns the result of the function execution.
+        Returns the result of the function execution, or with
+        @client.remote(return_ref=True) an ObjectRef to the result kept on
+        the host. ObjectRef arguments are resolved on the host, no transfer.
+        With requirements=["torch==2.3.0", ...] the function runs in an
+        environment the host builds once for that set and then reuses.
+        dedupe/memo_ttl as in submit_job (same function and arguments = same job).
+        With hedge=True (clan client key, idempotent functions only) the
+        call runs on whichever clan node answers first: a slow node gets a
+        backup copy on another one (no requirements, dedupe or memo_ttl).
+        Generator functions (or stream=True) stream: calling them returns an
+        iterator yielding each item as soon as the host yields it. Stop
+        early (break, close()) and the job is killed on the host.
         """
+        if func is None:
+            return lambda f: self.remote(f, return_ref=return_ref, requirements=requirements,
+                                         dedupe=dedupe, memo_ttl=memo_ttl, hedge=hedge, stream=stream)
+
+        if hedge:
+            self._check_hedgeable(requirements, dedupe, memo_ttl)
+        if stream is None:
+            stream = inspect.isgeneratorfunction(func)
+        if stream:
+            self._check_streamable(return_ref, dedupe, memo_ttl, hedge)
+
+            def stream_wrapper(*args, **kwargs):
+                job_func, refs = self._prepare_remote(func, args, kwargs, False, False)
+                yield from self._stream(self._remote_payload(job_func, refs, False, requirements, False, None))
+
+            return stream_wrapper
+
         def wrapper(*args, **kwargs):
-            # Serialize the function execution (closure + args)
-            if args or kwargs:
-                job_func = lambda: func(*args, **kwargs)
-            else:
-                job_func = func
-            
-            # Pickle
-            pickle_hex = dill.dumps(job_func).hex()
-            
-            # Submit
-            res = requests.post(
-                f"{self.url}/submit",
-                json={
-                    "owner_id": self.owner_id, 
-                    "type": "pickle", 
-                    "pickle_data": pickle_hex
-                },
-                headers=self.headers
-            )
-            res.raise_for_status()
-            data = res.json()
-            
-            if data["status"] == "success":
-                # Deserialize Result
-                return dill.loads(bytes.fromhex(data["result"]))
-            else:
-                raise RuntimeError(f"Remote execution failed:\n{data['stderr']}")
+            with span("remote", function=_func_name(func)):
+                job_func, refs = self._prepare_remote(func, args, kwargs, return_ref, hedge)
+                if hedge:
+                    return self._clan_call(job_func)
+
+                with span("serialize"):
+                    payload = self._remote_payload(job_func, refs, return_ref, requirements, dedupe, memo_ttl)
+                with span("request") as s:
+                    res = self._request("POST", "/submit", json=payload)
+                    s.attrs["server_timing"] = res.headers.get("Server-Timing")
+                res.raise_for_status()
+                with span("deserialize"):
+                    return self._remote_result(res.json(), return_ref, ObjectRef)
                 
         return wrapper
->>>>>>> 4b092473e6530ba53ab90c2e3dca88d9034ff8f5
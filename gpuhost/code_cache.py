@@ -0,0 +1,211 @@
+import asyncio
+import contextlib
+import hashlib
+import importlib.util
+import marshal
+import os
+import time
+from typing import Dict, Optional, Any, Tuple
+
+from gpuhost.job_store import GPUHOST_HOME
+
+CODE_DIR = os.path.join(GPUHOST_HOME, "code")
+
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# Entries (user source included) unused this long are deleted
+DEFAULT_TTL = 7 * 24 * 3600
+
+# Runs a cached code object as if it were `python <script dir>/<source>`:
+#   python -c CACHED_CODE_RUNNER <code file> <source file> <script dir>
+# The source is kept next to it so tracebacks still show the lines. The
+# import path starts at the job's own script dir, never at the cache (other
+# owners' sources live there).
+CACHED_CODE_RUNNER = """
+import marshal, sys
+code_path, source_path, script_dir = sys.argv[1:4]
+with open(code_path, "rb") as f:
+    code = marshal.load(f)
+sys.argv = [source_path]
+sys.path[0] = script_dir
+globs = {"__name__": "__main__", "__file__": source_path, "__builtins__": __builtins__}
+del code_path, script_dir, marshal
+try:
+    exec(code, globs)
+except SystemExit:
+    raise
+except BaseException as e:
+    import traceback
+    # Hide this bootstrap's frame, like a plain script run
+    traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+    sys.exit(1)
+"""
+
+
+def source_key(source: str) -> str:
+    """Cache key: the source and the bytecode format of this interpreter."""
+    h = hashlib.sha256(importlib.util.MAGIC_NUMBER)
+    h.update(source.encode("utf-8"))
+    return h.hexdigest()[:32]
+
+
+class CodeCache:
+    """
+    Compiled code objects of submitted code jobs, keyed by source hash.
+
+    The first run of a script compiles it on the host (off the event loop)
+    and stores the marshalled code object; every later run of the same
+    source skips parsing and compiling. Bounded by entry count and bytes,
+    least recently used first, and entries unused for `ttl` seconds are
+    deleted. The directory holds job sources: only the agent's user can read it.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        ttl: float = DEFAULT_TTL,
+    ):
+        self.directory = directory or CODE_DIR
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: Optional[Dict[str, Dict[str, Any]]] = None # key -> size, compile_seconds, last_used
+        self._in_use: Dict[str, int] = {}
+        self._compiling: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.compile_seconds_saved = 0.0
+
+    def _paths(self, key: str) -> Tuple[str, str]:
+        return os.path.join(self.directory, f"{key}.bin"), os.path.join(self.directory, f"{key}.py")
+
+    def _index(self) -> Dict[str, Dict[str, Any]]:
+        """Entries on disk, loaded on first use (the cache survives restarts)."""
+        if self._entries is None:
+            self._entries = {}
+            if os.path.isdir(self.directory):
+                for name in os.listdir(self.directory):
+                    key, ext = os.path.splitext(name)
+                    code_path, source_path = self._paths(key)
+                    if ext != ".bin" or not os.path.exists(source_path):
+                        continue
+                    st = os.stat(code_path)
+                    self._entries[key] = {
+                        "size": st.st_size + os.path.getsize(source_path),
+                        "compile_seconds": 0.0,
+                        "last_used": st.st_mtime,
+                    }
+            self.expire()
+        return self._entries
+
+    async def _compile(self, key: str, source: str) -> bool:
+        """Compiles and stores `source`; False if it doesn't compile."""
+        code_path, source_path = self._paths(key)
+
+        def compile_and_write():
+            start = time.perf_counter()
+            try:
+                code = compile(source, source_path, "exec", dont_inherit=True)
+            except Exception: # SyntaxError, but also e.g. RecursionError on deeply nested code
+                return None
+            elapsed = time.perf_counter() - start
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            os.chmod(self.directory, 0o700) # Also if it was made before, or with another umask
+            # Temp file + rename: readers never see a partial file
+            for path, data in ((source_path, source.encode("utf-8")), (code_path, marshal.dumps(code))):
+                tmp = f"{path}.{os.getpid()}.tmp"
+                with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+                    f.write(data)
+                os.replace(tmp, path)
+            return elapsed, os.path.getsize(code_path) + os.path.getsize(source_path)
+
+        # Not asyncio.to_thread: 3.8 is still supported
+        compiled = await asyncio.get_running_loop().run_in_executor(None, compile_and_write)
+        if compiled is None:
+            return False
+        elapsed, size = compiled
+        self._index()[key] = {"size": size, "compile_seconds": elapsed, "last_used": time.time()}
+        self._evict(keep=key)
+        return True
+
+    def _remove(self, key: str):
+        self._entries.pop(key, None)
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _evict(self, keep: str):
+        self.expire()
+        entries = self._index()
+        total = sum(e["size"] for e in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]["last_used"]):
+            if len(entries) <= self.max_entries and total <= self.max_bytes:
+                return
+            if key == keep or self._in_use.get(key):
+                continue
+            total -= entries[key]["size"]
+            self._remove(key)
+
+    def expire(self, now: Optional[float] = None):
+        """Deletes entries unused for `ttl` seconds (not while a job runs them)."""
+        now = now or time.time()
+        for key, entry in list(self._index().items()):
+            if now - entry["last_used"] > self.ttl and not self._in_use.get(key):
+                self._remove(key)
+
+    @contextlib.asynccontextmanager
+    async def use(self, source: str):
+        """
+        Yields (code_path, source_path) for CACHED_CODE_RUNNER, or None if
+        the source doesn't compile (run it as a file to get Python's error).
+        The entry can't be evicted while the job runs.
+        """
+        key = source_key(source)
+        entry = self._index().get(key)
+        if entry is not None:
+            self.hits += 1
+            self.compile_seconds_saved += entry["compile_seconds"]
+            entry["last_used"] = time.time()
+            try:
+                os.utime(self._paths(key)[0]) # last_used after a restart
+            except OSError:
+                pass
+        else:
+            self.misses += 1
+            # Concurrent first runs of the same script share one compile
+            compiling = self._compiling.get(key)
+            if compiling is None:
+                compiling = asyncio.ensure_future(self._compile(key, source))
+                self._compiling[key] = compiling
+                compiling.add_done_callback(lambda _: self._compiling.pop(key, None))
+            if not await asyncio.shield(compiling):
+                yield None
+                return
+
+        self._in_use[key] = self._in_use.get(key, 0) + 1
+        try:
+            yield self._paths(key)
+        finally:
+            self._in_use[key] -= 1
+            if not self._in_use[key]:
+                del self._in_use[key]
+
+    def stats(self) -> Dict[str, Any]:
+        entries = self._index()
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(entries),
+            "bytes": sum(e["size"] for e in entries.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "compile_seconds_saved": round(self.compile_seconds_saved, 6),
+        }
+
+
+# Global Cache Instance
+code_cache = CodeCache()
@@ -0,0 +1,197 @@
+import asyncio
+import os
+import re
+import shutil
+import time
+import uuid
+from pydantic import BaseModel
+from typing import List, Dict, Optional, Callable, Awaitable
+
+from gpuhost.job_store import GPUHOST_HOME
+
+DAG_DIR = os.path.join(GPUHOST_HOME, "dags")
+
+# Intermediate results are kept this long after a run so clients can fetch them
+DAG_TTL = 3600
+
+NODE_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+class DagNode(BaseModel):
+    id: str
+    pickle_data: str # dill'd callable, called with the results of `deps` as positional args
+    deps: List[str] = []
+    vram_bytes: Optional[int] = None # Shared mode only
+    requirements: List[str] = [] # Like SubmitRequest.requirements
+
+class DagRequest(BaseModel):
+    owner_id: str
+    nodes: List[DagNode]
+    outputs: Optional[List[str]] = None # Results sent back; default: nodes nothing depends on
+    max_parallel: int = 4
+
+
+def topological_order(nodes: List[DagNode]) -> List[DagNode]:
+    """
+    Orders nodes so every node comes after its deps.
+    Raises ValueError on duplicate/invalid ids, unknown deps or cycles.
+    """
+    by_id: Dict[str, DagNode] = {}
+    for node in nodes:
+        if not NODE_ID_RE.match(node.id):
+            raise ValueError(f"Invalid node id: {node.id!r}")
+        if node.id in by_id:
+            raise ValueError(f"Duplicate node id: {node.id}")
+        by_id[node.id] = node
+
+    for node in nodes:
+        for dep in node.deps:
+            if dep not in by_id:
+                raise ValueError(f"Node {node.id} depends on unknown node {dep}")
+
+    order: List[DagNode] = []
+    state: Dict[str, int] = {} # 1 = visiting, 2 = done
+
+    def visit(node: DagNode):
+        if state.get(node.id) == 2:
+            return
+        if state.get(node.id) == 1:
+            raise ValueError(f"Cycle detected at node {node.id}")
+        state[node.id] = 1
+        for dep in node.deps:
+            visit(by_id[dep])
+        state[node.id] = 2
+        order.append(node)
+
+    for node in nodes:
+        visit(node)
+    return order
+
+
+# run_node(node, dep_result_paths, result_path) -> job result dict
+NodeRunner = Callable[[DagNode, List[str], str], Awaitable[dict]]
+
+class DagRun:
+    """
+    One submitted graph. Every node's result stays on the host (in the
+    run's work dir) and is handed to dependent nodes by path, so nothing
+    but the requested outputs crosses the network.
+    """
+
+    def __init__(self, owner_id: str, nodes: List[DagNode], outputs: Optional[List[str]] = None):
+        self.dag_id = str(uuid.uuid4())
+        self.owner_id = owner_id
+        self.nodes = topological_order(nodes)
+        self.work_dir = os.path.join(DAG_DIR, self.dag_id)
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.status: Dict[str, str] = {n.id: "pending" for n in self.nodes}
+        self.errors: Dict[str, str] = {}
+
+        if outputs is None:
+            has_dependents = {d for n in self.nodes for d in n.deps}
+            outputs = [n.id for n in self.nodes if n.id not in has_dependents]
+        unknown = [o for o in outputs if o not in self.status]
+        if unknown:
+            raise ValueError(f"Unknown output nodes: {unknown}")
+        self.outputs = outputs
+
+    def result_path(self, node_id: str) -> str:
+        return os.path.join(self.work_dir, f"{node_id}.pkl")
+
+    def read_result(self, node_id: str) -> Optional[bytes]:
+        if self.status.get(node_id) != "success":
+            return None
+        with open(self.result_path(node_id), "rb") as f:
+            return f.read()
+
+    async def execute(self, run_node: NodeRunner, max_parallel: int = 4):
+        """Runs every node as soon as its deps are done, at most `max_parallel` at once."""
+        os.makedirs(self.work_dir, exist_ok=True)
+        slots = asyncio.Semaphore(max(1, max_parallel))
+        tasks: Dict[str, asyncio.Future] = {}
+
+        async def run(node: DagNode) -> bool:
+            deps_ok = await asyncio.gather(*(tasks[d] for d in node.deps))
+            if not all(deps_ok):
+                self.status[node.id] = "skipped"
+                return False
+
+            async with slots:
+                self.status[node.id] = "running"
+                result = await run_node(
+                    node, [self.result_path(d) for d in node.deps], self.result_path(node.id)
+                )
+
+            self.status[node.id] = result["status"]
+            if result["status"] != "success":
+                self.errors[node.id] = result.get("stderr", "")
+                return False
+            return True
+
+        for node in self.nodes:
+            tasks[node.id] = asyncio.ensure_future(run(node))
+        try:
+            await asyncio.gather(*tasks.values())
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            self.finished_at = time.time()
+
+    def summary(self) -> Dict:
+        return {
+            "dag_id": self.dag_id,
+            "status": dict(self.status),
+            "errors": dict(self.errors),
+            "outputs": self.outputs,
+            "finished": self.finished_at is not None,
+        }
+
+    def cleanup(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+class DagRegistry:
+    def __init__(self, ttl: float = DAG_TTL):
+        self.ttl = ttl
+        self.runs: Dict[str, DagRun] = {}
+
+    def add(self, run: DagRun):
+        self.runs[run.dag_id] = run
+
+    def get(self, dag_id: str, owner_id: Optional[str] = None) -> Optional[DagRun]:
+        """The run, None if unknown or (with `owner_id`) someone else's."""
+        run = self.runs.get(dag_id)
+        if run is None or (owner_id is not None and run.owner_id != owner_id):
+            return None
+        return run
+
+    def remove(self, dag_id: str) -> bool:
+        run = self.runs.pop(dag_id, None)
+        if run:
+            run.cleanup()
+        return run is not None
+
+    def expire(self, now: Optional[float] = None):
+        now = now or time.time()
+        for dag_id, run in list(self.runs.items()):
+            if run.finished_at and now - run.finished_at > self.ttl:
+                self.remove(dag_id)
+
+    def remove_orphans(self, now: Optional[float] = None):
+        """Deletes stale work dirs no run points to (left over by an earlier agent run)."""
+        now = now or time.time()
+        try:
+            names = os.listdir(DAG_DIR)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(DAG_DIR, name)
+            try:
+                if name not in self.runs and now - os.path.getmtime(path) > self.ttl:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
+
+
+# Global Registry Instance
+dag_runs = DagRegistry()
@@ -0,0 +1,267 @@
+import bisect
+import json
+import os
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pynvml
+
+
+class DeviceError(Exception):
+    """A device query failed (driver error, GPU fell off the bus...)."""
+
+
+class DeviceBackend:
+    """Where GPU information comes from. See NvmlBackend and SimulatedBackend."""
+
+    name = "none"
+    # Whether init() succeeded, None until it's tried (see gpu.py)
+    ready: Optional[bool] = None
+
+    def init(self) -> bool:
+        return True
+
+    def shutdown(self):
+        pass
+
+    def device_count(self) -> int:
+        raise NotImplementedError
+
+    def device_info(self, index: int = 0) -> Dict[str, Any]:
+        """Same keys as gpu.get_gpu_info(). Raises DeviceError."""
+        raise NotImplementedError
+
+    def cpu_affinity(self, index: int = 0) -> Optional[List[int]]:
+        return None
+
+
+def _arch_from_name(name: str) -> str:
+    # Simple Architecture Heuristic (can be refined)
+    if "RTX 30" in name or "A100" in name: return "Ampere"
+    if "RTX 40" in name or "H100" in name: return "Lovelace/Hopper"
+    if "RTX 20" in name or "T4" in name: return "Turing"
+    if "GTX 10" in name: return "Pascal"
+    return "Unknown"
+
+
+class NvmlBackend(DeviceBackend):
+    """Real NVIDIA GPUs through NVML."""
+
+    name = "nvml"
+
+    def init(self) -> bool:
+        try:
+            pynvml.nvmlInit()
+            return True
+        except pynvml.NVMLError:
+            return False
+
+    def shutdown(self):
+        try:
+            pynvml.nvmlShutdown()
+        except pynvml.NVMLError:
+            pass
+
+    def device_count(self) -> int:
+        try:
+            return pynvml.nvmlDeviceGetCount()
+        except pynvml.NVMLError as e:
+            raise DeviceError(str(e))
+
+    def device_info(self, index: int = 0) -> Dict[str, Any]:
+        try:
+            handle = pynvml.nvmlDeviceGetHandleByIndex(index)
+            name = pynvml.nvmlDeviceGetName(handle)
+            if isinstance(name, bytes):
+                name = name.decode("utf-8")
+
+            memory_info = pynvml.nvmlDeviceGetMemoryInfo(handle)
+            driver_version = pynvml.nvmlSystemGetDriverVersion()
+            if isinstance(driver_version, bytes):
+                driver_version = driver_version.decode("utf-8")
+        except pynvml.NVMLError as e:
+            raise DeviceError(str(e))
+
+        # Extended V2 Metrics
+        try:
+            cuda_major, cuda_minor = pynvml.nvmlDeviceGetCudaComputeCapability(handle)
+            cuda_cap = f"{cuda_major}.{cuda_minor}"
+        except pynvml.NVMLError:
+            cuda_cap = "0.0"
+        try:
+            utilization = pynvml.nvmlDeviceGetUtilizationRates(handle).gpu
+        except pynvml.NVMLError:
+            utilization = None
+
+        return {
+            "name": name,
+            "arch": _arch_from_name(name),
+            "cuda_capability": cuda_cap,
+            "tensor_cores": float(cuda_cap) >= 7.0, # Volta+ has Tensor Cores
+            "memory_total": memory_info.total,
+            "memory_free": memory_info.free,
+            "memory_used": memory_info.used,
+            "utilization": utilization,
+            "driver_version": driver_version
+        }
+
+    def cpu_affinity(self, index: int = 0) -> Optional[List[int]]:
+        """CPU cores on the same NUMA node as the GPU, or None if NVML can't tell us."""
+        try:
+            handle = pynvml.nvmlDeviceGetHandleByIndex(index)
+            words = pynvml.nvmlDeviceGetCpuAffinity(handle, ((os.cpu_count() or 1) + 63) // 64)
+        except pynvml.NVMLError:
+            return None
+        cpus = [w * 64 + bit for w, word in enumerate(words) for bit in range(64) if (word >> bit) & 1]
+        return cpus or None
+
+
+# The card reported when there's no real GPU (what the fallback used to hard-code)
+DEFAULT_SIMULATED_DEVICE = {
+    "name": "Mock NVIDIA GPU (Simulated)",
+    "arch": "Ampere (Simulated)",
+    "cuda_capability": "8.6",
+    "tensor_cores": True,
+    "memory_total": 24000 * 1024 * 1024,
+    "driver_version": "535.00 (Mock)",
+}
+
+
+class Trace:
+    """
+    A value over time from (seconds, value) points, linearly interpolated
+    and held after the last point (or repeated with loop=True).
+    """
+
+    def __init__(self, points: List[Tuple[float, float]], loop: bool = False):
+        if not points:
+            raise ValueError("A trace needs at least one point")
+        self.points = sorted((float(t), float(v)) for t, v in points)
+        self.times = [t for t, _ in self.points]
+        self.loop = loop
+
+    def at(self, t: float) -> float:
+        if self.loop and self.times[-1] > 0:
+            t %= self.times[-1]
+        i = bisect.bisect_right(self.times, t)
+        if i == 0:
+            return self.points[0][1]
+        if i == len(self.points):
+            return self.points[-1][1]
+        (t0, v0), (t1, v1) = self.points[i - 1], self.points[i]
+        return v0 + (v1 - v0) * (t - t0) / (t1 - t0)
+
+    @classmethod
+    def parse(cls, spec: Any) -> "Trace":
+        """A constant, a list of [t, value] points, or {"points": [...], "loop": bool}."""
+        if isinstance(spec, (int, float)):
+            return cls([(0, spec)])
+        if isinstance(spec, dict):
+            return cls(spec["points"], spec.get("loop", False))
+        return cls(spec)
+
+
+class SimulatedDevice:
+    def __init__(self, spec: Dict[str, Any]):
+        self.spec = dict(DEFAULT_SIMULATED_DEVICE, **{k: v for k, v in spec.items() if k not in ("memory_used", "utilization", "failures", "cpus")})
+        self.memory_used = Trace.parse(spec.get("memory_used", 0))
+        self.utilization = Trace.parse(spec.get("utilization", 0))
+        self.failures: List[Tuple[float, float]] = [(f["start"], f["end"]) for f in spec.get("failures", [])]
+        self.failure_rate = spec.get("failure_rate", 0.0) # Chance any single query fails
+        self.cpus: Optional[List[int]] = spec.get("cpus")
+        self.allocated = 0 # Scripted on top of the trace (allocate/free)
+        self.failed_until: Optional[float] = None
+
+
+class SimulatedBackend(DeviceBackend):
+    """
+    Scriptable fake GPUs for tests and load tests on machines without one.
+
+    Every device can have its own model, memory used and utilization over
+    time (Traces), failure windows and a random failure rate. Tests can
+    also drive it directly: allocate()/free() memory, fail() a device.
+    Time is seconds since the backend was created (or a custom `clock`).
+
+    Configuration (dict or JSON file), every key optional:
+      {"devices": [{"name": "RTX 3090", "memory_total": 25769803776,
+                    "memory_used": [[0, 0], [60, 20e9]], "utilization": {"points": [[0, 0], [5, 100]], "loop": true},
+                    "failures": [{"start": 30, "end": 40}], "failure_rate": 0.01}],
+       "seed": 0}
+    or {"count": 4} for four default devices.
+    """
+
+    name = "simulated"
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None, clock: Optional[Callable[[], float]] = None):
+        config = config or {}
+        specs = config.get("devices") or [{} for _ in range(config.get("count", 1))]
+        self.devices = [SimulatedDevice(spec) for spec in specs]
+        self._random = random.Random(config.get("seed"))
+        self._start = time.monotonic()
+        self.clock = clock or (lambda: time.monotonic() - self._start)
+
+    @classmethod
+    def from_file(cls, path: str) -> "SimulatedBackend":
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def _device(self, index: int) -> SimulatedDevice:
+        if not 0 <= index < len(self.devices):
+            raise DeviceError(f"Invalid device index {index}")
+        return self.devices[index]
+
+    def device_count(self) -> int:
+        return len(self.devices)
+
+    def device_info(self, index: int = 0) -> Dict[str, Any]:
+        device = self._device(index)
+        now = self.clock()
+        if device.failed_until is not None and now < device.failed_until:
+            raise DeviceError(f"Simulated failure of device {index}")
+        if any(start <= now < end for start, end in device.failures):
+            raise DeviceError(f"Simulated failure of device {index} (scheduled)")
+        if device.failure_rate and self._random.random() < device.failure_rate:
+            raise DeviceError(f"Simulated failure of device {index} (random)")
+
+        total = int(device.spec["memory_total"])
+        used = min(total, max(0, int(device.memory_used.at(now)) + device.allocated))
+        info = dict(device.spec)
+        info.update({
+            "memory_total": total,
+            "memory_free": total - used,
+            "memory_used": used,
+            "utilization": round(min(100.0, max(0.0, device.utilization.at(now)))),
+        })
+        return info
+
+    def cpu_affinity(self, index: int = 0) -> Optional[List[int]]:
+        return self._device(index).cpus
+
+    # --- Scripting ---
+
+    def allocate(self, index: int, nbytes: int):
+        self._device(index).allocated += nbytes
+
+    def free(self, index: int, nbytes: int):
+        device = self._device(index)
+        device.allocated = max(0, device.allocated - nbytes)
+
+    def fail(self, index: int, duration: float = float("inf")):
+        self._device(index).failed_until = self.clock() + duration
+
+    def recover(self, index: int):
+        self._device(index).failed_until = None
+
+
+def simulated_backend(spec: str) -> SimulatedBackend:
+    """From a device count ("4") or the path of a JSON config."""
+    if spec.isdigit():
+        return SimulatedBackend({"count": int(spec)})
+    return SimulatedBackend.from_file(spec)
+
+
+def backend_from_env() -> DeviceBackend:
+    """GPUHOST_SIMULATE=<n> or <config.json> selects the simulator, otherwise NVML."""
+    simulate = os.environ.get("GPUHOST_SIMULATE")
+    return simulated_backend(simulate) if simulate else NvmlBackend()
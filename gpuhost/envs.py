@@ -0,0 +1,249 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import re
+import shutil
+import sys
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Any
+
+from gpuhost.job_store import GPUHOST_HOME
+from gpuhost.job_manager import run_process
+from gpuhost.tracing import span
+
+ENV_DIR = os.path.join(GPUHOST_HOME, "envs")
+# Every wheel an environment was built from ends up here, so the same
+# requirements can be rebuilt later without network access
+WHEEL_DIR = os.environ.get("GPUHOST_WHEELS") or os.path.join(GPUHOST_HOME, "wheels")
+
+# Least recently used environments are deleted past this much disk
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3
+ENV_BUILD_TIMEOUT = 1800
+
+# Always installed: the pickle runner needs it
+BASE_REQUIREMENTS = ["dill"]
+
+META_FILE = "gpuhost-env.json"
+
+_NAME_RE = re.compile(r"^([A-Za-z0-9][A-Za-z0-9._-]*)")
+_SPEC_SPACE_RE = re.compile(r"\s*(===|==|!=|~=|>=|<=|<|>|,|\[|\])\s*")
+
+
+class EnvBuildError(Exception):
+    pass
+
+
+def normalize_requirements(requirements: List[str]) -> List[str]:
+    """
+    Canonical, sorted requirement list (PEP 503 names, no blank lines or
+    comments). Raises ValueError for pip options (-e, -r, --index-url...)
+    and direct references (`name @ URL`): jobs only get to pick packages,
+    not where they come from.
+    """
+    reqs = set()
+    for line in requirements:
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        if line.startswith("-") or "\n" in line or "@" in line or "://" in line:
+            raise ValueError(f"Unsupported requirement: {line!r}")
+        match = _NAME_RE.match(line)
+        if not match:
+            raise ValueError(f"Invalid requirement: {line!r}")
+        name = re.sub(r"[-_.]+", "-", match.group(1)).lower()
+        rest = " ".join(line[match.end():].split())
+        reqs.add(name + _SPEC_SPACE_RE.sub(r"\1", rest))
+    names = {_NAME_RE.match(r).group(1) for r in reqs}
+    reqs.update(r for r in BASE_REQUIREMENTS if r not in names)
+    return sorted(reqs)
+
+
+def env_hash(requirements: List[str]) -> str:
+    """Key of the environment for already normalized requirements on this interpreter."""
+    h = hashlib.sha256()
+    h.update(f"{platform.python_implementation()}-{sys.version_info[0]}.{sys.version_info[1]}-{sys.platform}\n".encode())
+    h.update("\n".join(requirements).encode("utf-8"))
+    return h.hexdigest()[:32]
+
+
+def env_python(path: str) -> str:
+    if os.name == "nt":
+        return os.path.join(path, "Scripts", "python.exe")
+    return os.path.join(path, "bin", "python")
+
+
+def _in_thread(func, *args):
+    """Runs blocking file work off the event loop (asyncio.to_thread is 3.9+)."""
+    return asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+async def build_venv(path: str, requirements: List[str], wheel_dir: str, offline: bool):
+    """
+    Creates a venv at `path` with `requirements` installed. Packages are
+    first collected as wheels into `wheel_dir` (skipped offline), then
+    installed from there only.
+    """
+    os.makedirs(wheel_dir, exist_ok=True)
+    env = dict(os.environ, PIP_NO_INPUT="1", PIP_DISABLE_PIP_VERSION_CHECK="1")
+    pip = [env_python(path), "-m", "pip"]
+    steps = [[sys.executable, "-m", "venv", path]]
+    if not offline:
+        steps.append(pip + ["wheel", "--wheel-dir", wheel_dir, "--find-links", wheel_dir] + requirements)
+    steps.append(pip + ["install", "--no-index", "--find-links", wheel_dir] + requirements)
+
+    for args in steps:
+        rc, _, stderr, timed_out = await run_process(args, ENV_BUILD_TIMEOUT, env=env)
+        if timed_out:
+            raise EnvBuildError(f"Environment build timed out ({ENV_BUILD_TIMEOUT}s)")
+        if rc != 0:
+            raise EnvBuildError(f"`{' '.join(args[:4])} ...` failed:\n{stderr[-4000:]}")
+
+
+class EnvCache:
+    """
+    Python environments for jobs that declare requirements, built once per
+    distinct requirement set and reused by every later job with the same hash.
+
+    Concurrent jobs asking for the same environment wait on a single build.
+    Environments not used by a running job are evicted least recently used
+    first once the cache grows past `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        wheel_dir: Optional[str] = None,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        offline: bool = False,
+        builder: Callable[[str, List[str], str, bool], Awaitable[None]] = build_venv,
+    ):
+        self.directory = directory or ENV_DIR
+        self.wheel_dir = wheel_dir or WHEEL_DIR
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.builder = builder
+        self._envs: Optional[Dict[str, Dict[str, Any]]] = None # hash -> meta
+        self._building: Dict[str, asyncio.Future] = {}
+        self._in_use: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _index(self) -> Dict[str, Dict[str, Any]]:
+        """Environments on disk, loaded on first use (they survive restarts)."""
+        if self._envs is None:
+            self._envs = {}
+            if os.path.isdir(self.directory):
+                for key in os.listdir(self.directory):
+                    meta_path = os.path.join(self.directory, key, META_FILE)
+                    try:
+                        with open(meta_path) as f:
+                            meta = json.load(f)
+                        meta["last_used"] = os.path.getmtime(meta_path)
+                    except (OSError, ValueError):
+                        continue # Half-built or foreign: ignore
+                    self._envs[key] = meta
+        return self._envs
+
+    def _touch(self, key: str):
+        meta = self._index()[key]
+        meta["last_used"] = time.time()
+        try:
+            os.utime(os.path.join(self.directory, key, META_FILE))
+        except OSError:
+            pass
+
+    async def _build(self, key: str, requirements: List[str]):
+        # Built in place (venvs aren't relocatable); the metadata file is
+        # written last, so a crash mid-build never looks like a ready env
+        path = os.path.join(self.directory, key)
+        if os.path.exists(path):
+            await _in_thread(shutil.rmtree, path, True)
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            await self.builder(path, requirements, self.wheel_dir, self.offline)
+            meta = {"requirements": requirements, "size": await _in_thread(_dir_size, path), "created": time.time()}
+            with open(os.path.join(path, META_FILE), "w") as f:
+                json.dump(meta, f)
+        except BaseException:
+            await _in_thread(shutil.rmtree, path, True)
+            raise
+        meta["last_used"] = time.time()
+        self._index()[key] = meta
+        await self._evict(keep=key)
+
+    async def _evict(self, keep: str):
+        envs = self._index()
+        total = sum(m["size"] for m in envs.values())
+        for key in sorted(envs, key=lambda k: envs[k]["last_used"]):
+            if total <= self.max_bytes:
+                return
+            if key == keep or self._in_use.get(key) or key in self._building:
+                continue
+            total -= envs.pop(key)["size"]
+            await _in_thread(shutil.rmtree, os.path.join(self.directory, key), True)
+
+    async def ensure(self, requirements: List[str]) -> str:
+        """Returns the hash of a ready environment for `requirements`. Raises EnvBuildError."""
+        reqs = normalize_requirements(requirements)
+        key = env_hash(reqs)
+        if key in self._index():
+            self.hits += 1
+        else:
+            self.misses += 1
+        # Loop: an environment could in principle be evicted between its
+        # build finishing and this waiter resuming
+        while key not in self._index():
+            build = self._building.get(key)
+            if build is None:
+                build = asyncio.ensure_future(self._build(key, reqs))
+                self._building[key] = build
+                build.add_done_callback(lambda _: self._building.pop(key, None))
+            # Shielded: one waiter going away must not cancel the shared build
+            await asyncio.shield(build)
+        self._touch(key)
+        return key
+
+    @contextlib.asynccontextmanager
+    async def use(self, requirements: List[str]):
+        """Yields the interpreter of the environment; it can't be evicted meanwhile."""
+        with span("env"):
+            key = await self.ensure(requirements)
+        self._in_use[key] = self._in_use.get(key, 0) + 1
+        try:
+            yield env_python(os.path.join(self.directory, key))
+        finally:
+            self._in_use[key] -= 1
+            if not self._in_use[key]:
+                del self._in_use[key]
+
+    def stats(self) -> Dict[str, Any]:
+        envs = self._index()
+        lookups = self.hits + self.misses
+        return {
+            "envs": len(envs),
+            "bytes": sum(m["size"] for m in envs.values()),
+            "max_bytes": self.max_bytes,
+            "building": len(self._building),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "offline": self.offline,
+        }
+
+
+# Global Cache Instance
+env_cache = EnvCache()
@@ -1,75 +1,65 @@
-import pynvml
-from typing import Dict, Any, Optional
+import logging
+from typing import Dict, Any, Optional, List
 
-def init_gpu():
-    try:
-        pynvml.nvmlInit()
-        return True
-    except pynvml.NVMLError:
-        return False
+from gpuhost.devices import DeviceBackend, DeviceError, SimulatedBackend, backend_from_env
+
+logger = logging.getLogger("gpuhost.gpu")
+
+# Where device info comes from (NVML unless GPUHOST_SIMULATE is set, see devices.py)
+_backend: DeviceBackend = backend_from_env()
+# Stands in when the backend can't be set up at all (no driver or GPU, e.g. dev machines):
+# the old single mock card. A backend that works but then fails isn't replaced by it
+_fallback = SimulatedBackend()
+
+def set_backend(backend: DeviceBackend):
+    """Swap the device backend (e.g. a SimulatedBackend for tests or load tests)."""
+    global _backend
+    _backend = backend
+
+def get_backend() -> DeviceBackend:
+    return _backend
+
+def init_gpu() -> bool:
+    _backend.ready = _backend.init()
+    return _backend.ready
+
+def _active() -> DeviceBackend:
+    if _backend.ready is None:
+        init_gpu()
+    return _backend if _backend.ready else _fallback
 
 def shutdown_gpu():
-    try:
-        pynvml.nvmlShutdown()
-    except pynvml.NVMLError:
-        pass
+    _backend.shutdown()
 
-def get_gpu_info() -> Optional[Dict[str, Any]]:
+def get_gpu_info(index: int = 0) -> Optional[Dict[str, Any]]:
     """
-    Returns information about the primary GPU (index 0).
-    If no GPU is found or nvml fails, returns a mock dict for testing capability
-    on non-GPU machines, or None if completely unable to run.
+    Returns information about a GPU (the primary one by default), None if
+    the query fails. Without any usable backend (no GPU or drivers), a mock
+    dict for testing capability on non-GPU machines.
     """
-
     try:
-        handle = pynvml.nvmlDeviceGetHandleByIndex(0)
-        name = pynvml.nvmlDeviceGetName(handle)
-        if isinstance(name, bytes):
-            name = name.decode("utf-8")
-            
-        memory_info = pynvml.nvmlDeviceGetMemoryInfo(handle)
-        driver_version = pynvml.nvmlSystemGetDriverVersion()
-        if isinstance(driver_version, bytes):
-            driver_version = driver_version.decode("utf-8")
+        return _active().device_info(index)
+    except DeviceError as e:
+        logger.warning("GPU %d query failed: %s", index, e)
+        return None
 
-        # Extended V2 Metrics
+def list_devices() -> List[Dict[str, Any]]:
+    """Info of every device, with its index. Failing devices are reported with an error."""
+    try:
+        count = _backend.device_count()
+    except DeviceError:
+        return []
+    devices = []
+    for index in range(count):
         try:
-            cuda_major, cuda_minor = pynvml.nvmlDeviceGetCudaComputeCapability(handle)
-            cuda_cap = f"{cuda_major}.{cuda_minor}"
-        except:
-            cuda_cap = "0.0"
-
-        # Simple Architecture Heuristic (can be refined)
-        arch = "Unknown"
-        if "RTX 30" in name or "A100" in name: arch = "Ampere"
-        elif "RTX 40" in name or "H100" in name: arch = "Lovelace/Hopper"
-        elif "RTX 20" in name or "T4" in name: arch = "Turing"
-        elif "GTX 10" in name: arch = "Pascal"
+            devices.append(dict(_backend.device_info(index), index=index))
+        except DeviceError as e:
+            devices.append({"index": index, "error": str(e)})
+    return devices
 
-        tensor_cores = False
-        if float(cuda_cap) >= 7.0: # Volta+ has Tensor Cores
-            tensor_cores = True
-
-        return {
-            "name": name,
-            "arch": arch,
-            "cuda_capability": cuda_cap,
-            "tensor_cores": tensor_cores,
-            "memory_total": memory_info.total,
-            "memory_free": memory_info.free,
-            "memory_used": memory_info.used,
-            "driver_version": driver_version
-        }
-    except pynvml.NVMLError as e:
-        print(f"NVML Error: {e}")
-        # Fallback for dev/testing on non-GPU implementations
-        return {
-            "name": "Mock NVIDIA GPU (Simulated)",
-            "arch": "Ampere (Simulated)",
-            "cuda_capability": "8.6",
-            "tensor_cores": True,
-            "memory_total": 24000 * 1024 * 1024,
-            "memory_free": 24000 * 1024 * 1024,
-            "memory_used": 0,
-            "driver_version": "535.00 (Mock)"
-        }
+def get_gpu_cpu_affinity(index: int = 0) -> Optional[List[int]]:
+    """
+    Returns the CPU cores on the same NUMA node as the GPU (ideal for the
+    jobs feeding it), or None if the backend can't tell us.
+    """
+    return _backend.cpu_affinity(index)
@@ -0,0 +1,180 @@
+import asyncio
+import collections
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# Hedge when the primary is slower than this percentile of recent requests
+DEFAULT_PERCENTILE = 95.0
+# Until enough requests were seen, hedge after this long
+INITIAL_DELAY = 1.0
+MIN_DELAY = 0.01
+MIN_SAMPLES = 20
+# Extra requests allowed, as a fraction of all requests (and the burst on top)
+DEFAULT_BUDGET_RATIO = 0.1
+DEFAULT_BUDGET_BURST = 5.0
+# A failed attempt counts as this slow when ranking nodes
+ERROR_PENALTY = 10.0
+# Weight of the newest sample in a node's latency average
+NODE_EWMA_ALPHA = 0.2
+
+
+class LatencyTracker:
+    """Rolling window of latencies (seconds)."""
+
+    def __init__(self, window: int = 1000):
+        self.samples: "collections.deque" = collections.deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100.0))]
+
+
+class HedgeBudget:
+    """
+    Token bucket: every request earns `ratio` of a token, every hedge spends
+    one, so hedges stay under `ratio` extra load (plus a small burst).
+    """
+
+    def __init__(self, ratio: float = DEFAULT_BUDGET_RATIO, burst: float = DEFAULT_BUDGET_BURST):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst if ratio > 0 else 0.0
+
+    def earn(self):
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+
+# (node_id, start the request on that node)
+Candidate = Tuple[str, Callable[[], Awaitable[Any]]]
+
+class Hedger:
+    """
+    Hedged requests for idempotent calls that any of several nodes can serve.
+
+    The call goes to the node with the best recent latency. If it hasn't
+    answered by the adaptive deadline (a percentile of recent latencies)
+    and the budget allows, the same call goes to the next node; the first
+    success wins and the other attempt is cancelled. Failures fail over to
+    the next node without spending budget.
+    """
+
+    def __init__(
+        self,
+        percentile: float = DEFAULT_PERCENTILE,
+        budget_ratio: float = DEFAULT_BUDGET_RATIO,
+        budget_burst: float = DEFAULT_BUDGET_BURST,
+    ):
+        self.percentile = percentile
+        self.budget = HedgeBudget(budget_ratio, budget_burst)
+        self.latency = LatencyTracker() # What callers saw
+        self.primary_latency = LatencyTracker() # What they'd have seen without hedging (cancelled primaries count as their age: a lower bound)
+        self.node_latency: Dict[str, float] = {}
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    def delay(self) -> float:
+        if len(self.latency) < MIN_SAMPLES:
+            return INITIAL_DELAY
+        return max(MIN_DELAY, self.latency.percentile(self.percentile))
+
+    def _record_node(self, node_id: str, seconds: float):
+        previous = self.node_latency.get(node_id)
+        self.node_latency[node_id] = seconds if previous is None else previous + NODE_EWMA_ALPHA * (seconds - previous)
+
+    async def run(self, candidates: List[Candidate], hedge: bool = True) -> Any:
+        """Result of the first attempt to succeed; re-raises the last error if all fail."""
+        if not candidates:
+            raise ValueError("No nodes to send the request to")
+        self.requests += 1
+        self.budget.earn()
+        # Unmeasured nodes first, so new nodes get a chance
+        queue = sorted(candidates, key=lambda c: self.node_latency.get(c[0], 0.0))
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        deadline = start + self.delay()
+        attempts: Dict[asyncio.Future, Tuple[str, float]] = {}
+        primary: Optional[asyncio.Future] = None
+        last_error: Optional[BaseException] = None
+
+        def launch() -> asyncio.Future:
+            node_id, call = queue.pop(0)
+            task = asyncio.ensure_future(call())
+            attempts[task] = (node_id, loop.time())
+            return task
+
+        primary = launch()
+        try:
+            while attempts:
+                may_hedge = hedge and queue and len(attempts) == 1 and deadline is not None
+                timeout = max(0.0, deadline - loop.time()) if may_hedge else None
+                done, _ = await asyncio.wait(attempts, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    deadline = None # One hedge per request at most
+                    if self.budget.try_spend():
+                        self.hedges += 1
+                        launch()
+                    continue
+
+                for task in done:
+                    node_id, started = attempts.pop(task)
+                    elapsed = loop.time() - started
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        self._record_node(node_id, ERROR_PENALTY)
+                        continue
+                    self._record_node(node_id, elapsed)
+                    self.latency.record(loop.time() - start)
+                    if task is primary:
+                        self.primary_latency.record(elapsed)
+                    else:
+                        self.hedge_wins += 1
+                    return task.result()
+
+                if not attempts and queue:
+                    self.failovers += 1
+                    launch()
+            raise last_error
+        finally:
+            for task, (node_id, started) in attempts.items():
+                task.cancel()
+                if task is primary:
+                    self.primary_latency.record(loop.time() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        def ms(value: Optional[float]) -> Optional[float]:
+            return round(value * 1000, 1) if value is not None else None
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+            "extra_load": self.hedges / self.requests if self.requests else 0.0,
+            "delay_ms": ms(self.delay()),
+            "p50_ms": ms(self.latency.percentile(50)),
+            "p99_ms": ms(self.latency.percentile(99)),
+            "unhedged_p99_ms": ms(self.primary_latency.percentile(99)),
+            "node_latency_ms": {n: ms(v) for n, v in self.node_latency.items()},
+        }
+
+
+# Global Hedgers (one per kind of request, they have different latencies)
+hedgers = {
+    "chat": Hedger(),
+    "call": Hedger(),
+}
@@ -1,14 +1,327 @@
-import subprocess
+import asyncio
+import contextlib
+import hashlib
+import json
 import tempfile
 import os
+import shutil
+import signal
+import time
 import uuid
+import sys
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from gpuhost.code_cache import code_cache, CACHED_CODE_RUNNER
+from gpuhost.job_store import GPUHOST_HOME
+from gpuhost.tracing import span, record
+from gpuhost.streams import FRAME_HEADER, ITEM, END, STREAM_CHUNK
+from gpuhost.preemption import current_attempt
+
+# Timeout after 600 seconds (10 mins) to allow for LLM loading
+JOB_TIMEOUT = 600
+
+# Directories holding nothing but a link to the gpuhost package, put on the
+# runner's PYTHONPATH: pickled jobs can reference gpuhost helpers without the
+# rest of the agent's site-packages shadowing a job environment's packages
+HELPER_DIR = os.path.join(GPUHOST_HOME, "runner-path")
+
+RUNNER_CODE = """
+import time
+started = time.time()
+import json
+import os
+import sys
 import dill
+
+# Phase -> (start, end), reported back to the agent's trace (see _record_runner)
+timings = {"start": started, "imports": (started, time.time())}
+try:
+    input_path = sys.argv[1]
+    output_path = sys.argv[2]
+
+    t = time.time()
+    with open(input_path, "rb") as f:
+        func = dill.load(f)
+
+    # Extra argv entries are pickled positional args (results of earlier
+    # jobs kept on the host, e.g. DAG dependencies)
+    args = []
+    for arg_path in sys.argv[3:]:
+        with open(arg_path, "rb") as f:
+            args.append(dill.load(f))
+    timings["unpickle"] = (t, time.time())
+
+    # Run the function
+    t = time.time()
+    result = func(*args)
+    timings["user_code"] = (t, time.time())
+
+    t = time.time()
+    with open(output_path, "wb") as f:
+        dill.dump(result, f)
+    timings["pickle_result"] = (t, time.time())
+
+except Exception as e:
+    sys.stderr.write(str(e))
+    sys.exit(1)
+finally:
+    timings_path = os.environ.get("GPUHOST_RUNNER_TIMINGS")
+    if timings_path:
+        with open(timings_path, "w") as f:
+            json.dump(timings, f)
+"""
+
+STREAM_RUNNER_CODE = """
+import os
+import struct
 import sys
+import dill
 
-def execute_code(code: str) -> dict:
+try:
+    input_path = sys.argv[1]
+    frames = os.fdopen(int(sys.argv[2]), "wb")
+
+    with open(input_path, "rb") as f:
+        func = dill.load(f)
+    args = []
+    for arg_path in sys.argv[3:]:
+        with open(arg_path, "rb") as f:
+            args.append(dill.load(f))
+
+    # Each item goes out as soon as it's yielded (an ITEM frame, see
+    # gpuhost.streams). The pipe holds little: a slow reader pauses the generator
+    for item in func(*args):
+        data = dill.dumps(item)
+        frames.write(struct.pack(">cI", b"I", len(data)) + data)
+        frames.flush()
+    frames.close()
+
+except BrokenPipeError:
+    sys.exit(1) # Nobody is reading anymore
+except Exception as e:
+    sys.stderr.write(str(e))
+    sys.exit(1)
+"""
+
+# Runner phases, in the order they run
+RUNNER_PHASES = ["imports", "unpickle", "user_code", "pickle_result"]
+
+
+@contextlib.contextmanager
+def pidfd_child_watcher():
+    """
+    Before 3.12 asyncio waits for each child on its own thread
+    (ThreadedChildWatcher). On Linux a pidfd watcher lets the running event
+    loop track any number of jobs with no extra threads. Use around the
+    lifetime of the server loop.
+    """
+    loop = asyncio.get_running_loop()
+    usable = (
+        sys.version_info < (3, 12)
+        and hasattr(os, "pidfd_open")
+        and hasattr(asyncio, "PidfdChildWatcher")
+        and isinstance(loop, asyncio.SelectorEventLoop) # uvloop has its own
+    )
+    if usable:
+        try:
+            os.close(os.pidfd_open(os.getpid()))
+        except OSError:
+            usable = False
+    if not usable:
+        yield
+        return
+
+    previous = asyncio.get_child_watcher()
+    watcher = asyncio.PidfdChildWatcher()
+    watcher.attach_loop(loop)
+    asyncio.set_child_watcher(watcher)
+    try:
+        yield
+    finally:
+        asyncio.set_child_watcher(previous)
+        watcher.close()
+
+
+_helper_path: Optional[str] = None
+
+def helper_path() -> str:
+    """A directory with only `gpuhost` in it (a link to this package, or a copy where links aren't allowed)."""
+    global _helper_path
+    if _helper_path is None:
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        path = os.path.join(HELPER_DIR, hashlib.sha256(package_dir.encode("utf-8")).hexdigest()[:16])
+        link = os.path.join(path, "gpuhost")
+        if not os.path.exists(link):
+            os.makedirs(path, exist_ok=True)
+            tmp = f"{link}.{os.getpid()}.tmp"
+            try:
+                os.symlink(package_dir, tmp, target_is_directory=True)
+            except OSError:
+                shutil.copytree(package_dir, tmp, ignore=shutil.ignore_patterns("__pycache__"))
+            try:
+                os.replace(tmp, link)
+            except OSError:
+                shutil.rmtree(tmp, ignore_errors=True) # Another process made it first
+        _helper_path = path
+    return _helper_path
+
+
+def _runner_env(env: Optional[Dict[str, str]], python: Optional[str] = None) -> Dict[str, str]:
+    """
+    Pickled jobs may reference gpuhost helpers: make sure the runner can
+    import them. In a job environment (`python`) only the gpuhost package
+    is added, so the environment's own packages win over the agent's.
+    """
+    env = dict(env if env is not None else os.environ)
+    if python:
+        env["PYTHONPATH"] = helper_path()
+        return env
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    paths = [p for p in env.get("PYTHONPATH", "").split(os.pathsep) if p]
+    if package_root not in paths:
+        env["PYTHONPATH"] = os.pathsep.join(paths + [package_root])
+    return env
+
+
+def _record_runner(timings_path: str, spawned: float):
+    """Spans for the phases the runner timed in its own process."""
+    try:
+        with open(timings_path) as f:
+            timings = json.load(f)
+    except (OSError, ValueError):
+        return # Killed before it got that far
+    record("spawn", spawned, timings["start"])
+    for phase in RUNNER_PHASES:
+        if phase in timings:
+            record(phase, *timings[phase])
+
+
+def _kill_group(proc: asyncio.subprocess.Process):
+    """Kill the job and everything it spawned (it leads its own process group)."""
+    if proc.returncode is not None:
+        return
+    try:
+        if os.name == "posix":
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except ProcessLookupError:
+        pass
+
+
+def _signal_group(proc: asyncio.subprocess.Process, sig: int):
+    if proc.returncode is not None:
+        return
+    try:
+        if os.name == "posix":
+            os.killpg(proc.pid, sig)
+        else:
+            proc.send_signal(sig)
+    except ProcessLookupError:
+        pass
+
+
+async def _wait_or_stop(proc: asyncio.subprocess.Process) -> int:
+    """
+    proc.wait(), unless the job gets preempted meanwhile (see
+    gpuhost.preemption): then it's sent the stop signal, and killed if
+    it's still running after the grace period.
+    """
+    attempt = current_attempt.get()
+    if attempt is None:
+        return await proc.wait()
+    exited = asyncio.ensure_future(proc.wait())
+    try:
+        await asyncio.wait({exited, attempt.stop}, return_when=asyncio.FIRST_COMPLETED)
+        if not exited.done():
+            sig, grace = attempt.stop.result()
+            attempt.signalled = True
+            _signal_group(proc, sig)
+            done, _ = await asyncio.wait({exited}, timeout=grace)
+            if not done:
+                _kill_group(proc)
+        return await exited
+    finally:
+        exited.cancel()
+
+
+async def _limit(proc, apply_limits: Optional[Callable[[int], None]]):
+    """Applies a job's resource budget to its just spawned process; kills it if that fails."""
+    if apply_limits is None:
+        return
+    try:
+        apply_limits(proc.pid)
+    except ProcessLookupError: # Already gone
+        pass
+    except OSError:
+        _kill_group(proc)
+        await proc.wait()
+        raise
+
+
+async def _drain(stream: asyncio.StreamReader, chunks: List[bytes]):
+    while True:
+        chunk = await stream.read(65536)
+        if not chunk:
+            return
+        chunks.append(chunk)
+
+
+async def run_process(
+    args: List[str],
+    timeout: float = JOB_TIMEOUT,
+    apply_limits: Optional[Callable[[int], None]] = None,
+    env: Optional[Dict[str, str]] = None
+) -> Tuple[Optional[int], str, str, bool]:
+    """
+    Runs a command without blocking the event loop.
+    Returns (return_code, stdout, stderr, timed_out).
+    If the awaiting task is cancelled (e.g. client went away) the whole
+    process group is killed before the cancellation propagates. A
+    preempted job is stopped gracefully instead (see _wait_or_stop).
+    `apply_limits`/`env` come from resources.prepare() (CPU set, rlimits...).
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=(os.name == "posix"),
+        env=env
+    )
+    await _limit(proc, apply_limits)
+    out_chunks: List[bytes] = []
+    err_chunks: List[bytes] = []
+    readers = asyncio.gather(_drain(proc.stdout, out_chunks), _drain(proc.stderr, err_chunks))
+
+    timed_out = False
+    try:
+        await asyncio.wait_for(_wait_or_stop(proc), timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+        _kill_group(proc)
+        await proc.wait()
+    except asyncio.CancelledError:
+        _kill_group(proc)
+        await proc.wait()
+        readers.cancel()
+        raise
+
+    # Grandchildren may still hold the pipes open; don't wait on them forever
+    try:
+        await asyncio.wait_for(readers, 5)
+    except asyncio.TimeoutError:
+        pass
+
+    stdout = b"".join(out_chunks).decode("utf-8", errors="replace")
+    stderr = b"".join(err_chunks).decode("utf-8", errors="replace")
+    return proc.returncode, stdout, stderr, timed_out
+
+
+async def run_code(code: str, timeout: float = JOB_TIMEOUT, apply_limits=None, env=None, python: Optional[str] = None) -> dict:
     """
     Executes the provided Python code in a subprocess.
     Returns dictionary with stdout, stderr, and return_code.
+    `python` is the interpreter to use (a job environment), default: ours.
     """
     job_id = str(uuid.uuid4())
     filename = f"job_{job_id}.py"
@@ -16,33 +329,38 @@ def execute_code(code: str) -> dict:
     file_path = os.path.join(temp_dir, filename)
 
     try:
-        # Write code to temp file
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(code)
+        async with code_cache.use(code) as compiled:
+            if compiled:
+                # Same script seen before: run its cached code object, imports
+                # resolved from where the script file would have been
+                args = [python or sys.executable, "-c", CACHED_CODE_RUNNER, *compiled, temp_dir]
+            else:
+                # Doesn't compile: run it as a file so Python reports the error as usual
+                with open(file_path, "w", encoding="utf-8") as f:
+                    f.write(code)
+                args = [python or sys.executable, file_path]
 
-        # Execute
-        # Timeout after 600 seconds (10 mins) to allow for LLM loading
-        result = subprocess.run(
-            [sys.executable, file_path],
-            capture_output=True,
-            text=True,
-            timeout=600
-        )
+            # Execute
+            with span("run_process"):
+                return_code, stdout, stderr, timed_out = await run_process(args, timeout, apply_limits, env)
 
-        return {
-            "stdout": result.stdout,
-            "stderr": result.stderr,
-            "return_code": result.returncode,
-            "status": "success" if result.returncode == 0 else "error"
-        }
+        if timed_out:
+            return {
+                "stdout": stdout,
+                "stderr": stderr + f"\nExecution timed out ({timeout:g}s limit)",
+                "return_code": -1,
+                "status": "timeout"
+            }
 
-    except subprocess.TimeoutExpired:
         return {
-            "stdout": "",
-            "stderr": "Execution timed out (60s limit)",
-            "return_code": -1,
-            "status": "timeout"
+            "stdout": stdout,
+            "stderr": stderr,
+            "return_code": return_code,
+            "status": "success" if return_code == 0 else "error"
         }
+
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
         return {
             "stdout": "",
@@ -58,88 +376,219 @@ def execute_code(code: str) -> dict:
             except:
                 pass
 
-def execute_pickle(pickle_hex: str) -> dict:
+
+async def run_pickle(
+    pickle_hex: str,
+    timeout: float = JOB_TIMEOUT,
+    apply_limits=None,
+    env=None,
+    arg_paths: Optional[List[str]] = None,
+    result_path: Optional[str] = None,
+    python: Optional[str] = None
+) -> dict:
     """
     Executes a pickled function in a subprocess.
     Returns the pickled result or stderr.
+    `arg_paths` are pickle files passed to the function as positional args.
+    With `result_path` the pickled result is left in that file on the host
+    instead of being returned. `python` as in run_code().
     """
     job_id = str(uuid.uuid4())
     temp_dir = tempfile.gettempdir()
-    
+
     input_path = os.path.join(temp_dir, f"in_{job_id}.pkl")
-    output_path = os.path.join(temp_dir, f"out_{job_id}.pkl")
+    output_path = result_path or os.path.join(temp_dir, f"out_{job_id}.pkl")
     runner_path = os.path.join(temp_dir, f"runner_{job_id}.py")
-    
-    # 1. Runner Script
-    runner_code = """
-import dill
-import sys
+    timings_path = os.path.join(temp_dir, f"timings_{job_id}.json")
 
-try:
-    input_path = sys.argv[1]
-    output_path = sys.argv[2]
+    try:
+        with span("write_input"):
+            # Write Input Pickle
+            with open(input_path, "wb") as f:
+                f.write(bytes.fromhex(pickle_hex))
 
-    with open(input_path, "rb") as f:
-        func = dill.load(f)
-    
-    # Run the function
-    # Note: We assume the function takes no args for this simple implementation
-    # or that args were bound in the closure.
-    result = func()
-    
-    with open(output_path, "wb") as f:
-        dill.dump(result, f)
-        
-except Exception as e:
-    sys.stderr.write(str(e))
-    sys.exit(1)
-"""
+            # Write Runner
+            with open(runner_path, "w", encoding="utf-8") as f:
+                f.write(RUNNER_CODE)
 
-    try:
-        # Write Input Pickle
-        with open(input_path, "wb") as f:
-            f.write(bytes.fromhex(pickle_hex))
-            
-        # Write Runner
-        with open(runner_path, "w", encoding="utf-8") as f:
-            f.write(runner_code)
-            
         # Execute
-        proc = subprocess.run(
-            [sys.executable, runner_path, input_path, output_path],
-            capture_output=True,
-            text=True,
-            timeout=600
-        )
-        
-        if proc.returncode != 0:
+        with span("run_process"):
+            spawned = time.time()
+            return_code, stdout, stderr, timed_out = await run_process(
+                [python or sys.executable, runner_path, input_path, output_path] + list(arg_paths or []),
+                timeout, apply_limits, dict(_runner_env(env, python), GPUHOST_RUNNER_TIMINGS=timings_path)
+            )
+            _record_runner(timings_path, spawned)
+
+        if timed_out:
+            return {
+                "status": "timeout",
+                "stderr": stderr + f"\nExecution timed out ({timeout:g}s limit)",
+                "stdout": stdout,
+                "return_code": -1
+            }
+
+        if return_code != 0:
             return {
                 "status": "error",
-                "stderr": proc.stderr or "Unknown error",
-                "stdout": proc.stdout
+                "stderr": stderr or "Unknown error",
+                "stdout": stdout,
+                "return_code": return_code
             }
-            
+
         # Read Result
+        if result_path and os.path.exists(result_path):
+            return {
+                "status": "success",
+                "result_path": result_path,
+                "stdout": stdout,
+                "stderr": stderr,
+                "return_code": return_code
+            }
         if os.path.exists(output_path):
-            with open(output_path, "rb") as f:
-                res_bytes = f.read()
+            with span("read_result"):
+                with open(output_path, "rb") as f:
+                    res_bytes = f.read()
+            with span("hex_encode"):
+                result_hex = res_bytes.hex()
             return {
                 "status": "success",
-                "result": res_bytes.hex(),
-                "stdout": proc.stdout,
-                "stderr": proc.stderr
+                "result": result_hex,
+                "stdout": stdout,
+                "stderr": stderr,
+                "return_code": return_code
             }
         else:
              return {
                 "status": "error",
                 "stderr": "No output file produced",
-                "stdout": proc.stdout
+                "stdout": stdout
             }
-            
+
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
         return {"status": "internal_error", "stderr": str(e)}
     finally:
-        for p in [input_path, output_path, runner_path]:
+        for p in [input_path, runner_path, timings_path] + ([] if result_path else [output_path]):
+            if os.path.exists(p):
+                try: os.remove(p)
+                except: pass
+
+
+async def stream_pickle(
+    pickle_hex: str,
+    timeout: float = JOB_TIMEOUT,
+    apply_limits=None,
+    env=None,
+    arg_paths: Optional[List[str]] = None,
+    python: Optional[str] = None
+) -> AsyncIterator[Tuple[bytes, Any]]:
+    """
+    Executes a pickled generator function in a subprocess.
+    Yields (ITEM, pickled item) as the function yields, then (END, result
+    dict as from run_pickle, without "result"). Closing the iterator early
+    (or cancelling the task reading it) kills the job.
+    Arguments as in run_pickle().
+    """
+    job_id = str(uuid.uuid4())
+    temp_dir = tempfile.gettempdir()
+    input_path = os.path.join(temp_dir, f"in_{job_id}.pkl")
+    runner_path = os.path.join(temp_dir, f"stream_runner_{job_id}.py")
+
+    read_fd, write_fd = os.pipe()
+    proc = None
+    transport = None
+    readers = None
+    try:
+        with open(input_path, "wb") as f:
+            f.write(bytes.fromhex(pickle_hex))
+        with open(runner_path, "w", encoding="utf-8") as f:
+            f.write(STREAM_RUNNER_CODE)
+
+        proc = await asyncio.create_subprocess_exec(
+            python or sys.executable, runner_path, input_path, str(write_fd), *(arg_paths or []),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=(os.name == "posix"),
+            env=_runner_env(env, python),
+            pass_fds=(write_fd,)
+        )
+        await _limit(proc, apply_limits)
+        os.close(write_fd)
+        write_fd = None
+
+        loop = asyncio.get_running_loop()
+        frames = asyncio.StreamReader(limit=STREAM_CHUNK)
+        transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(frames), os.fdopen(read_fd, "rb", 0)
+        )
+        read_fd = None # The transport owns it now
+        out_chunks: List[bytes] = []
+        err_chunks: List[bytes] = []
+        readers = asyncio.gather(_drain(proc.stdout, out_chunks), _drain(proc.stderr, err_chunks))
+
+        deadline = loop.time() + timeout
+        timed_out = False
+        items = 0
+        while True:
+            try:
+                header = await asyncio.wait_for(frames.readexactly(FRAME_HEADER.size), deadline - loop.time())
+                kind, size = FRAME_HEADER.unpack(header)
+                payload = await asyncio.wait_for(frames.readexactly(size), deadline - loop.time())
+            except asyncio.IncompleteReadError:
+                break # Pipe closed: the function returned (or the runner died)
+            except asyncio.TimeoutError:
+                timed_out = True
+                _kill_group(proc)
+                break
+            if kind != ITEM:
+                continue
+            items += 1
+            yield ITEM, payload
+
+        try:
+            await asyncio.wait_for(proc.wait(), max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            timed_out = True
+            _kill_group(proc)
+            await proc.wait()
+        try:
+            await asyncio.wait_for(readers, 5)
+        except asyncio.TimeoutError:
+            pass
+
+        stdout = b"".join(out_chunks).decode("utf-8", errors="replace")
+        stderr = b"".join(err_chunks).decode("utf-8", errors="replace")
+        if timed_out:
+            result = {"status": "timeout", "stderr": stderr + f"\nExecution timed out ({timeout:g}s limit)", "return_code": -1}
+        elif proc.returncode != 0:
+            result = {"status": "error", "stderr": stderr or "Unknown error", "return_code": proc.returncode}
+        else:
+            result = {"status": "success", "stderr": stderr, "return_code": 0}
+        yield END, dict(result, stdout=stdout, items=items)
+
+    finally:
+        if proc is not None and proc.returncode is None:
+            _kill_group(proc) # Closed early: the client went away
+            await proc.wait()
+        if readers is not None and not readers.done():
+            readers.cancel()
+        if transport is not None:
+            transport.close()
+        for fd in (read_fd, write_fd):
+            if fd is not None:
+                os.close(fd)
+        for p in (input_path, runner_path):
             if os.path.exists(p):
                 try: os.remove(p)
                 except: pass
+
+
+# --- Blocking wrappers (scripts / tests without an event loop) ---
+
+def execute_code(code: str) -> dict:
+    return asyncio.run(run_code(code))
+
+def execute_pickle(pickle_hex: str) -> dict:
+    return asyncio.run(run_pickle(pickle_hex))
@@ -0,0 +1,309 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Optional, Dict, Any, List
+
+GPUHOST_HOME = os.environ.get("GPUHOST_HOME", os.path.join(os.path.expanduser("~"), ".gpuhost"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    owner_id TEXT NOT NULL,
+    type TEXT NOT NULL,
+    status TEXT NOT NULL,
+    submitted_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    return_code INTEGER,
+    output_path TEXT,
+    result_path TEXT,
+    preemptions INTEGER NOT NULL DEFAULT 0,
+    lost_seconds REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs(owner_id, submitted_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, submitted_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_submitted ON jobs(submitted_at);
+"""
+
+COLUMNS = [
+    "job_id", "owner_id", "type", "status", "submitted_at", "started_at",
+    "finished_at", "return_code", "output_path", "result_path", "preemptions", "lost_seconds"
+]
+
+# Columns added since the first schema: (name, definition), added to older databases on open
+ADDED_COLUMNS = [
+    ("preemptions", "INTEGER NOT NULL DEFAULT 0"),
+    ("lost_seconds", "REAL NOT NULL DEFAULT 0"),
+]
+
+# A job in one of these hasn't finished yet
+UNFINISHED = ("running", "queued", "preempted")
+
+_STOP = object()
+
+logger = logging.getLogger("gpuhost.job_store")
+
+
+class JobStore:
+    """
+    Durable record of every job run on this host.
+
+    Rows live in SQLite (WAL mode); stdout/stderr and pickled results are
+    written next to it as blob files and referenced by path. All writes go
+    through a single background writer thread so recording a job never
+    blocks the request that submitted it.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        retention_seconds: float = 7 * 24 * 3600,
+        max_jobs: int = 10000,
+    ):
+        self.path = path or os.path.join(GPUHOST_HOME, "jobs.db")
+        self.blob_dir = os.path.join(os.path.dirname(os.path.abspath(self.path)), "blobs")
+        self.retention_seconds = retention_seconds
+        self.max_jobs = max_jobs
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._local = threading.local()
+        self._open_lock = threading.Lock()
+        self._last_prune = 0.0
+        # Ids of jobs whose row is queued but not written yet (see exists)
+        self._pending: set = set()
+        self._pending_lock = threading.Lock()
+        # Off in the worker processes of a multi-process agent: the jobs they'd
+        # find running belong to their siblings, and the parent recovers at startup
+        self.recover_on_open = True
+
+    # --- Connection Handling ---
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _ensure_open(self):
+        if self._writer is not None:
+            return
+        with self._open_lock:
+            if self._writer is not None:
+                return
+            os.makedirs(self.blob_dir, exist_ok=True)
+            conn = self._connect()
+            conn.executescript(SCHEMA)
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for name, definition in ADDED_COLUMNS:
+                if name not in existing:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+            if self.recover_on_open:
+                # Unfinished jobs belong to a previous agent process that died
+                conn.execute(f"UPDATE jobs SET status = 'interrupted' WHERE status IN {UNFINISHED}")
+            conn.commit()
+            self._writer = threading.Thread(target=self._write_loop, args=(conn,), daemon=True)
+            self._writer.start()
+
+    def _reader(self) -> sqlite3.Connection:
+        # WAL readers never block the writer, one connection per thread
+        self._ensure_open()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _write_loop(self, conn: sqlite3.Connection):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    conn.close()
+                    return
+                fn, args = item
+                try:
+                    fn(conn, *args)
+                    conn.commit()
+                finally:
+                    if fn == self._insert:
+                        with self._pending_lock:
+                            self._pending.discard(args[0])
+                if time.time() - self._last_prune > 3600:
+                    self._prune(conn, time.time())
+            except Exception:
+                logger.exception("JobStore write failed")
+            finally:
+                self._queue.task_done()
+
+    def open(self):
+        """Open now rather than on first use (recovering jobs a dead agent left behind)."""
+        self._ensure_open()
+
+    def flush(self):
+        """Block until every queued write has hit the database."""
+        if self._writer is not None:
+            self._queue.join()
+
+    def close(self):
+        if self._writer is None:
+            return
+        self._queue.put(_STOP)
+        self._writer.join()
+        self._writer = None
+
+    # --- Writes (queued) ---
+
+    def record_submit(self, job_id: str, owner_id: str, job_type: str, status: str = "running"):
+        self._ensure_open()
+        with self._pending_lock:
+            self._pending.add(job_id)
+        self._queue.put((self._insert, (job_id, owner_id, job_type, status, time.time())))
+
+    def record_started(self, job_id: str):
+        """A queued job got its resources and is now running."""
+        self._ensure_open()
+        self._queue.put((self._start, (job_id, time.time())))
+
+    def record_preempted(self, job_id: str, lost_seconds: float):
+        """The job was stopped for a higher priority lock and waits to run again."""
+        self._ensure_open()
+        self._queue.put((self._preempt, (job_id, lost_seconds)))
+
+    def record_result(self, job_id: str, result: Dict[str, Any], started_at: Optional[float] = None):
+        self._ensure_open()
+        self._queue.put((self._finish, (job_id, dict(result), started_at, time.time())))
+
+    def _insert(self, conn, job_id, owner_id, job_type, status, now):
+        conn.execute(
+            "INSERT INTO jobs (job_id, owner_id, type, status, submitted_at, started_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, owner_id, job_type, status, now, now if status == "running" else None)
+        )
+
+    def _start(self, conn, job_id, now):
+        conn.execute("UPDATE jobs SET status = 'running', started_at = ? WHERE job_id = ?", (now, job_id))
+
+    def _preempt(self, conn, job_id, lost_seconds):
+        conn.execute(
+            "UPDATE jobs SET status = 'preempted', preemptions = preemptions + 1, "
+            "lost_seconds = lost_seconds + ? WHERE job_id = ?", (lost_seconds, job_id)
+        )
+
+    def _finish(self, conn, job_id, result, started_at, now):
+        output_path = os.path.join(self.blob_dir, f"{job_id}.out")
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(result.get("stdout") or "")
+            f.write("\0")
+            f.write(result.get("stderr") or "")
+
+        result_path = None
+        if result.get("result"):
+            result_path = os.path.join(self.blob_dir, f"{job_id}.result")
+            with open(result_path, "wb") as f:
+                f.write(bytes.fromhex(result["result"]))
+
+        conn.execute(
+            "UPDATE jobs SET status = ?, finished_at = ?, return_code = ?, output_path = ?, result_path = ?, "
+            "started_at = COALESCE(?, started_at) WHERE job_id = ?",
+            (result.get("status", "error"), now, result.get("return_code"),
+             output_path, result_path, started_at, job_id)
+        )
+
+    # --- Retention ---
+
+    def prune(self, now: Optional[float] = None):
+        """Apply the retention policy (age and row count) right away."""
+        self._ensure_open()
+        self._queue.put((self._prune, (now or time.time(),)))
+        self.flush()
+
+    def _prune(self, conn, now):
+        self._last_prune = now
+        cutoff = now - self.retention_seconds
+        expired = conn.execute(
+            "SELECT job_id, output_path, result_path FROM jobs "
+            f"WHERE submitted_at < ? AND status NOT IN {UNFINISHED}", (cutoff,)
+        ).fetchall()
+        overflow = conn.execute(
+            f"SELECT job_id, output_path, result_path FROM jobs WHERE status NOT IN {UNFINISHED} "
+            "ORDER BY submitted_at DESC LIMIT -1 OFFSET ?", (self.max_jobs,)
+        ).fetchall()
+
+        doomed = {row[0]: row for row in expired + overflow}
+        for job_id, output_path, result_path in doomed.values():
+            for p in (output_path, result_path):
+                if p and os.path.exists(p):
+                    try: os.remove(p)
+                    except OSError: pass
+        conn.executemany("DELETE FROM jobs WHERE job_id = ?", [(j,) for j in doomed])
+
+    # --- Reads ---
+
+    def exists(self, job_id: str) -> bool:
+        """The id is taken, whether or not its row has been written yet."""
+        with self._pending_lock:
+            if job_id in self._pending:
+                return True
+        return self._reader().execute("SELECT 1 FROM jobs WHERE job_id = ?", (job_id,)).fetchone() is not None
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._reader().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def list(
+        self,
+        owner_id: Optional[str] = None,
+        status: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: int = 100,
+    ) -> List[Dict[str, Any]]:
+        clauses, params = [], []
+        if owner_id is not None:
+            clauses.append("owner_id = ?")
+            params.append(owner_id)
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(status)
+        if since is not None:
+            clauses.append("submitted_at >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("submitted_at < ?")
+            params.append(until)
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._reader().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM jobs {where} ORDER BY submitted_at DESC LIMIT ?",
+            params + [limit]
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    def count(self, status: str) -> int:
+        return self._reader().execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+
+    def read_output(self, job: Dict[str, Any]) -> Dict[str, str]:
+        path = job.get("output_path")
+        if not path or not os.path.exists(path):
+            return {"stdout": "", "stderr": ""}
+        with open(path, "r", encoding="utf-8") as f:
+            stdout, _, stderr = f.read().partition("\0")
+        return {"stdout": stdout, "stderr": stderr}
+
+    def read_result(self, job: Dict[str, Any]) -> Optional[bytes]:
+        path = job.get("result_path")
+        if not path or not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+
+# Global Store Instance (opened lazily on first use)
+job_store = JobStore()
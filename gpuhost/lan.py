@@ -0,0 +1,164 @@
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import os
+import secrets
+import socket
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from gpuhost.lazy import lazy_import
+
+httpx = lazy_import("httpx")
+
+# Tells this agent apart from another one answering on the same LAN address
+AGENT_ID = uuid.uuid4().hex
+# A LAN address that doesn't answer this fast isn't worth it
+PROBE_TIMEOUT = 0.5
+# How long a clan node's chosen address is trusted before probing again
+ROUTE_TTL = 300.0
+# Most direct addresses a clan worker may advertise
+MAX_LAN_URLS = 8
+
+
+def local_addresses() -> List[str]:
+    """
+    IPv4 addresses other machines on the network may reach this one at.
+    GPUHOST_LAN_ADDRESSES (comma separated, empty to disable) overrides.
+    """
+    override = os.environ.get("GPUHOST_LAN_ADDRESSES")
+    if override is not None:
+        return [a.strip() for a in override.split(",") if a.strip()]
+
+    addresses = set()
+    try:
+        for info in socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET):
+            addresses.add(info[4][0])
+    except socket.gaierror:
+        pass
+    # The interface outbound traffic uses (connect() on UDP sends nothing)
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(("10.255.255.255", 1))
+            addresses.add(s.getsockname()[0])
+    except OSError:
+        pass
+    usable = [a for a in addresses if not (ipaddress.ip_address(a).is_loopback or ipaddress.ip_address(a).is_link_local)]
+    return sorted(usable)
+
+
+def lan_urls(port: int) -> List[str]:
+    return [f"http://{address}:{port}" for address in local_addresses()]
+
+
+def is_local_url(url: str) -> bool:
+    """Already a direct address (localhost or a private IP): nothing to gain from probing."""
+    host = urlparse(url).hostname or ""
+    if host == "localhost":
+        return True
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return address.is_private or address.is_loopback
+
+
+def valid_lan_url(url: str) -> bool:
+    """
+    A direct address a clan worker may advertise: plain http://<private IPv4>:<port>,
+    nothing else (the host probes these, so no hostnames, loopback or paths).
+    """
+    try:
+        parsed = urlparse(url)
+        address = ipaddress.ip_address(parsed.hostname or "")
+        port = parsed.port
+    except ValueError:
+        return False
+    return (
+        parsed.scheme == "http" and port is not None and address.version == 4
+        and address.is_private and not (address.is_loopback or address.is_link_local or address.is_unspecified)
+        and parsed.path in ("", "/") and not (parsed.query or parsed.fragment or parsed.username or parsed.password)
+    )
+
+
+def hello_proof(key: str, agent_id: str, nonce: str) -> str:
+    """What an agent holding `key` answers to a probe's nonce (see /lan/hello)."""
+    return hmac.new(key.encode(), f"{agent_id}:{nonce}".encode(), hashlib.sha256).hexdigest()
+
+
+def new_nonce() -> str:
+    return secrets.token_hex(16)
+
+
+def verify_hello(body, token: Optional[str], nonce: str, agent_id: Optional[str] = None) -> bool:
+    """
+    A /lan/hello answer comes from the agent we mean: the right agent_id and
+    proof it knows our key. Only then is the key sent to that address.
+    """
+    if not isinstance(body, dict) or not token:
+        return False
+    answered = body.get("agent_id")
+    if not isinstance(answered, str) or (agent_id and answered != agent_id):
+        return False
+    expected = hello_proof(token, answered, nonce)
+    return any(isinstance(p, str) and hmac.compare_digest(p, expected) for p in body.get("proofs") or [])
+
+
+async def probe(client, url: str, token: Optional[str], agent_id: Optional[str] = None) -> Optional[float]:
+    """Round trip to `url`'s /lan/hello in seconds, None if unreachable or not the agent we mean. Sends no key."""
+    nonce = new_nonce()
+    start = time.perf_counter()
+    try:
+        res = await client.get(f"{url}/lan/hello", params={"nonce": nonce}, timeout=PROBE_TIMEOUT)
+    except httpx.HTTPError:
+        return None
+    elapsed = time.perf_counter() - start
+    if res.status_code != 200:
+        return None
+    try:
+        body = res.json()
+    except ValueError:
+        return None
+    return elapsed if verify_hello(body, token, nonce, agent_id) else None
+
+
+async def fastest(urls: List[str], token: Optional[str], agent_id: Optional[str] = None) -> Optional[str]:
+    """The URL answering quickest, probed concurrently."""
+    async with httpx.AsyncClient() as client:
+        latencies = await asyncio.gather(*(probe(client, url, token, agent_id) for url in urls))
+    reachable = [(latency, url) for url, latency in zip(urls, latencies) if latency is not None]
+    return min(reachable)[1] if reachable else None
+
+
+class NodeRoutes:
+    """
+    Which address the clan host uses for each worker: one of its LAN
+    addresses when that answers faster than its public (tunnel) URL and
+    proves it's the same agent (workers only advertise them with --lan).
+    """
+
+    def __init__(self, ttl: float = ROUTE_TTL):
+        self.ttl = ttl
+        self._routes: Dict[str, Tuple[str, float]] = {} # node id -> url, chosen at
+
+    async def url(self, node) -> str:
+        if not node.lan_urls:
+            return node.url
+        cached = self._routes.get(node.id)
+        if cached and time.time() - cached[1] < self.ttl:
+            return cached[0]
+        url = await fastest([node.url] + node.lan_urls, node.token, node.agent_id) or node.url
+        self._routes[node.id] = (url, time.time())
+        return url
+
+    def failed(self, node, url: str):
+        """`url` stopped answering: use the public URL until the next probe."""
+        if url != node.url:
+            self._routes[node.id] = (node.url, time.time())
+
+
+# Global Routes Instance
+node_routes = NodeRoutes()
@@ -0,0 +1,21 @@
+import importlib.util
+import sys
+
+
+def lazy_import(name: str):
+    """
+    Returns module `name`, executed only when one of its attributes is
+    first used. Keeps heavy dependencies (requests, dill) out of the import
+    time of the client and CLI, which short-lived scripts pay on every run.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import time
+from typing import Any, Callable, Dict, Optional, Set
+
+# At most this many pushes per second, however often state changes
+DEFAULT_MAX_RATE = 2.0
+# Sections with an interval (telemetry) are sampled this often, others on every wake-up
+DEFAULT_SAMPLE_INTERVAL = 2.0
+# Comment line sent when nothing changed for a while, keeps proxies/tunnels from closing the stream
+KEEPALIVE_INTERVAL = 15.0
+# With several API worker processes, how often sections are re-checked without a notify()
+SHARED_POLL_INTERVAL = 1.0
+# Pushes buffered per subscriber before it's considered too slow and resynced
+SUBSCRIBER_BUFFER = 16
+
+
+class LiveFeed:
+    """
+    Server-sent events for the dashboard.
+
+    One producer task, running only while someone is subscribed, samples
+    each registered section (lock state, telemetry, queue, clan...) and
+    pushes the ones that changed since the last push. Every event is
+    encoded once and the same bytes go to every subscriber, so NVML reads
+    and JSON rendering don't grow with the number of open dashboards.
+    Changes are coalesced to at most `max_rate` pushes per second.
+
+    notify() only reaches this process's feed: with several API worker
+    processes, `poll_interval` makes it re-check sections on a timer too.
+    """
+
+    def __init__(self, max_rate: float = DEFAULT_MAX_RATE):
+        self.max_rate = max_rate
+        self._sections: Dict[str, Dict[str, Any]] = {} # name -> provider, interval, sampled_at, encoded
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._wake: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._producer: Optional[asyncio.Future] = None
+        self.poll_interval: Optional[float] = None
+        self.pushes = 0
+
+    def add_section(self, name: str, provider: Callable[[], Any], interval: Optional[float] = None,
+                    blocking: bool = False):
+        """
+        `provider()` returns the section's JSON-able value; `interval` for
+        polled data like telemetry. `blocking` providers (NVML reads...) run
+        in the default executor so they don't stall the event loop.
+        """
+        self._sections[name] = {"provider": provider, "interval": interval, "blocking": blocking,
+                                "sampled_at": 0.0, "encoded": None}
+
+    def notify(self):
+        """Something may have changed: re-check the cheap sections soon. Thread-safe."""
+        if self._wake is None or self._loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError: # Sync endpoint in the threadpool
+            running = None
+        if running is self._loop:
+            self._wake.set()
+        else:
+            try:
+                self._loop.call_soon_threadsafe(self._wake.set)
+            except RuntimeError: # Loop closed
+                pass
+
+    async def _sample(self, now: float, force: bool = False) -> Dict[str, str]:
+        """Encoded value of every section that changed."""
+        loop = asyncio.get_running_loop()
+        changed = {}
+        for name, section in self._sections.items():
+            interval = section["interval"]
+            if not force and interval and now - section["sampled_at"] < interval:
+                continue
+            section["sampled_at"] = now
+            provider = section["provider"]
+            value = await loop.run_in_executor(None, provider) if section["blocking"] else provider()
+            encoded = json.dumps(value, sort_keys=True, default=str)
+            if encoded != section["encoded"]:
+                section["encoded"] = encoded
+                changed[name] = encoded
+        return changed
+
+    def _snapshot(self) -> bytes:
+        return _event({n: s["encoded"] for n, s in self._sections.items() if s["encoded"] is not None})
+
+    def _publish(self, message: bytes):
+        self.pushes += 1
+        for queue in list(self._subscribers):
+            if queue.full():
+                # Too slow to keep up with diffs: drop its backlog, resend everything
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self._snapshot())
+            else:
+                queue.put_nowait(message)
+
+    async def _produce(self):
+        last_push = time.monotonic()
+        while self._subscribers:
+            timeout = min([s["interval"] for s in self._sections.values() if s["interval"]]
+                          + [self.poll_interval or KEEPALIVE_INTERVAL, KEEPALIVE_INTERVAL])
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            # Coalesce: whatever happens until the next slot goes out as one push
+            await asyncio.sleep(max(0.0, last_push + 1.0 / self.max_rate - time.monotonic()))
+            self._wake.clear()
+
+            changed = await self._sample(time.time())
+            if changed:
+                self._publish(_event(changed))
+                last_push = time.monotonic()
+            elif time.monotonic() - last_push >= KEEPALIVE_INTERVAL:
+                self._publish(b": keepalive\n\n")
+                last_push = time.monotonic()
+        self._producer = None
+
+    async def subscribe(self) -> asyncio.Queue:
+        """A queue of SSE messages, starting with the full current state."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_BUFFER)
+        if not self._subscribers:
+            await self._sample(time.time(), force=True) # Nobody was watching: state is stale
+        queue.put_nowait(self._snapshot())
+        self._subscribers.add(queue)
+        if self._producer is None or self._producer.done():
+            self._loop = asyncio.get_running_loop()
+            self._wake = asyncio.Event()
+            self._producer = asyncio.ensure_future(self._produce())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+        self.notify() # Lets the producer notice it's alone
+
+    def stats(self) -> Dict[str, Any]:
+        return {"subscribers": len(self._subscribers), "pushes": self.pushes, "max_rate": self.max_rate}
+
+
+def _event(encoded_sections: Dict[str, str]) -> bytes:
+    """One SSE message from already encoded section values (no re-encoding)."""
+    body = ",".join(f"{json.dumps(name)}:{value}" for name, value in encoded_sections.items())
+    return f"data: {{{body}}}\n\n".encode("utf-8")
+
+
+# Global Feed Instance
+live_feed = LiveFeed()
@@ -0,0 +1,147 @@
+import os
+import threading
+import time
+import uuid
+from typing import Dict, Optional, Any
+
+from gpuhost.job_store import GPUHOST_HOME
+
+OBJECT_DIR = os.path.join(GPUHOST_HOME, "objects")
+
+# Objects nobody touched for this long are freed even if refs are still held
+OBJECT_TTL = 3600
+# How often the API frees expired objects
+SWEEP_INTERVAL = 60
+
+
+class ObjectStore:
+    """
+    Pickled results kept on the host so they can be passed to later jobs
+    without a round trip through the client.
+
+    Each object belongs to the owner whose job made it, who holds it until
+    releasing it; jobs using it pin it meanwhile. It is freed once released
+    and unpinned, or when it hasn't been accessed for `ttl` seconds and no
+    job is using it (see expire, run periodically by the API).
+    """
+
+    def __init__(self, directory: Optional[str] = None, ttl: float = OBJECT_TTL):
+        self.directory = directory or OBJECT_DIR
+        self.ttl = ttl
+        self._objects: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def new_path(self) -> str:
+        """Where a job should write a result that will become an object."""
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, f"{uuid.uuid4()}.pkl")
+
+    def put(self, path: str, owner_id: str) -> str:
+        """Registers a pickle file written by a job; `owner_id` holds it."""
+        ref = os.path.splitext(os.path.basename(path))[0]
+        with self._lock:
+            self._objects[ref] = {
+                "path": path,
+                "owner_id": owner_id,
+                "size": os.path.getsize(path),
+                "held": True,
+                "pins": 0,
+                "last_access": time.time(),
+            }
+        return ref
+
+    def _touch(self, ref: str, owner_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """The object if it exists and (unless owner_id is None) belongs to owner_id."""
+        obj = self._objects.get(ref)
+        if obj is None or (owner_id is not None and obj["owner_id"] != owner_id):
+            return None
+        obj["last_access"] = time.time()
+        return obj
+
+    def info(self, ref: str, owner_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            obj = self._touch(ref, owner_id)
+            return dict(obj) if obj else None
+
+    def read(self, ref: str, owner_id: str) -> Optional[bytes]:
+        with self._lock:
+            obj = self._touch(ref, owner_id)
+            if not obj:
+                return None
+            path = obj["path"]
+        with open(path, "rb") as f:
+            return f.read()
+
+    def acquire(self, ref: str, owner_id: str) -> Optional[str]:
+        """Pins an object for a job; returns its path on the host."""
+        with self._lock:
+            obj = self._touch(ref, owner_id)
+            if not obj:
+                return None
+            obj["pins"] += 1
+            return obj["path"]
+
+    def unpin(self, ref: str):
+        """A job using the object is done with it."""
+        with self._lock:
+            obj = self._objects.get(ref)
+            if obj:
+                obj["pins"] -= 1
+                self._free_unused(ref, obj)
+
+    def release(self, ref: str, owner_id: str) -> bool:
+        """The owner lets go of it (again: no-op). False if unknown or someone else's."""
+        with self._lock:
+            obj = self._objects.get(ref)
+            if not obj or obj["owner_id"] != owner_id:
+                return False
+            obj["held"] = False
+            self._free_unused(ref, obj)
+            return True
+
+    def _free_unused(self, ref: str, obj: Dict[str, Any]):
+        if not obj["held"] and obj["pins"] <= 0:
+            self._delete(ref)
+
+    def _delete(self, ref: str):
+        obj = self._objects.pop(ref)
+        try:
+            os.remove(obj["path"])
+        except OSError:
+            pass
+
+    def expire(self, now: Optional[float] = None):
+        """Frees objects idle for longer than the TTL, unless a job is using them."""
+        now = now or time.time()
+        with self._lock:
+            for ref, obj in list(self._objects.items()):
+                if obj["pins"] <= 0 and now - obj["last_access"] > self.ttl:
+                    self._delete(ref)
+
+    def remove_orphans(self, now: Optional[float] = None):
+        """Deletes stale result files no object points to (left over by an earlier agent run)."""
+        now = now or time.time()
+        with self._lock:
+            known = {obj["path"] for obj in self._objects.values()}
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                if path not in known and now - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "objects": len(self._objects),
+                "bytes": sum(o["size"] for o in self._objects.values()),
+            }
+
+
+# Global Store Instance
+object_store = ObjectStore()
@@ -0,0 +1,197 @@
+import asyncio
+import contextlib
+import contextvars
+import signal
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from gpuhost.state import state, PRIORITY_CLASSES, DEFAULT_PRIORITY
+
+DEFAULT_GRACE = 30.0
+DEFAULT_SIGNAL = signal.SIGTERM
+# Highest class each kind of API key may lock at (roles as in ClanState.key_roles;
+# the agent's own key is "admin"). Configurable for clan keys with --preempt-client-max
+DEFAULT_MAX_PRIORITY = {"admin": "interactive", "worker": DEFAULT_PRIORITY, "client": DEFAULT_PRIORITY}
+# Extra wait for a preempted job to be gone after its grace period (the SIGKILL landing)
+STOP_MARGIN = 5.0
+
+
+def priority_rank(priority: Optional[str]) -> int:
+    """Rank of a priority class (higher wins). ValueError if unknown."""
+    if priority not in PRIORITY_CLASSES:
+        raise ValueError(f"Unknown priority {priority!r}, expected one of: {', '.join(PRIORITY_CLASSES)}")
+    return PRIORITY_CLASSES[priority]
+
+
+class JobAttempt:
+    """One run of a job under the lock, until it ends or is preempted."""
+
+    def __init__(self, job_id: str, owner_id: str, started_at: float):
+        self.job_id = job_id
+        self.owner_id = owner_id
+        self.started_at = started_at
+        self.ended_at: Optional[float] = None
+        # Resolves to (signal, grace seconds) when the job has to stop
+        self.stop: asyncio.Future = asyncio.get_running_loop().create_future()
+        # Set once the job's process actually got the signal (see job_manager.run_process):
+        # a job that finished just before isn't run again
+        self.signalled = False
+        self.exited = asyncio.Event()
+
+    @property
+    def duration(self) -> float:
+        return (self.ended_at or time.time()) - self.started_at
+
+
+# The attempt the current task is running, for run_process() to stop it gracefully
+current_attempt: contextvars.ContextVar[Optional[JobAttempt]] = contextvars.ContextVar(
+    "gpuhost_attempt", default=None
+)
+
+
+class _Waiter:
+    """An owner whose lock was taken by a higher priority one."""
+
+    def __init__(self, priority: str, preempted_at: float):
+        self.priority = priority
+        self.preempted_at = preempted_at
+        self.turn: asyncio.Future = asyncio.get_running_loop().create_future() # True: lock is back
+
+
+class Preemption:
+    """
+    Priority classes for the exclusive lock.
+
+    Off by default: a busy lock is refused whatever the priority.
+    Enabled (`gpuhost start --preempt`), a request of a higher class than
+    the holder's takes the lock over. The holder's running jobs get
+    `signal` (SIGTERM by default) and `grace` seconds to checkpoint and
+    exit before they're killed, then wait: once the GPU is free again the
+    lock goes back to the highest priority owner waiting for it, and its
+    jobs run again from the start (a job that saved a checkpoint resumes
+    from it). Preemptions and the GPU time of the interrupted runs are
+    counted here and per job in the job store.
+
+    Keys are capped (`max_priority`): by default only the agent's own
+    (admin) key may ask for "interactive", clan keys for "normal" at most.
+
+    Per process: the agent refuses --preempt with several API workers.
+    """
+
+    def __init__(self, grace: float = DEFAULT_GRACE, sig: int = DEFAULT_SIGNAL,
+                 clock: Callable[[], float] = time.time):
+        self.enabled = False
+        self.grace = grace
+        self.signal = sig
+        self.clock = clock
+        self.max_priority = dict(DEFAULT_MAX_PRIORITY)
+        self._attempts: Dict[str, JobAttempt] = {}
+        self._waiting: Dict[str, _Waiter] = {} # owner_id -> preempted lock
+        self.preemptions = 0
+        self.jobs_preempted = 0
+        self.gpu_seconds_lost = 0.0
+
+    def allowed(self, priority: str, role: str) -> bool:
+        """Whether a key of `role` may lock at `priority`."""
+        return priority_rank(priority) <= priority_rank(self.max_priority.get(role, DEFAULT_PRIORITY))
+
+    def can_preempt(self, holder: Dict[str, Any], priority: str) -> bool:
+        return self.enabled and priority_rank(priority) > priority_rank(holder.get("priority", DEFAULT_PRIORITY))
+
+    def is_waiting(self, owner_id: str) -> bool:
+        return owner_id in self._waiting
+
+    @contextlib.contextmanager
+    def track(self, job_id: str, owner_id: str):
+        """Registers a running job of `owner_id` as preemptible."""
+        attempt = JobAttempt(job_id, owner_id, self.clock())
+        self._attempts[job_id] = attempt
+        try:
+            yield attempt
+        finally:
+            attempt.ended_at = self.clock()
+            if self._attempts.get(job_id) is attempt:
+                del self._attempts[job_id]
+            if attempt.signalled:
+                self.jobs_preempted += 1
+                self.gpu_seconds_lost += attempt.duration
+            attempt.exited.set()
+
+    @contextlib.contextmanager
+    def attempt(self, job_id: str, owner_id: str):
+        """track(), and the job's process is stopped with the grace period when preempted."""
+        with self.track(job_id, owner_id) as attempt:
+            token = current_attempt.set(attempt)
+            try:
+                yield attempt
+            finally:
+                current_attempt.reset(token)
+
+    async def preempt(self, holder: Dict[str, Any], owner_id: str, priority: str) -> Optional[List[str]]:
+        """
+        Hands the lock from `holder` to `owner_id` and stops the holder's
+        running jobs, returning once they're gone. Their ids, or None if the
+        lock changed meanwhile.
+        """
+        if not state.transfer(holder, owner_id, priority):
+            return None
+        self.preemptions += 1
+        previous = holder["owner_id"]
+        if previous not in self._waiting:
+            self._waiting[previous] = _Waiter(holder.get("priority", DEFAULT_PRIORITY), self.clock())
+        self._granted(owner_id) # In case it was waiting on a preemption itself
+
+        attempts = [a for a in self._attempts.values() if a.owner_id == previous]
+        for attempt in attempts:
+            if not attempt.stop.done():
+                attempt.stop.set_result((self.signal, self.grace))
+        if attempts:
+            await asyncio.wait([asyncio.ensure_future(a.exited.wait()) for a in attempts],
+                               timeout=self.grace + STOP_MARGIN)
+        return [a.job_id for a in attempts]
+
+    async def wait_turn(self, owner_id: str) -> bool:
+        """After a preemption: True once `owner_id` holds the lock again, False if it gave it up."""
+        waiter = self._waiting.get(owner_id)
+        if waiter is None:
+            return state.owner_id == owner_id
+        return await asyncio.shield(waiter.turn)
+
+    def resume(self):
+        """Gives the free lock back to the highest priority preempted owner (earliest first)."""
+        while self._waiting and not state.is_locked:
+            owner_id, waiter = max(
+                self._waiting.items(), key=lambda w: (priority_rank(w[1].priority), -w[1].preempted_at)
+            )
+            if state.lock(owner_id, waiter.priority):
+                self._granted(owner_id)
+
+    def release(self, owner_id: str) -> bool:
+        """A preempted owner gives up its lock: its waiting jobs won't run again. False if it wasn't waiting."""
+        waiter = self._waiting.pop(owner_id, None)
+        if waiter is None:
+            return False
+        if not waiter.turn.done():
+            waiter.turn.set_result(False)
+        return True
+
+    def _granted(self, owner_id: str):
+        waiter = self._waiting.pop(owner_id, None)
+        if waiter is not None and not waiter.turn.done():
+            waiter.turn.set_result(True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "grace": self.grace,
+            "signal": signal.Signals(self.signal).name,
+            "max_priority": self.max_priority,
+            "preemptions": self.preemptions,
+            "jobs_preempted": self.jobs_preempted,
+            "gpu_seconds_lost": round(self.gpu_seconds_lost, 3),
+            "waiting_owners": len(self._waiting),
+        }
+
+
+# Global Preemption Instance
+preemption = Preemption()
@@ -0,0 +1,220 @@
+import asyncio
+import collections
+import math
+import time
+from typing import Any, Callable, Dict, Optional
+
+# Per API key: sustained requests per second and burst
+DEFAULT_KEY_RATE = 20.0
+DEFAULT_KEY_BURST = 40.0
+# Per owner (client instance)
+DEFAULT_OWNER_RATE = 10.0
+DEFAULT_OWNER_BURST = 20.0
+# Requests in progress at once, per key / per owner
+DEFAULT_KEY_CONCURRENCY = 32
+DEFAULT_OWNER_CONCURRENCY = 8
+# Requests running at once across all keys, and how many may wait for a slot
+DEFAULT_MAX_INFLIGHT = 64
+DEFAULT_MAX_QUEUED = 128
+# Owners tracked at once (client generated ids, so bounded; the idlest are forgotten)
+MAX_OWNERS = 10000
+
+
+class RateLimited(Exception):
+    """Rejected by a limit; the client should retry after `retry_after` seconds (429)."""
+
+    def __init__(self, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """0 if a token was taken, else seconds until one is available."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+
+class _Counters:
+    """Rate bucket plus requests in progress, for one key or owner."""
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.bucket = TokenBucket(rate, burst, now)
+        self.active = 0
+
+
+class Ticket:
+    """An admitted request: what to give back when it's done."""
+
+    def __init__(self, key: str, started: float):
+        self.key = key
+        self.owner: Optional[str] = None
+        self.started = started
+
+
+class RateLimiter:
+    """
+    Backpressure for the expensive endpoints (jobs, maps, chat).
+
+    Every request spends a token from its key's bucket and takes one of the
+    key's concurrency slots, then one of the `max_inflight` global slots,
+    waiting in a bounded FIFO queue if they are all busy. Endpoints that
+    know the owner also claim() a slot and a token for it. Anything over a
+    limit (or a full queue) is rejected right away with RateLimited instead
+    of piling up. Checks are dict lookups, no scans.
+    """
+
+    def __init__(
+        self,
+        key_rate: float = DEFAULT_KEY_RATE,
+        key_burst: float = DEFAULT_KEY_BURST,
+        owner_rate: float = DEFAULT_OWNER_RATE,
+        owner_burst: float = DEFAULT_OWNER_BURST,
+        key_concurrency: int = DEFAULT_KEY_CONCURRENCY,
+        owner_concurrency: int = DEFAULT_OWNER_CONCURRENCY,
+        max_inflight: int = DEFAULT_MAX_INFLIGHT,
+        max_queued: int = DEFAULT_MAX_QUEUED,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.key_rate = key_rate
+        self.key_burst = key_burst
+        self.owner_rate = owner_rate
+        self.owner_burst = owner_burst
+        self.key_concurrency = key_concurrency
+        self.owner_concurrency = owner_concurrency
+        self.max_inflight = max_inflight
+        self.max_queued = max_queued
+        self.clock = clock
+        self._keys: Dict[str, _Counters] = {}
+        self._owners: "collections.OrderedDict[str, _Counters]" = collections.OrderedDict()
+        self._waiters: "collections.deque[asyncio.Future]" = collections.deque()
+        self.inflight = 0
+        self.admitted = 0
+        self.rejected: Dict[str, int] = collections.Counter()
+        self._hold = 1.0 # Moving average of how long requests hold a slot (for Retry-After)
+
+    def split(self, workers: int):
+        """
+        Scale the limits down to one of `workers` API processes. Each process
+        counts on its own, so together they allow roughly the configured totals.
+        """
+        self.key_rate /= workers
+        self.key_burst = max(1.0, self.key_burst / workers)
+        self.owner_rate /= workers
+        self.owner_burst = max(1.0, self.owner_burst / workers)
+        self.key_concurrency = max(1, self.key_concurrency // workers)
+        self.owner_concurrency = max(1, self.owner_concurrency // workers)
+        self.max_inflight = max(1, self.max_inflight // workers)
+        self.max_queued = max(1, self.max_queued // workers)
+
+    def _reject(self, reason: str, detail: str, retry_after: float):
+        self.rejected[reason] += 1
+        raise RateLimited(detail, retry_after)
+
+    def _counters(self, table: Dict[str, _Counters], name: str, rate: float, burst: float) -> _Counters:
+        counters = table.get(name)
+        if counters is None:
+            counters = table[name] = _Counters(rate, burst, self.clock())
+        return counters
+
+    async def admit(self, key: Optional[str]) -> Ticket:
+        key = key or "anonymous" # No auth configured (dev mode)
+        now = self.clock()
+        counters = self._counters(self._keys, key, self.key_rate, self.key_burst)
+        if counters.active >= self.key_concurrency:
+            self._reject("key_concurrency", "Too many requests in progress for this key", self._hold)
+        wait = counters.bucket.take(now)
+        if wait:
+            self._reject("key_rate", "Rate limit exceeded for this key", wait)
+
+        # Queued requests count against their key too, so one key can't fill the queue
+        counters.active += 1
+        try:
+            await self._acquire_slot()
+        except BaseException:
+            counters.active -= 1
+            raise
+        self.admitted += 1
+        return Ticket(key, self.clock())
+
+    async def _acquire_slot(self):
+        if self.inflight < self.max_inflight:
+            self.inflight += 1
+            return
+        if len(self._waiters) >= self.max_queued:
+            self._reject("queue_full", "Server busy, admission queue is full", self._hold)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter # release() hands its slot over
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release_slot() # Got the slot as we were cancelled: pass it on
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+
+    def claim(self, ticket: Ticket, owner_id: Optional[str]):
+        """Also count the request against its owner. Released with the ticket."""
+        if not owner_id or ticket.owner is not None:
+            return
+        counters = self._counters(self._owners, owner_id, self.owner_rate, self.owner_burst)
+        self._owners.move_to_end(owner_id)
+        if counters.active >= self.owner_concurrency:
+            self._reject("owner_concurrency", "Too many requests in progress for this owner", self._hold)
+        wait = counters.bucket.take(self.clock())
+        if wait:
+            self._reject("owner_rate", "Rate limit exceeded for this owner", wait)
+        counters.active += 1
+        ticket.owner = owner_id
+        while len(self._owners) > MAX_OWNERS:
+            idle = next((o for o, c in self._owners.items() if c.active == 0), None)
+            if idle is None:
+                break
+            del self._owners[idle]
+
+    def _release_slot(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None) # The slot moves to the waiter, inflight unchanged
+                return
+        self.inflight -= 1
+
+    def release(self, ticket: Ticket):
+        held = self.clock() - ticket.started
+        self._hold += 0.1 * (held - self._hold)
+        self._keys[ticket.key].active -= 1
+        if ticket.owner is not None and ticket.owner in self._owners:
+            self._owners[ticket.owner].active -= 1
+        self._release_slot()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "inflight": self.inflight,
+            "queued": len(self._waiters),
+            "max_inflight": self.max_inflight,
+            "max_queued": self.max_queued,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+        }
+
+
+def retry_after_header(seconds: float) -> str:
+    """Retry-After takes whole seconds."""
+    return str(max(1, math.ceil(seconds)))
+
+
+# Global Limiter Instance
+rate_limiter = RateLimiter()
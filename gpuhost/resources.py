@@ -0,0 +1,145 @@
+import os
+from pydantic import BaseModel
+from typing import Optional, List, Dict, Callable, Tuple
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+from gpuhost.gpu import get_gpu_cpu_affinity
+
+THREAD_ENV_VARS = [
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+]
+
+class ResourceBudget(BaseModel):
+    cpus: Optional[List[int]] = None # CPU set. Default: cores local to the job's GPU
+    nice: Optional[int] = None # 0 (normal) .. 19 (lowest priority)
+    memory_bytes: Optional[int] = None # RLIMIT_DATA (not RLIMIT_AS: CUDA maps far more address space than it uses)
+    max_open_files: Optional[int] = None # RLIMIT_NOFILE
+    threads: Optional[int] = None # OMP_NUM_THREADS & co. Default: len(cpus)
+
+# Cores the agent keeps for itself (event loop, API), never handed to jobs
+RESERVED_CORES: List[int] = []
+# Cores this process was allowed to use before reserve_agent_cores()
+_all_cores: Optional[List[int]] = None
+
+
+def _can_pin() -> bool:
+    return hasattr(os, "sched_setaffinity")
+
+def available_cores() -> List[int]:
+    if _all_cores is not None:
+        return list(_all_cores)
+    if _can_pin():
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def reserve_agent_cores(cores: Optional[List[int]] = None, count: int = 1) -> List[int]:
+    """
+    Pins the agent to `cores` and keeps them out of every job's CPU set.
+    With no argument `count` cores (one per API worker process) are
+    reserved on machines with at least 4 cores per reserved core.
+    Call before the server starts so its threads inherit the affinity.
+    """
+    global RESERVED_CORES, _all_cores
+    if not _can_pin():
+        return []
+
+    allowed = available_cores()
+    if cores is None:
+        cores = allowed[:count] if len(allowed) >= 4 * count else []
+    cores = [c for c in cores if c in allowed]
+    if not cores or len(cores) >= len(allowed):
+        return []
+
+    _all_cores = allowed
+    RESERVED_CORES = sorted(cores)
+    os.sched_setaffinity(0, RESERVED_CORES)
+    return RESERVED_CORES
+
+def inherit_reserved_cores(reserved: List[int], all_cores: Optional[List[int]]):
+    """In an agent worker process: the parent's reservation, already pinned."""
+    global RESERVED_CORES, _all_cores
+    RESERVED_CORES = list(reserved)
+    _all_cores = list(all_cores) if all_cores is not None else None
+
+def default_job_cores(gpu_index: int = 0) -> List[int]:
+    """Cores local to the GPU (NUMA-wise), minus the agent's reserved cores."""
+    allowed = [c for c in available_cores() if c not in RESERVED_CORES]
+    local = get_gpu_cpu_affinity(gpu_index)
+    if local:
+        near = [c for c in allowed if c in local]
+        if near:
+            return near
+    return allowed
+
+
+def prepare(budget: Optional[ResourceBudget], gpu_index: int = 0) -> Tuple[Optional[Callable[[int], None]], Dict[str, str]]:
+    """
+    Validates a job's budget and turns it into what the executor needs:
+    a function applying it to the job's process right after it's spawned
+    (given its pid: no preexec_fn, which isn't safe in a threaded agent),
+    and the env. Raises ValueError for budgets this host can't honour.
+    """
+    budget = budget or ResourceBudget()
+    env = dict(os.environ)
+
+    # 1. CPU set (always applied: children inherit the agent's reserved cores otherwise)
+    cpus = None
+    if _can_pin():
+        if budget.cpus is not None:
+            allowed = set(available_cores()) - set(RESERVED_CORES)
+            bad = [c for c in budget.cpus if c not in allowed]
+            if bad or not budget.cpus:
+                raise ValueError(f"CPUs not available to jobs: {bad or budget.cpus}")
+            cpus = sorted(set(budget.cpus))
+        else:
+            cpus = default_job_cores(gpu_index)
+
+    # 2. Thread pools sized to the CPU set so BLAS/OpenMP don't oversubscribe
+    threads = budget.threads or (len(cpus) if cpus else None)
+    if threads is not None:
+        if threads < 1:
+            raise ValueError("threads must be >= 1")
+        for var in THREAD_ENV_VARS:
+            env[var] = str(threads)
+
+    # 3. Priority and rlimits
+    if budget.nice is not None and not 0 <= budget.nice <= 19:
+        raise ValueError("nice must be between 0 and 19")
+    limits = []
+    if budget.memory_bytes is not None or budget.max_open_files is not None:
+        if resource is None or not hasattr(resource, "prlimit"):
+            raise ValueError("Resource limits are not supported on this platform")
+        if budget.memory_bytes is not None:
+            if budget.memory_bytes <= 0:
+                raise ValueError("memory_bytes must be > 0")
+            limits.append((resource.RLIMIT_DATA, budget.memory_bytes))
+        if budget.max_open_files is not None:
+            _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+            if budget.max_open_files <= 0:
+                raise ValueError("max_open_files must be > 0")
+            if hard != resource.RLIM_INFINITY and budget.max_open_files > hard:
+                raise ValueError(f"max_open_files above host limit ({hard})")
+            limits.append((resource.RLIMIT_NOFILE, budget.max_open_files))
+
+    nice = budget.nice
+    if cpus is None and nice is None and not limits:
+        return None, env
+
+    def apply(pid: int):
+        if cpus is not None:
+            os.sched_setaffinity(pid, cpus)
+        if nice:
+            # Relative to the agent, like os.nice() in the child
+            os.setpriority(os.PRIO_PROCESS, pid, min(19, os.getpriority(os.PRIO_PROCESS, 0) + nice))
+        for which, value in limits:
+            resource.prlimit(pid, which, (value, value))
+
+    return apply, env
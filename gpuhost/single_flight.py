@@ -0,0 +1,102 @@
+import asyncio
+import collections
+import time
+from typing import Dict, Optional, Any, Tuple
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def _result_size(result: Dict[str, Any]) -> int:
+    return sum(len(v) for v in result.values() if isinstance(v, str))
+
+
+class SingleFlight:
+    """
+    Identical jobs share one execution.
+
+    While a job is running, submissions with the same key join it instead
+    of running again. Successful results can also be memoized for a while
+    (per-request TTL), bounded by entry count and bytes, least recently
+    used first.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._in_flight: Dict[str, Tuple[str, asyncio.Future]] = {} # key -> (job_id, job)
+        self._memo: "collections.OrderedDict[str, Dict[str, Any]]" = collections.OrderedDict()
+        self._memo_bytes = 0
+        self.executions = 0
+        self.joined = 0
+        self.memo_hits = 0
+
+    def recall(self, key: str, max_age: Optional[float], now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """A memoized result no older than `max_age` seconds (None: don't use memoized results)."""
+        if max_age is None:
+            return None
+        now = now or time.time()
+        entry = self._memo.get(key)
+        if entry is None:
+            return None
+        if now >= entry["expires"]:
+            self._forget(key)
+            return None
+        if now - entry["stored_at"] > max_age:
+            return None
+        self._memo.move_to_end(key)
+        self.memo_hits += 1
+        return dict(entry["result"], memoized_from=entry["job_id"])
+
+    def join(self, key: str) -> Optional[Tuple[str, asyncio.Future]]:
+        """The (job_id, job) already running for `key`, if any."""
+        flight = self._in_flight.get(key)
+        if flight and not flight[1].done():
+            self.joined += 1
+            return flight
+        return None
+
+    def start(self, key: str, job_id: str, job: asyncio.Future, memo_ttl: Optional[float] = None):
+        """Registers a new execution; its successful result is kept `memo_ttl` seconds."""
+        self.executions += 1
+        self._in_flight[key] = (job_id, job)
+
+        def done(fut: asyncio.Future):
+            if self._in_flight.get(key, (None, None))[1] is fut:
+                del self._in_flight[key]
+            if memo_ttl and not fut.cancelled() and fut.exception() is None:
+                result = fut.result()
+                if result.get("status") == "success":
+                    self._remember(key, job_id, result, memo_ttl)
+
+        job.add_done_callback(done)
+
+    def _remember(self, key: str, job_id: str, result: Dict[str, Any], ttl: float):
+        size = _result_size(result)
+        if size > self.max_bytes:
+            return
+        self._forget(key)
+        now = time.time()
+        self._memo[key] = {"job_id": job_id, "result": dict(result), "size": size, "stored_at": now, "expires": now + ttl}
+        self._memo_bytes += size
+        while len(self._memo) > self.max_entries or self._memo_bytes > self.max_bytes:
+            self._forget(next(iter(self._memo)))
+
+    def _forget(self, key: str):
+        entry = self._memo.pop(key, None)
+        if entry:
+            self._memo_bytes -= entry["size"]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._in_flight),
+            "executions": self.executions,
+            "joined": self.joined,
+            "memo_hits": self.memo_hits,
+            "memo_entries": len(self._memo),
+            "memo_bytes": self._memo_bytes,
+        }
+
+
+# Global Instance
+single_flight = SingleFlight()
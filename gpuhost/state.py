@@ -1,6 +1,16 @@
 from datetime import datetime
 from typing import Optional, Dict
-import threading
+import time
+
+from gpuhost.state_backend import StateBackend, state_backend
+
+# Backend key holding {"owner_id", "since", "priority"} while the GPU is locked
+LOCK_KEY = "gpu_lock"
+
+# Lock priority classes, lowest first. A higher class can preempt the
+# holder when the agent allows it (see gpuhost.preemption)
+PRIORITY_CLASSES = {"batch": 0, "normal": 1, "interactive": 2}
+DEFAULT_PRIORITY = "normal"
 
 class GPUState:
     _instance = None
@@ -8,51 +18,81 @@ class GPUState:
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(GPUState, cls).__new__(cls)
-            cls._instance.is_locked = False
-            cls._instance.owner_id: Optional[str] = None
-            cls._instance.workload_start_time: Optional[datetime] = None
+            # The lock lives in the backend so every worker process sees the same owner
+            cls._instance.backend: StateBackend = state_backend
             cls._instance.public_url = None
+            cls._instance.lan_urls = [] # Direct addresses, advertised so nearby clients skip the tunnel
             cls._instance.auth_token = None
-            cls._instance._lock = threading.Lock()
+            # "exclusive": one lock owner at a time. "shared": jobs declare
+            # VRAM and are packed onto the GPU by the admission controller.
+            cls._instance.mode = "exclusive"
             
         return cls._instance
 
-    def lock(self, owner_id: str) -> bool:
+    def _holder(self) -> Optional[Dict]:
+        return self.backend.get(LOCK_KEY)
+
+    def holder(self) -> Optional[Dict]:
+        """The lock record ({"owner_id", "since", "priority"}), None if free."""
+        return self._holder()
+
+    @property
+    def is_locked(self) -> bool:
+        return self._holder() is not None
+
+    @property
+    def owner_id(self) -> Optional[str]:
+        holder = self._holder()
+        return holder["owner_id"] if holder else None
+
+    @property
+    def workload_start_time(self) -> Optional[datetime]:
+        holder = self._holder()
+        return datetime.fromtimestamp(holder["since"]) if holder else None
+
+    def lock(self, owner_id: str, priority: str = DEFAULT_PRIORITY) -> bool:
         """
         Attempts to lock the GPU for a specific owner.
         Returns True if successful, False if already locked.
         """
-        with self._lock:
-            if self.is_locked:
-                return False
-                
-            self.is_locked = True
-            self.owner_id = owner_id
-            self.workload_start_time = datetime.now()
-            return True
+        return self.backend.compare_and_set(
+            LOCK_KEY, None, {"owner_id": owner_id, "since": time.time(), "priority": priority}
+        )
+
+    def transfer(self, holder: Dict, owner_id: str, priority: str = DEFAULT_PRIORITY) -> bool:
+        """
+        Hands the lock from `holder` (a record from holder()) to another owner.
+        False if the lock changed since that record was read.
+        """
+        return self.backend.compare_and_set(
+            LOCK_KEY, holder, {"owner_id": owner_id, "since": time.time(), "priority": priority}
+        )
 
     def unlock(self, owner_id: str) -> bool:
         """
         Attempts to unlock the GPU.
         Only the owner can unlock.
         """
-        with self._lock:
-            if not self.is_locked:
+        while True:
+            holder = self._holder()
+            if holder is None:
                 return True # Already free
                 
-            if self.owner_id != owner_id:
+            if holder["owner_id"] != owner_id:
                 return False # Unauthorized
                 
-            self.is_locked = False
-            self.owner_id = None
-            self.workload_start_time = None
-            return True
+            if self.backend.compare_and_set(LOCK_KEY, holder, None):
+                return True
+            # Changed under us (another worker): look again
 
     def get_status(self) -> Dict:
+        holder = self._holder()
         return {
-            "is_locked": self.is_locked,
-            "owner_id": self.owner_id,
-            "workload_duration": str(datetime.now() - self.workload_start_time) if self.workload_start_time else None
+            "mode": self.mode,
+            "is_locked": holder is not None,
+            "owner_id": holder["owner_id"] if holder else None,
+            "priority": holder.get("priority", DEFAULT_PRIORITY) if holder else None,
+            "workload_duration": str(datetime.now() - datetime.fromtimestamp(holder["since"])) if holder else None
         }
 
 state = GPUState()
@@ -0,0 +1,223 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+# Set (by the agent) to a SQLite path when several worker processes serve the API
+STATE_DB_ENV = "GPUHOST_STATE_DB"
+# Upserts (INSERT ... ON CONFLICT) in SqliteBackend
+MIN_SQLITE_VERSION = (3, 24, 0)
+
+
+def _encode(value: Any) -> str:
+    # Canonical, so equal values always compare equal as stored text
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+# A deleted stamped key (see compare_and_stamp)
+_TOMBSTONE = _encode(None)
+
+
+class StateBackend:
+    """
+    Where the agent's mutable state (GPU lock, clan membership) lives.
+
+    Values are JSON documents under string keys. compare_and_set() is the
+    only way to change a value that others may be changing too: it writes
+    `new` only if the key still holds `expected` (None meaning absent), in
+    one atomic step.
+
+    compare_and_stamp() also numbers each change, so a reader can catch up
+    with only what changed since it last looked (see changed_since).
+    """
+
+    # Whether other processes see the same values (callers skip syncing if not)
+    shared = False
+
+    def get(self, key: str) -> Any:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any):
+        raise NotImplementedError
+
+    def compare_and_set(self, key: str, expected: Any, new: Any) -> bool:
+        raise NotImplementedError
+
+    def compare_and_stamp(self, key: str, expected: Any, new: Any) -> Optional[int]:
+        """
+        compare_and_set() stamping the key with the next change number, which
+        it returns (None if `expected` didn't match). new=None leaves a
+        tombstone so readers see the deletion; expected=None matches one.
+        """
+        raise NotImplementedError
+
+    def last_stamp(self) -> int:
+        """Number of the latest stamped change, 0 if none."""
+        raise NotImplementedError
+
+    def changed_since(self, prefix: str, stamp: int) -> List[Tuple[str, Any, int]]:
+        """(key, value, stamp) of the keys under `prefix` stamped after `stamp`, oldest first."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryBackend(StateBackend):
+    """The default: one agent process, values in a dict."""
+
+    def __init__(self):
+        self._values: Dict[str, str] = {}
+        self._stamps: Dict[str, int] = {}
+        self._last_stamp = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        raw = self._values.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            if value is None:
+                self._values.pop(key, None)
+            else:
+                self._values[key] = _encode(value)
+
+    def compare_and_set(self, key: str, expected: Any, new: Any) -> bool:
+        with self._lock:
+            current = self._values.get(key)
+            if current != (None if expected is None else _encode(expected)):
+                return False
+            if new is None:
+                self._values.pop(key, None)
+            else:
+                self._values[key] = _encode(new)
+            return True
+
+    def compare_and_stamp(self, key: str, expected: Any, new: Any) -> Optional[int]:
+        with self._lock:
+            if self._values.get(key, _TOMBSTONE) != _encode(expected):
+                return None
+            self._last_stamp += 1
+            self._values[key] = _encode(new)
+            self._stamps[key] = self._last_stamp
+            return self._last_stamp
+
+    def last_stamp(self) -> int:
+        return self._last_stamp
+
+    def changed_since(self, prefix: str, stamp: int) -> List[Tuple[str, Any, int]]:
+        with self._lock:
+            changed = [(k, json.loads(self._values[k]), s) for k, s in self._stamps.items()
+                       if s > stamp and k.startswith(prefix)]
+        return sorted(changed, key=lambda c: c[2])
+
+
+class SqliteBackend(StateBackend):
+    """
+    State shared by every process opening the same file. Each
+    compare_and_set() is a single conditional statement, so SQLite's write
+    lock makes it atomic across processes.
+    """
+
+    shared = True
+
+    def __init__(self, path: str):
+        if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+            raise RuntimeError(
+                f"SQLite {sqlite3.sqlite_version} is too old for a shared state file "
+                f"(upserts need {'.'.join(map(str, MIN_SQLITE_VERSION))}+): run a single API worker"
+            )
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Autocommit: every statement is its own transaction
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL, stamp INTEGER)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_state_stamp ON state(stamp)")
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            if value is None:
+                self._conn.execute("DELETE FROM state WHERE key = ?", (key,))
+            else:
+                self._conn.execute(
+                    "INSERT INTO state (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                    (key, _encode(value))
+                )
+
+    def compare_and_set(self, key: str, expected: Any, new: Any) -> bool:
+        with self._lock:
+            if expected is None and new is None:
+                return self._conn.execute("SELECT 1 FROM state WHERE key = ?", (key,)).fetchone() is None
+            if expected is None:
+                cur = self._conn.execute(
+                    "INSERT INTO state (key, value) VALUES (?, ?) ON CONFLICT(key) DO NOTHING", (key, _encode(new))
+                )
+            elif new is None:
+                cur = self._conn.execute("DELETE FROM state WHERE key = ? AND value = ?", (key, _encode(expected)))
+            else:
+                cur = self._conn.execute(
+                    "UPDATE state SET value = ? WHERE key = ? AND value = ?", (_encode(new), key, _encode(expected))
+                )
+            return cur.rowcount == 1
+
+    def compare_and_stamp(self, key: str, expected: Any, new: Any) -> Optional[int]:
+        # The stamp is taken and the row written under the same write lock (BEGIN IMMEDIATE),
+        # so stamps become visible in order. No RETURNING: that needs SQLite 3.35
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                stamp = self._conn.execute("SELECT COALESCE(MAX(stamp), 0) + 1 FROM state").fetchone()[0]
+                if expected is None:
+                    # New key, or one that was deleted (tombstone)
+                    cur = self._conn.execute(
+                        "UPDATE state SET value = ?, stamp = ? WHERE key = ? AND value = ?",
+                        (_encode(new), stamp, key, _TOMBSTONE)
+                    )
+                    if cur.rowcount == 0:
+                        cur = self._conn.execute(
+                            "INSERT OR IGNORE INTO state (key, value, stamp) VALUES (?, ?, ?)", (key, _encode(new), stamp)
+                        )
+                else:
+                    cur = self._conn.execute(
+                        "UPDATE state SET value = ?, stamp = ? WHERE key = ? AND value = ?",
+                        (_encode(new), stamp, key, _encode(expected))
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return stamp if cur.rowcount == 1 else None
+
+    def last_stamp(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(stamp), 0) FROM state").fetchone()[0]
+
+    def changed_since(self, prefix: str, stamp: int) -> List[Tuple[str, Any, int]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value, stamp FROM state WHERE stamp > ? AND substr(key, 1, ?) = ? ORDER BY stamp",
+                (stamp, len(prefix), prefix)
+            ).fetchall()
+        return [(key, json.loads(value), s) for key, value, s in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def backend_from_env() -> StateBackend:
+    """SqliteBackend on GPUHOST_STATE_DB if set (a worker of a multi-process agent), else in memory."""
+    path = os.environ.get(STATE_DB_ENV)
+    return SqliteBackend(path) if path else MemoryBackend()
+
+
+# Global Backend Instance
+state_backend = backend_from_env()
@@ -0,0 +1,37 @@
+import struct
+from typing import List, Tuple
+
+# Framing for streamed results, on the runner's pipe and over HTTP:
+# kind (1 byte) + payload length (uint32, big endian) + payload
+FRAME_HEADER = struct.Struct(">cI")
+ITEM = b"I" # One yielded value, pickled with dill
+END = b"E" # JSON result of the job (status, stdout, stderr...), always the last frame
+
+STREAM_MEDIA_TYPE = "application/x-gpuhost-stream"
+# Read size on the client; also roughly what each end buffers
+STREAM_CHUNK = 64 * 1024
+
+
+def encode_frame(kind: bytes, payload: bytes) -> bytes:
+    return FRAME_HEADER.pack(kind, len(payload)) + payload
+
+
+class FrameDecoder:
+    """Splits a byte stream arriving in arbitrary chunks back into frames."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> List[Tuple[bytes, bytes]]:
+        self._buffer += data
+        frames = []
+        offset = 0
+        while len(self._buffer) - offset >= FRAME_HEADER.size:
+            kind, size = FRAME_HEADER.unpack_from(self._buffer, offset)
+            end = offset + FRAME_HEADER.size + size
+            if len(self._buffer) < end:
+                break
+            frames.append((kind, bytes(self._buffer[offset + FRAME_HEADER.size:end])))
+            offset = end
+        del self._buffer[:offset]
+        return frames
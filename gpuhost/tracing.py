@@ -0,0 +1,202 @@
+import contextlib
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# Append every finished span to this file (client and agent alike)
+TRACE_ENV = "GPUHOST_TRACE"
+# W3C Trace Context: version-trace_id-parent_id-flags
+TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+def _new_id(nbytes: int) -> str:
+    return os.urandom(nbytes).hex()
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str]]:
+    """(trace_id, parent span id) from a traceparent header, None if absent or malformed."""
+    match = TRACEPARENT_RE.match((header or "").strip().lower())
+    if not match or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return match.group(1), match.group(2)
+
+
+class Span:
+    """One timed step of a request. Times are epoch seconds so processes can be compared."""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start", "end", "attrs")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None,
+                 start: Optional[float] = None, attrs: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.start = start if start is not None else time.time()
+        self.end: Optional[float] = None
+        self.attrs = attrs or {}
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.time()) - self.start
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_event(self) -> Dict[str, Any]:
+        """Chrome trace event ("complete" event, microseconds); one row per trace."""
+        return {
+            "name": self.name,
+            "cat": "gpuhost",
+            "ph": "X",
+            "ts": round(self.start * 1e6),
+            "dur": round(self.duration * 1e6),
+            "pid": os.getpid(),
+            "tid": int(self.trace_id[:8], 16),
+            "args": dict(self.attrs, trace_id=self.trace_id, span_id=self.span_id, parent_id=self.parent_id),
+        }
+
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("gpuhost_span", default=None)
+_collected: contextvars.ContextVar[Optional[List[Span]]] = contextvars.ContextVar("gpuhost_spans", default=None)
+
+
+class Tracer:
+    """
+    Hands finished spans to the request collecting them (Server-Timing) and,
+    if `path` is set, appends them to a Chrome trace file: a JSON array of
+    trace events, left unterminated so several processes can append to it
+    (chrome://tracing and Perfetto accept that; see load_trace()).
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def finish(self, span: Span):
+        collected = _collected.get()
+        if collected is not None:
+            collected.append(span)
+        if self.path:
+            self._write(span)
+
+    def _write(self, span: Span):
+        line = json.dumps(span.to_event()) + ",\n"
+        with self._lock:
+            if self._file is None or self._file.name != self.path:
+                self._file = open(self.path, "a", encoding="utf-8")
+                if self._file.tell() == 0:
+                    self._file.write("[\n")
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def load_trace(path: str) -> List[Dict[str, Any]]:
+    """The events in a trace file written by Tracer."""
+    with open(path, encoding="utf-8") as f:
+        text = f.read().strip()
+    return json.loads(text.rstrip(",").rstrip("]").rstrip().rstrip(",") + "]") if text else []
+
+
+@contextlib.contextmanager
+def span(name: str, traceparent: Optional[str] = None, **attrs):
+    """
+    Times the block as a child of the current span; a new trace if there is
+    none. `traceparent` (a header from the caller) continues its trace instead.
+    """
+    remote = parse_traceparent(traceparent)
+    parent = _current.get()
+    if remote:
+        s = Span(name, remote[0], remote[1], attrs=attrs)
+    elif parent:
+        s = Span(name, parent.trace_id, parent.span_id, attrs=attrs)
+    else:
+        s = Span(name, _new_id(16), attrs=attrs)
+    token = _current.set(s)
+    try:
+        yield s
+    finally:
+        s.end = time.time()
+        _current.reset(token)
+        tracer.finish(s)
+
+
+def record(name: str, start: float, end: float, **attrs):
+    """A span timed elsewhere (e.g. in the job's own process), under the current one."""
+    parent = _current.get()
+    s = Span(name, parent.trace_id if parent else _new_id(16), parent.span_id if parent else None, start, attrs)
+    s.end = end
+    tracer.finish(s)
+
+
+def current_traceparent() -> Optional[str]:
+    """Header value continuing the current span's trace in another process."""
+    current = _current.get()
+    return current.traceparent() if current else None
+
+
+@contextlib.contextmanager
+def collect():
+    """Collects the spans finished inside the block (and tasks it starts) into a list."""
+    spans: List[Span] = []
+    token = _collected.set(spans)
+    try:
+        yield spans
+    finally:
+        _collected.reset(token)
+
+
+def server_timing(spans: List[Span], total: Optional[float] = None) -> str:
+    """Server-Timing header value: milliseconds per span name, in order of first start."""
+    durations: Dict[str, float] = {}
+    for s in sorted(spans, key=lambda s: s.start):
+        if s.end is not None:
+            durations[s.name] = durations.get(s.name, 0.0) + s.duration
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in durations.items()]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware: every HTTP request is a root span continuing the
+    caller's `traceparent`. The response gets a Server-Timing header with
+    the spans finished before it started, and the root span's traceparent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        header = next((v for k, v in scope["headers"] if k == b"traceparent"), b"").decode("latin-1")
+        with collect() as spans, span(f"{scope['method']} {scope['path']}", traceparent=header or None) as root:
+            async def send_with_timing(message):
+                if message["type"] == "http.response.start":
+                    timing = server_timing(spans, total=root.duration)
+                    headers = list(message.get("headers", [])) + [
+                        (b"server-timing", timing.encode("latin-1")),
+                        (b"traceparent", root.traceparent().encode("latin-1")),
+                    ]
+                    message = dict(message, headers=headers)
+                await send(message)
+
+            await self.app(scope, receive, send_with_timing)
+
+
+# Global Tracer Instance
+tracer = Tracer(os.environ.get(TRACE_ENV))
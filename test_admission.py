@@ -0,0 +1,105 @@
+import asyncio
+import unittest
+
+from gpuhost.admission import AdmissionController
+
+GB = 1024 ** 3
+
+
+class SimulatedGPU:
+    """Stands in for NVML: a 24 GB card whose free memory we control."""
+
+    def __init__(self, total=24 * GB):
+        self.total = total
+        self.used = 0
+
+    def info(self):
+        return {"memory_total": self.total, "memory_free": self.total - self.used, "memory_used": self.used}
+
+
+class TestAdmission(unittest.TestCase):
+
+    def test_packs_jobs_until_budget_is_full(self):
+        gpu = SimulatedGPU()
+        ctl = AdmissionController(memory_probe=gpu.info, safety_margin=1 * GB)
+
+        async def main():
+            for i in range(5):
+                await asyncio.wait_for(ctl.acquire(f"job-{i}", 4 * GB), 1)
+            self.assertEqual(ctl.reserved_bytes, 20 * GB)
+
+            # 20 + 4 + 1 margin > 24: must queue
+            waiter = asyncio.ensure_future(ctl.acquire("job-5", 4 * GB))
+            await asyncio.sleep(0.05)
+            self.assertFalse(waiter.done())
+            self.assertEqual(ctl.snapshot()["queued_jobs"], 1)
+
+            ctl.release("job-0")
+            await asyncio.wait_for(waiter, 1)
+            self.assertEqual(ctl.snapshot()["running_jobs"], 5)
+
+        asyncio.run(main())
+
+    def test_live_free_memory_is_respected(self):
+        gpu = SimulatedGPU()
+        gpu.used = 20 * GB # Something outside gpuhost is using the card
+        ctl = AdmissionController(memory_probe=gpu.info, safety_margin=1 * GB)
+
+        async def main():
+            waiter = asyncio.ensure_future(ctl.acquire("job", 4 * GB))
+            await asyncio.sleep(0.05)
+            self.assertFalse(waiter.done())
+
+            gpu.used = 0 # Freed externally: picked up by the periodic re-check
+            await asyncio.wait_for(waiter, 3)
+
+        asyncio.run(main())
+
+    def test_quick_admissions_count_unallocated_budgets(self):
+        gpu = SimulatedGPU()
+        gpu.used = 10 * GB # Used outside gpuhost
+        ctl = AdmissionController(memory_probe=gpu.info, safety_margin=0)
+
+        async def main():
+            await asyncio.wait_for(ctl.acquire("first", 8 * GB), 1)
+            # The first job hasn't allocated yet: 10 + 8 + 8 > 24 all the same
+            second = asyncio.ensure_future(ctl.acquire("second", 8 * GB))
+            await asyncio.sleep(0.05)
+            self.assertFalse(second.done())
+
+            gpu.used += 8 * GB # The first job allocates: still no room
+            await asyncio.sleep(1.2)
+            self.assertFalse(second.done())
+
+            gpu.used -= 8 * GB
+            ctl.release("first")
+            await asyncio.wait_for(second, 3)
+
+        asyncio.run(main())
+
+    def test_fifo_and_cancellation(self):
+        gpu = SimulatedGPU(total=10 * GB)
+        ctl = AdmissionController(memory_probe=gpu.info, safety_margin=0)
+
+        async def main():
+            await ctl.acquire("big", 8 * GB)
+            blocked = asyncio.ensure_future(ctl.acquire("next", 8 * GB))
+            small = asyncio.ensure_future(ctl.acquire("small", 1 * GB))
+            await asyncio.sleep(0.05)
+            # The small job fits but must not jump the queue
+            self.assertFalse(small.done())
+
+            blocked.cancel()
+            await asyncio.sleep(0)
+            ctl.release("big")
+            await asyncio.wait_for(small, 1)
+            self.assertEqual(ctl.reserved_bytes, 1 * GB)
+
+            with self.assertRaises(ValueError):
+                await ctl.acquire("huge", 11 * GB)
+
+        asyncio.run(main())
+
+
+if __name__ == "__main__":
+    unittest.main()
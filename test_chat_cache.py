@@ -0,0 +1,144 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+import gpuhost.api as api
+from gpuhost.api import app, set_auth_token
+from gpuhost.chat_cache import ChatCache, cache_key
+from gpuhost.clan import clan
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def enabled_cache(**kwargs) -> ChatCache:
+    cache = ChatCache(**kwargs)
+    cache.enabled = True
+    return cache
+
+
+class TestChatCache(unittest.TestCase):
+
+    def test_canonical_key(self):
+        body = {"model": "m", "messages": [{"role": "user", "content": "hi"}], "temperature": 0}
+        reordered = {"temperature": 0, "hedge": True, "messages": [{"content": "hi", "role": "user"}], "model": "m"}
+        self.assertEqual(cache_key(body, "k"), cache_key(reordered, "k"))
+        self.assertNotEqual(cache_key(body, "k"), cache_key(body, "other"))
+        self.assertNotEqual(cache_key(body), cache_key(dict(body, max_tokens=5)))
+
+        cache = enabled_cache()
+        self.assertTrue(cache.cacheable(body))
+        self.assertFalse(cache.cacheable(dict(body, temperature=0.7)))
+        self.assertFalse(cache.cacheable(dict(body, n=2)))
+        cache.clan_wide = True
+        self.assertEqual(cache.key(body, "k"), cache.key(body, "other"))
+
+    def test_ttl(self):
+        clock = Clock()
+        cache = enabled_cache(ttl=10, clock=clock)
+        cache.put("a", {"x": 1})
+        clock.now = 9
+        self.assertEqual(cache.get("a"), ({"x": 1}, 9))
+        clock.now = 10
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["bytes"], 0)
+
+    def test_lru_eviction_by_bytes(self):
+        cache = enabled_cache(max_bytes=45)
+        for key in "abc":
+            cache.put(key, {"v": "x" * 5}) # 14 bytes each
+        cache.get("a") # Now the most recently used
+        cache.put("d", {"v": "x" * 5})
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+        cache.put("huge", {"v": "x" * 100}) # Never fits: not stored, nothing evicted
+        self.assertEqual(cache.stats()["entries"], 3)
+
+    def test_concurrent_misses_compute_once(self):
+        cache = enabled_cache()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {"answer": 42}
+
+        async def main():
+            return await asyncio.gather(*[cache.run("k", compute) for _ in range(3)])
+
+        results = asyncio.run(main())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(outcome for _, outcome, _ in results), ["HIT", "HIT", "MISS"])
+        self.assertEqual(cache.stats()["hits"], 2)
+
+    def test_failures_are_not_cached(self):
+        cache = enabled_cache()
+
+        async def fail():
+            raise RuntimeError("no nodes")
+
+        async def main():
+            with self.assertRaises(RuntimeError):
+                await cache.run("k", fail)
+            return await cache.run("k", lambda: asyncio.sleep(0, {"ok": True}))
+
+        self.assertEqual(asyncio.run(main())[:2], ({"ok": True}, "MISS"))
+
+
+class TestCachedEndpoint(unittest.TestCase):
+
+    def setUp(self):
+        set_auth_token("secret")
+        self.client = TestClient(app)
+        self.patch = patch.object(api, "chat_cache", enabled_cache())
+        self.patch.start()
+        # As forwarded by a clan host
+        self.headers = {"Authorization": f"Bearer {api.node_key()}"}
+        self.chat = {"model": "m", "messages": [{"role": "user", "content": "hi"}], "temperature": 0}
+
+    def tearDown(self):
+        self.patch.stop()
+        clan.nodes = {}
+        clan.clan_id = None
+        clan.key_roles = {}
+
+    def post(self, body, **headers):
+        return self.client.post("/v1/chat/completions", headers=dict(self.headers, **headers), json=body)
+
+    def test_hit_after_miss(self):
+        first = self.post(self.chat)
+        self.assertEqual(first.headers["X-Cache"], "MISS")
+        second = self.post(self.chat)
+        self.assertEqual(second.headers["X-Cache"], "HIT")
+        self.assertIn("Age", second.headers)
+        self.assertEqual(second.json()["id"], first.json()["id"])
+
+        refreshed = self.post(self.chat, **{"Cache-Control": "no-cache"})
+        self.assertEqual(refreshed.headers["X-Cache"], "MISS")
+        self.assertNotEqual(refreshed.json()["id"], first.json()["id"])
+
+        stats = self.client.get("/info?key=secret").json()["chat_cache"]
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (1, 2, 1))
+
+    def test_bypass(self):
+        self.assertEqual(self.post(dict(self.chat, temperature=0.7)).headers["X-Cache"], "BYPASS")
+        self.assertEqual(self.post(self.chat, **{"Cache-Control": "no-store"}).headers["X-Cache"], "BYPASS")
+        self.assertEqual(self.client.get("/info?key=secret").json()["chat_cache"]["bypassed"], 2)
+
+    def test_disabled_by_default(self):
+        with patch.object(api, "chat_cache", ChatCache()):
+            res = self.post(self.chat)
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn("X-Cache", res.headers)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,196 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+import dill
+import requests
+from fastapi.testclient import TestClient
+
+import gpuhost.clan_map as clan_map
+from gpuhost.api import app, set_auth_token
+from gpuhost.clan import clan, Node
+from gpuhost.state import state
+from gpuhost.client import GPUClient
+from gpuhost.client.client import _MapShard
+
+HARDWARE = {
+    "name": "NVIDIA GeForce RTX 3050",
+    "arch": "Ampere",
+    "cuda_capability": "8.6",
+    "tensor_cores": True,
+    "memory_total": 8 * 1024 * 1024 * 1024,
+}
+
+WORKER_SCRIPT = """
+import sys, uvicorn
+from gpuhost.api import app, set_auth_token
+set_auth_token(sys.argv[2])
+uvicorn.run(app, host="127.0.0.1", port=int(sys.argv[1]), log_level="warning")
+"""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class TestClanMap(unittest.TestCase):
+    """Host runs in-process; workers are real local agent processes."""
+
+    @classmethod
+    def setUpClass(cls):
+        root = os.path.dirname(os.path.abspath(__file__))
+        env = dict(os.environ, PYTHONPATH=root, GPUHOST_HOME=tempfile.mkdtemp())
+        cls.workers = []
+        for i in range(2):
+            port, token = free_port(), f"worker-token-{i}"
+            proc = subprocess.Popen([sys.executable, "-c", WORKER_SCRIPT, str(port), token], env=env)
+            cls.workers.append((proc, f"http://127.0.0.1:{port}", token))
+
+        for proc, url, _ in cls.workers:
+            for _ in range(100):
+                try:
+                    requests.get(url, timeout=0.5)
+                    break
+                except requests.ConnectionError:
+                    time.sleep(0.1)
+
+    @classmethod
+    def tearDownClass(cls):
+        for proc, _, _ in cls.workers:
+            proc.terminate()
+            proc.wait()
+
+    def setUp(self):
+        clan.nodes = {}
+        set_auth_token("admin-secret")
+        self.http = TestClient(app)
+        with patch("gpuhost.api.get_gpu_info", return_value=HARDWARE):
+            keys = self.http.post("/v2/clan/create?key=admin-secret").json()["keys"]
+        self.worker_key = keys["worker_key"]
+        self.client = GPUClient("http://testserver", keys["client_key"], session=self.http)
+
+    def join(self, name, url, token):
+        resp = self.http.post(
+            "/v2/clan/join",
+            headers={"Authorization": f"Bearer {self.worker_key}"},
+            json={"name": name, "url": url, "hardware": HARDWARE, "token": token}
+        )
+        self.assertEqual(resp.status_code, 200)
+        return resp.json()["node_id"]
+
+    def run_map(self, func, items, shard_size):
+        """Returns (results, per-node stats)"""
+        resp = self.http.post(
+            "/v2/clan/map",
+            headers=self.client.headers,
+            json={
+                "pickle_data": dill.dumps(_MapShard(func)).hex(),
+                "items": [dill.dumps(i).hex() for i in items],
+                "shard_size": shard_size
+            }
+        ).json()
+        self.assertEqual(resp["status"], "success", resp.get("stderr"))
+        return [dill.loads(bytes.fromhex(r)) for r in resp["results"]], resp["nodes"]
+
+    def test_map_spreads_over_nodes_in_order(self):
+        ids = [self.join(f"w{i}", url, token) for i, (_, url, token) in enumerate(self.workers)]
+
+        results, stats = self.run_map(lambda x: x * x, list(range(16)), shard_size=2)
+        self.assertEqual(results, [x * x for x in range(16)])
+        self.assertTrue(all(stats[i]["shards"] > 0 for i in ids), stats)
+
+    def test_node_key(self):
+        _, url, token = self.workers[0]
+        node_key = requests.get(f"{url}/v2/node/key", headers={"Authorization": f"Bearer {token}"}).json()["node_key"]
+        scoped = {"Authorization": f"Bearer {node_key}"}
+        # Only sends work: no jobs, locks or node key of its own
+        self.assertEqual(requests.post(f"{url}/lock", headers=scoped, json={"owner_id": "x"}).status_code, 403)
+        self.assertEqual(requests.get(f"{url}/v2/node/key", headers=scoped).status_code, 403)
+
+        node_id = self.join("w", url, node_key)
+        results, stats = self.run_map(str.upper, ["a", "b", "c", "d"], shard_size=1)
+        self.assertEqual(results, ["A", "B", "C", "D"])
+        self.assertGreater(stats[node_id]["shards"], 0)
+        self.assertFalse(state.is_locked) # Host shards give the lock back
+
+    def test_host_shards_respect_the_lock(self):
+        self.assertTrue(state.lock("alice"))
+        try:
+            resp = self.http.post("/v2/clan/call", headers=self.client.headers,
+                                  json={"pickle_data": dill.dumps(_MapShard(str.upper)).hex(), "item": dill.dumps("a").hex()})
+            self.assertEqual(resp.json()["status"], "error")
+        finally:
+            state.unlock("alice")
+
+    def test_failed_node_is_rebalanced(self):
+        _, url, token = self.workers[0]
+        good = self.join("good", url, token)
+        dead = self.join("dead", f"http://127.0.0.1:{free_port()}", "nobody-home")
+
+        results, stats = self.run_map(str.upper, ["a", "b", "c", "d", "e", "f"], shard_size=1)
+        self.assertEqual(results, ["A", "B", "C", "D", "E", "F"])
+        self.assertGreater(stats[dead]["failures"], 0)
+        self.assertEqual(stats[dead]["shards"], 0)
+        self.assertGreater(stats[good]["shards"], 0)
+
+    def test_user_error_fails_map(self):
+        _, url, token = self.workers[1]
+        self.join("w", url, token)
+        # Through the client API: a deterministic user error fails the whole map
+        self.assertEqual(self.client.map(lambda x: x + 1, [1, 2, 3]), [2, 3, 4])
+        with self.assertRaises(RuntimeError):
+            self.client.map(lambda x: 1 / x, [1, 0, 2], shard_size=1)
+
+
+class TestNodeConnections(unittest.TestCase):
+
+    def test_losing_copies_are_cancelled(self):
+        host = Node(id="host", role="host", name="host", url="http://host", hardware=HARDWARE)
+        slow = Node(id="slow", role="worker", name="slow", url="http://slow", hardware=HARDWARE, token="k")
+        stopped = []
+
+        async def straggler(node, pickle_hex, items, vram_bytes=None):
+            try:
+                await asyncio.sleep(30)
+            except asyncio.CancelledError:
+                stopped.extend(items) # The request is dropped: its node stops the work
+                raise
+
+        async def run_local(pickle_hex, items):
+            await asyncio.sleep(0.01)
+            return items
+
+        async def main():
+            job = clan_map.ClanMap([host, slow], "host", "", [b"a", b"b", b"c", b"d"], shard_size=1, run_local=run_local)
+            results = await asyncio.wait_for(job.run(), 10)
+            return results, list(stopped), job.stats
+
+        with patch.object(clan_map, "run_shard_on_node", straggler):
+            results, stopped_during_map, stats = asyncio.run(main())
+        self.assertEqual(results, [b"a", b"b", b"c", b"d"])
+        self.assertGreater(stats["host"]["steals"], 0)
+        # Each stolen shard's copy on the straggler was stopped as soon as the host's won
+        self.assertEqual(len(stopped_during_map), stats["host"]["steals"])
+        self.assertEqual(stats["slow"]["failures"], 0)
+
+    def test_async_client_closed_on_shutdown(self):
+        async def main():
+            client = clan_map._async_client()
+            self.assertIs(clan_map._async_client(), client) # Shared within the loop
+            await clan_map.close_async_client()
+            return client
+
+        self.assertTrue(asyncio.run(main()).is_closed)
+        self.assertIsNone(clan_map._async_http)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import httpx
+
+import gpuhost.api as api
+from gpuhost.api import app, set_auth_token
+from gpuhost.client import AsyncGPUClient, AsyncObjectRef, GPUClient
+from gpuhost.job_store import JobStore
+from gpuhost.objects import ObjectStore
+
+
+class CountingHandler(BaseHTTPRequestHandler):
+    """/info with a few 502s first (like a tunnel with the agent restarting)"""
+    protocol_version = "HTTP/1.1" # Keep-alive
+    connections = set()
+    failures_left = 0
+
+    def do_GET(self):
+        CountingHandler.connections.add(self.client_address)
+        if CountingHandler.failures_left > 0:
+            CountingHandler.failures_left -= 1
+            status, body = 502, b"bad gateway"
+        else:
+            status, body = 200, json.dumps({"gpu": {"name": "test"}}).encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestPooledClient(unittest.TestCase):
+
+    def setUp(self):
+        CountingHandler.connections = set()
+        CountingHandler.failures_left = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), CountingHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/?key=secret"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_is_reused(self):
+        with GPUClient(self.url) as gpu:
+            for _ in range(10):
+                self.assertEqual(gpu.get_info()["gpu"]["name"], "test")
+        self.assertEqual(len(CountingHandler.connections), 1)
+
+    def test_retries_with_backoff(self):
+        CountingHandler.failures_left = 2
+        with GPUClient(self.url, backoff=0.01) as gpu:
+            self.assertEqual(gpu.get_info()["gpu"]["name"], "test")
+
+        CountingHandler.failures_left = 5
+        with GPUClient(self.url, retries=1, backoff=0.01) as gpu:
+            with self.assertRaises(Exception):
+                gpu.get_info()
+
+    def test_async_client_shares_connections(self):
+        async def main():
+            async with AsyncGPUClient(self.url, pool_size=4) as gpu:
+                infos = await asyncio.gather(*(gpu.get_info() for _ in range(50)))
+            return infos
+        self.assertEqual(len(asyncio.run(main())), 50)
+        self.assertLessEqual(len(CountingHandler.connections), 4)
+
+
+class TestAsyncClient(unittest.TestCase):
+
+    def test_retries_connection_errors(self):
+        attempts = []
+
+        def handler(request):
+            attempts.append(request.method)
+            if len(attempts) < 3:
+                raise httpx.ConnectError("refused")
+            return httpx.Response(200, json={"status": "success", "stdout": "hi"})
+
+        async def main():
+            session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            async with AsyncGPUClient("http://host/?key=k", session=session, backoff=0.01, lan=False) as gpu:
+                return await gpu.submit_job("print('hi')")
+
+        self.assertEqual(asyncio.run(main())["stdout"], "hi")
+        self.assertEqual(attempts, ["POST"] * 3)
+
+    def test_remote_calls_against_agent(self):
+        tmp = tempfile.mkdtemp()
+        store = ObjectStore(os.path.join(tmp, "objects"), ttl=60)
+        set_auth_token("secret")
+
+        async def main():
+            session = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), timeout=30)
+            async with AsyncGPUClient("http://testserver/?key=secret", session=session) as gpu:
+                self.assertTrue(await gpu.lock())
+
+                @gpu.remote(return_ref=True)
+                def make(n):
+                    return list(range(n))
+
+                @gpu.remote
+                def total(xs):
+                    return sum(xs)
+
+                ref = await make(10)
+                self.assertIsInstance(ref, AsyncObjectRef)
+                self.assertEqual(await total(ref), 45)
+                self.assertEqual((await ref.get())[:3], [0, 1, 2])
+                await ref.release()
+                self.assertEqual(await gpu.fetch_result(), 45)
+                self.assertTrue(await gpu.unlock())
+
+        try:
+            with patch.object(api, "object_store", store), \
+                 patch.object(api, "job_store", JobStore(os.path.join(tmp, "jobs.db"))):
+                asyncio.run(main())
+            self.assertEqual(store.stats()["objects"], 0)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import os
+import shutil
+import stat
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+import gpuhost.job_manager as job_manager
+from gpuhost.code_cache import CodeCache
+from gpuhost.job_manager import run_code, pidfd_child_watcher
+
+SCRIPT = """
+import sys
+def greet(name):
+    return f"hello {name}"
+print(greet(sys.argv[0].endswith(".py") and "script" or "?"), __name__)
+"""
+
+
+class TestCodeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache = CodeCache(os.path.join(self.tmp, "code"), max_entries=3)
+        self.patch = patch.object(job_manager, "code_cache", self.cache)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def run_jobs(self, *codes):
+        async def main():
+            with pidfd_child_watcher():
+                return await asyncio.gather(*(run_code(c) for c in codes))
+        return asyncio.run(main())
+
+    def test_hits_skip_compilation(self):
+        first, = self.run_jobs(SCRIPT)
+        self.assertEqual(first["stdout"].strip(), "hello script __main__")
+
+        with patch("builtins.compile", side_effect=AssertionError("compiled again")):
+            second, third = self.run_jobs(SCRIPT, SCRIPT)
+        self.assertEqual(second["stdout"], first["stdout"])
+        self.assertEqual(third["stdout"], first["stdout"])
+
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (2, 1, 1))
+        self.assertAlmostEqual(stats["hit_rate"], 2 / 3)
+
+    def test_concurrent_misses_compile_once(self):
+        results = self.run_jobs(*[SCRIPT] * 5)
+        self.assertTrue(all(r["status"] == "success" for r in results))
+        self.assertEqual(len(os.listdir(self.cache.directory)), 2) # code + source
+
+    def test_errors_look_like_a_script_run(self):
+        res, = self.run_jobs("x = 1\nraise ValueError('boom')\n")
+        self.assertEqual(res["return_code"], 1)
+        self.assertIn("ValueError: boom", res["stderr"])
+        self.assertIn("raise ValueError('boom')", res["stderr"]) # Source lines in the traceback
+        self.assertNotIn("<string>", res["stderr"])
+
+        res, = self.run_jobs("import sys; sys.exit(3)")
+        self.assertEqual(res["return_code"], 3)
+
+        # Not cached, Python reports it as usual
+        res, = self.run_jobs("def broken(:\n")
+        self.assertIn("SyntaxError", res["stderr"])
+        self.assertEqual(self.cache.stats()["entries"], 2)
+
+    def test_import_path(self):
+        code = "import json, sys; print(json.dumps(sys.path))"
+        for res in self.run_jobs(code) + self.run_jobs(code): # Compiled, then cached
+            path = json.loads(res["stdout"])
+            self.assertEqual(path[0], tempfile.gettempdir()) # As for a plain script file there
+            self.assertNotIn(self.cache.directory, path)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_compiler_errors_fall_back(self):
+        # Too deeply nested for the compiler here: run as a plain file instead
+        with patch("builtins.compile", side_effect=RecursionError("maximum recursion depth exceeded")):
+            res, = self.run_jobs("print('ok')")
+        self.assertEqual(res["stdout"], "ok\n")
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+    def test_private_and_expiring(self):
+        self.run_jobs("print(1)")
+        self.assertEqual(stat.S_IMODE(os.stat(self.cache.directory).st_mode), 0o700)
+        for name in os.listdir(self.cache.directory):
+            self.assertEqual(stat.S_IMODE(os.stat(os.path.join(self.cache.directory, name)).st_mode), 0o600)
+
+        self.cache.expire(now=time.time() + self.cache.ttl - 60)
+        self.assertEqual(self.cache.stats()["entries"], 1)
+        self.cache.expire(now=time.time() + self.cache.ttl + 60)
+        self.assertEqual(self.cache.stats()["entries"], 0)
+        self.assertEqual(os.listdir(self.cache.directory), [])
+
+    def test_lru_bound(self):
+        self.run_jobs("print(1)", "print(2)", "print(3)")
+        self.run_jobs("print(1)") # Most recently used
+        self.run_jobs("print(4)")
+        self.assertEqual(self.cache.stats()["entries"], 3)
+        self.run_jobs("print(1)")
+        self.assertEqual(self.cache.stats()["misses"], 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
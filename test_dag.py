@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+import dill
+from fastapi.testclient import TestClient
+
+import gpuhost.api as api
+import gpuhost.dag as dag
+from gpuhost.api import app, set_auth_token
+from gpuhost.client.client import Dag, DagNodeHandle, GPUClient
+from gpuhost.job_store import JobStore
+from gpuhost.state import state
+
+
+class TestDag(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.patches = [
+            patch.object(dag, "DAG_DIR", os.path.join(self.tmp, "dags")),
+            patch.object(api, "job_store", JobStore(os.path.join(self.tmp, "jobs.db"))),
+        ]
+        for p in self.patches:
+            p.start()
+        set_auth_token("secret")
+        self.http = TestClient(app)
+        self.client = GPUClient("http://testserver/?key=secret", session=self.http)
+        state.lock(self.client.owner_id)
+
+    def tearDown(self):
+        state.unlock(self.client.owner_id)
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_validation(self):
+        a = dag.DagNode(id="a", pickle_data="", deps=["b"])
+        b = dag.DagNode(id="b", pickle_data="", deps=["a"])
+        with self.assertRaises(ValueError):
+            dag.topological_order([a, b])
+        with self.assertRaises(ValueError):
+            dag.topological_order([dag.DagNode(id="a", pickle_data="", deps=["missing"])])
+        order = dag.topological_order([dag.DagNode(id="c", pickle_data="", deps=["d"]), dag.DagNode(id="d", pickle_data="")])
+        self.assertEqual([n.id for n in order], ["d", "c"])
+
+    def test_pipeline_only_returns_outputs(self):
+        g = self.client.dag()
+        left = g.add(lambda n: list(range(n)), 5)
+        right = g.add(lambda: 100)
+        total = g.add(lambda xs, offset, scale=1: (sum(xs) + offset) * scale, left, right, scale=2)
+
+        resp = self.http.post("/dag/submit", json={
+            "owner_id": self.client.owner_id, "nodes": g.nodes, "outputs": [total.id]
+        }, headers=self.client.headers).json()
+        self.assertEqual(list(resp["results"]), [total.id])
+        self.assertEqual(dill.loads(bytes.fromhex(resp["results"][total.id])), 220)
+
+        # Intermediates stay on the host until fetched, by their owner only
+        g.dag_id = resp["dag_id"]
+        self.assertEqual(g.fetch(left), [0, 1, 2, 3, 4])
+        path = f"/dag/{g.dag_id}"
+        self.assertEqual(self.http.get(path, params={"owner_id": "eve"}, headers=self.client.headers).status_code, 404)
+        self.assertEqual(self.http.get(f"{path}/results/{left.id}", params={"owner_id": "eve"},
+                                       headers=self.client.headers).status_code, 404)
+        self.assertEqual(self.http.delete(path, params={"owner_id": "eve"}, headers=self.client.headers).status_code, 404)
+        self.assertEqual(self.http.delete(path, params={"owner_id": self.client.owner_id},
+                                          headers=self.client.headers).status_code, 200)
+        self.assertFalse(os.path.exists(os.path.join(dag.DAG_DIR, g.dag_id)))
+
+    def test_failure_skips_dependents(self):
+        g = self.client.dag()
+        bad = g.add(lambda: 1 / 0)
+        after = g.add(lambda x: x, bad)
+        ok = g.add(lambda: "fine")
+
+        resp = self.http.post("/dag/submit", json={
+            "owner_id": self.client.owner_id, "nodes": g.nodes, "outputs": [after.id, ok.id]
+        }, headers=self.client.headers).json()
+        self.assertEqual(resp["status"], {bad.id: "error", after.id: "skipped", ok.id: "success"})
+        self.assertEqual(list(resp["results"]), [ok.id])
+
+    def test_orphaned_work_dirs(self):
+        registry = dag.DagRegistry(ttl=10)
+        run = dag.DagRun("alice", [dag.DagNode(id="a", pickle_data="")])
+        registry.add(run)
+        os.makedirs(run.work_dir)
+        orphan = os.path.join(dag.DAG_DIR, "left-over")
+        os.makedirs(orphan)
+
+        registry.remove_orphans(now=time.time() + 5)
+        self.assertTrue(os.path.exists(orphan)) # Not stale yet
+        registry.remove_orphans(now=time.time() + 20)
+        self.assertFalse(os.path.exists(orphan))
+        self.assertTrue(os.path.exists(run.work_dir))
+
+        run.finished_at = time.time()
+        registry.expire(now=run.finished_at + 20)
+        self.assertIsNone(registry.get(run.dag_id))
+        self.assertFalse(os.path.exists(run.work_dir))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+import gpuhost.gpu as gpu
+from gpuhost.admission import AdmissionController
+from gpuhost.devices import DeviceError, SimulatedBackend, simulated_backend
+
+GB = 1024 ** 3
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestSimulatedBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.sim = SimulatedBackend({"devices": [
+            {"name": "RTX 3090", "memory_total": 24 * GB, "memory_used": [[0, 0], [10, 20 * GB]],
+             "utilization": {"points": [[0, 0], [5, 100], [10, 0]], "loop": True}},
+            {"name": "T4", "arch": "Turing", "cuda_capability": "7.5", "memory_total": 16 * GB,
+             "failures": [{"start": 5, "end": 8}]},
+        ]}, clock=self.clock)
+
+    def test_heterogeneous_devices(self):
+        self.assertEqual(self.sim.device_count(), 2)
+        first, second = self.sim.device_info(0), self.sim.device_info(1)
+        self.assertEqual((first["name"], first["memory_total"]), ("RTX 3090", 24 * GB))
+        self.assertEqual((second["arch"], second["memory_free"]), ("Turing", 16 * GB))
+        with self.assertRaises(DeviceError):
+            self.sim.device_info(2)
+
+    def test_traces_over_time(self):
+        self.clock.now = 5
+        info = self.sim.device_info(0)
+        self.assertEqual(info["memory_used"], 10 * GB)
+        self.assertEqual(info["utilization"], 100)
+        self.clock.now = 17.5 # Utilization loops, memory holds its last value
+        info = self.sim.device_info(0)
+        self.assertEqual((info["memory_used"], info["utilization"]), (20 * GB, 50))
+
+        self.sim.allocate(0, 10 * GB) # Never above the card
+        self.assertEqual(self.sim.device_info(0)["memory_free"], 0)
+        self.sim.free(0, 10 * GB)
+        self.assertEqual(self.sim.device_info(0)["memory_free"], 4 * GB)
+
+    def test_injected_failures(self):
+        self.clock.now = 6
+        with self.assertRaises(DeviceError):
+            self.sim.device_info(1)
+        self.clock.now = 8
+        self.sim.device_info(1)
+
+        self.sim.fail(0, duration=1)
+        with self.assertRaises(DeviceError):
+            self.sim.device_info(0)
+        self.clock.now = 9
+        self.sim.device_info(0)
+
+        flaky = SimulatedBackend({"devices": [{"failure_rate": 0.5}], "seed": 1})
+        failures = 0
+        for _ in range(100):
+            try:
+                flaky.device_info(0)
+            except DeviceError:
+                failures += 1
+        self.assertTrue(20 < failures < 80)
+
+    def test_config_file(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            json.dump({"devices": [{"name": "A100"}, {"name": "H100"}]}, f)
+        try:
+            self.assertEqual(simulated_backend(f.name).device_info(1)["name"], "H100")
+        finally:
+            os.unlink(f.name)
+        self.assertEqual(simulated_backend("4").device_count(), 4)
+
+
+class TestGpuFacade(unittest.TestCase):
+
+    def setUp(self):
+        self.previous = gpu.get_backend()
+        self.sim = SimulatedBackend({"count": 3})
+        gpu.set_backend(self.sim)
+
+    def tearDown(self):
+        gpu.set_backend(self.previous)
+
+    def test_list_devices_and_failures(self):
+        self.sim.fail(1)
+        devices = gpu.list_devices()
+        self.assertEqual([d["index"] for d in devices], [0, 1, 2])
+        self.assertIn("error", devices[1])
+
+        # A failing device is reported as such, not hidden behind the mock card
+        self.sim.fail(0)
+        with self.assertLogs("gpuhost.gpu", "WARNING"):
+            self.assertIsNone(gpu.get_gpu_info())
+
+    def test_mock_card_without_backend(self):
+        class Unavailable(SimulatedBackend):
+            def init(self):
+                return False
+
+        gpu.set_backend(Unavailable())
+        self.assertEqual(gpu.get_gpu_info()["name"], "Mock NVIDIA GPU (Simulated)")
+
+    def test_admission_under_memory_pressure(self):
+        # Something outside gpuhost fills the card, then frees it
+        self.sim.allocate(0, 20 * GB)
+        ctl = AdmissionController(memory_probe=gpu.get_gpu_info, safety_margin=1 * GB)
+
+        async def main():
+            waiter = asyncio.ensure_future(ctl.acquire("job", 4 * GB))
+            await asyncio.sleep(0.05)
+            self.assertFalse(waiter.done())
+            self.sim.free(0, 20 * GB)
+            await asyncio.wait_for(waiter, 3)
+
+        asyncio.run(main())
+
+    def test_failed_device_admits_nothing(self):
+        # 8 GB card, 7 GB used: a 10 GB job must not be admitted on the mock card's numbers
+        sim = SimulatedBackend({"devices": [{"memory_total": 8 * GB}]})
+        gpu.set_backend(sim)
+        sim.allocate(0, 7 * GB)
+        sim.fail(0)
+        ctl = AdmissionController(safety_margin=0)
+
+        async def main():
+            waiter = asyncio.ensure_future(ctl.acquire("job", 10 * GB))
+            await asyncio.sleep(0.05)
+            self.assertFalse(waiter.done()) # Queued, not admitted nor rejected
+            self.assertEqual(ctl.reserved_bytes, 0)
+            # Answers again: too big for the card after all
+            sim.recover(0)
+            with self.assertRaises(ValueError):
+                await asyncio.wait_for(waiter, 3)
+
+        asyncio.run(main())
+
+
+if __name__ == "__main__":
+    unittest.main()
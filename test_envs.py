@@ -0,0 +1,190 @@
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+import gpuhost.api as api
+from gpuhost.api import app, set_auth_token
+from gpuhost.client import GPUClient
+from gpuhost.envs import EnvCache, EnvBuildError, normalize_requirements, env_hash, env_python
+from gpuhost.job_manager import _runner_env
+from gpuhost.job_store import JobStore
+from gpuhost.state import state
+
+
+class FakeBuilder:
+    """Stands in for build_venv: a 'venv' whose python is ours, of a chosen size."""
+
+    def __init__(self, size=1000, delay=0.05):
+        self.size = size
+        self.delay = delay
+        self.builds = []
+        self.fail = False
+
+    async def __call__(self, path, requirements, wheel_dir, offline):
+        self.builds.append(requirements)
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise EnvBuildError("no matching distribution")
+        os.makedirs(os.path.dirname(env_python(path)))
+        os.symlink(sys.executable, env_python(path))
+        with open(os.path.join(path, "blob"), "wb") as f:
+            f.write(b"\0" * self.size)
+
+
+class PinnedBuilder:
+    """A real (pip-less) venv with dill and a fake httpx 0.0.1, whatever the agent has installed."""
+
+    async def __call__(self, path, requirements, wheel_dir, offline):
+        subprocess.run([sys.executable, "-m", "venv", "--without-pip", path], check=True)
+        site = os.path.join(path, "lib", f"python{sys.version_info[0]}.{sys.version_info[1]}", "site-packages")
+        import dill
+        shutil.copytree(os.path.dirname(dill.__file__), os.path.join(site, "dill"))
+        os.makedirs(os.path.join(site, "httpx"))
+        with open(os.path.join(site, "httpx", "__init__.py"), "w") as f:
+            f.write("__version__ = '0.0.1'\n")
+
+
+class TestEnvCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.builder = FakeBuilder()
+        self.cache = EnvCache(os.path.join(self.tmp, "envs"), os.path.join(self.tmp, "wheels"), builder=self.builder)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_normalization(self):
+        a = normalize_requirements(["NumPy >= 1.2, <2", "Torch_Vision", "# comment", ""])
+        b = normalize_requirements(["torch-vision", "numpy>=1.2,<2"])
+        self.assertEqual(a, b)
+        self.assertEqual(env_hash(a), env_hash(b))
+        self.assertIn("dill", a) # The runner needs it
+        for bad in (["-e ."], ["--index-url http://evil"], ["-r requirements.txt"],
+                    ["numpy @ https://evil/numpy.whl"], ["pkg@file:///tmp/pkg"]):
+            with self.assertRaises(ValueError):
+                normalize_requirements(bad)
+
+    def test_concurrent_requests_share_one_build(self):
+        async def main():
+            keys = await asyncio.gather(*(self.cache.ensure(["numpy"]) for _ in range(5)))
+            self.assertEqual(len(set(keys)), 1)
+            await self.cache.ensure(["NumPy"]) # Same env
+        asyncio.run(main())
+        self.assertEqual(len(self.builder.builds), 1)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+        # Survives a restart
+        reopened = EnvCache(self.cache.directory, builder=self.builder)
+        asyncio.run(reopened.ensure(["numpy"]))
+        self.assertEqual(len(self.builder.builds), 1)
+
+    def test_failed_build_is_not_cached(self):
+        self.builder.fail = True
+        with self.assertRaises(EnvBuildError):
+            asyncio.run(self.cache.ensure(["nope"]))
+        self.assertEqual(os.listdir(self.cache.directory), [])
+        self.builder.fail = False
+        asyncio.run(self.cache.ensure(["nope"]))
+        self.assertEqual(len(self.builder.builds), 2)
+
+    def test_lru_eviction(self):
+        self.cache.max_bytes = 2500 # Room for two envs
+
+        async def main():
+            a = await self.cache.ensure(["a"])
+            b = await self.cache.ensure(["b"])
+            await asyncio.sleep(0.01)
+            await self.cache.ensure(["a"]) # b is now least recently used
+            c = await self.cache.ensure(["c"])
+            return a, b, c
+        a, b, c = asyncio.run(main())
+        self.assertEqual(sorted(os.listdir(self.cache.directory)), sorted([a, c]))
+
+        # Environments used by running jobs are never evicted
+        async def busy():
+            async with self.cache.use(["a"]):
+                async with self.cache.use(["c"]):
+                    await self.cache.ensure(["d"])
+        asyncio.run(busy())
+        self.assertIn(a, os.listdir(self.cache.directory))
+        self.assertIn(c, os.listdir(self.cache.directory))
+
+
+class TestJobRequirements(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.builder = FakeBuilder()
+        self.cache = EnvCache(os.path.join(self.tmp, "envs"), builder=self.builder)
+        self.patches = [
+            patch.object(api, "env_cache", self.cache),
+            patch.object(api, "job_store", JobStore(os.path.join(self.tmp, "jobs.db"))),
+        ]
+        for p in self.patches:
+            p.start()
+        set_auth_token("secret")
+        self.client = TestClient(app)
+        self.headers = {"Authorization": "Bearer secret"}
+        state.lock("alice")
+
+    def tearDown(self):
+        state.unlock("alice")
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def submit(self, requirements):
+        return self.client.post("/submit", headers=self.headers, json={
+            "owner_id": "alice",
+            "code": "import sys; print(sys.executable)",
+            "requirements": requirements,
+        })
+
+    def test_job_runs_in_cached_env(self):
+        first = self.submit(["numpy"]).json()
+        self.assertEqual(first["status"], "success")
+        key = env_hash(normalize_requirements(["numpy"]))
+        self.assertEqual(first["stdout"].strip(), env_python(os.path.join(self.cache.directory, key)))
+
+        self.submit(["numpy"])
+        self.assertEqual(len(self.builder.builds), 1)
+
+        plain = self.submit([]).json()
+        self.assertEqual(plain["stdout"].strip(), sys.executable)
+
+    @unittest.skipIf(os.name == "nt", "POSIX venv layout")
+    def test_pinned_version_beats_agents_copy(self):
+        import httpx
+        self.assertNotEqual(httpx.__version__, "0.0.1")
+        self.cache.builder = PinnedBuilder()
+        gpu = GPUClient("http://testserver/?key=secret", session=self.client)
+        gpu.owner_id = "alice"
+
+        # Defined as a script would: nothing from this test module goes along
+        namespace = {"__name__": "__main__"}
+        exec("def version():\n    import httpx\n    return httpx.__version__\n", namespace)
+        version = gpu.remote(namespace["version"], requirements=["httpx==0.0.1"])
+
+        self.assertEqual(version(), "0.0.1")
+
+        # Only the gpuhost package is added to the runner's path
+        for path in _runner_env({}, python="/env/bin/python")["PYTHONPATH"].split(os.pathsep):
+            self.assertEqual(os.listdir(path), ["gpuhost"])
+
+    def test_bad_requirements(self):
+        self.assertEqual(self.submit(["--index-url=http://evil"]).status_code, 400)
+        self.builder.fail = True
+        res = self.submit(["missing-package"]).json()
+        self.assertEqual(res["status"], "env_error")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from gpuhost.job_manager import run_code, run_process, pidfd_child_watcher
+
+
+class TestAsyncExecutor(unittest.TestCase):
+
+    def test_many_concurrent_jobs_constant_threads(self):
+        # 60 jobs that each wait 1s: far more than the default threadpool (40)
+        async def main():
+            with pidfd_child_watcher():
+                threads_before = threading.active_count()
+                start = time.time()
+                jobs = [asyncio.ensure_future(run_code("import time; time.sleep(1); print('done')")) for _ in range(60)]
+                await asyncio.sleep(0.5)
+                threads_during = threading.active_count()
+                results = await asyncio.gather(*jobs)
+                return results, time.time() - start, threads_before, threads_during
+
+        results, elapsed, before, during = asyncio.run(main())
+        self.assertTrue(all(r["stdout"].strip() == "done" for r in results))
+        self.assertLess(elapsed, 10)
+        self.assertLessEqual(during - before, 2)
+
+    @unittest.skipUnless(os.name == "posix", "process groups are POSIX only")
+    def test_timeout_kills_process_group(self):
+        marker = os.path.join(tempfile.gettempdir(), f"gpuhost_grandchild_{os.getpid()}")
+        grandchild = f"import time; time.sleep(3); open({marker!r}, 'w').close()"
+        code = (
+            "import subprocess, sys, time\n"
+            f"subprocess.Popen([sys.executable, '-c', {grandchild!r}])\n"
+            "time.sleep(60)\n"
+        )
+        result = asyncio.run(run_code(code, timeout=1))
+        self.assertEqual(result["status"], "timeout")
+        time.sleep(3)
+        self.assertFalse(os.path.exists(marker), "grandchild survived the timeout")
+
+    def test_cancel_kills_process(self):
+        async def main():
+            task = asyncio.ensure_future(run_process([sys.executable, "-c", "import time; time.sleep(60)"]))
+            await asyncio.sleep(0.5)
+            start = time.time()
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            return time.time() - start
+
+        self.assertLess(asyncio.run(main()), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+import gpuhost.api as api
+from gpuhost.api import app, set_auth_token
+from gpuhost.clan import clan
+from gpuhost.client import GPUClient
+from gpuhost.hedging import Hedger
+
+
+class FakeNode:
+    def __init__(self, name, latency=0.01, fail=False):
+        self.name = name
+        self.latency = latency
+        self.fail = fail
+        self.calls = 0
+        self.cancelled = 0
+
+    async def __call__(self):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.latency)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.fail:
+            raise ConnectionError(f"{self.name} is down")
+        return self.name
+
+
+class TestHedger(unittest.TestCase):
+
+    def run_requests(self, hedger, nodes, n):
+        async def main():
+            return [await hedger.run([(node.name, node) for node in nodes]) for _ in range(n)]
+        return asyncio.run(main())
+
+    def test_slow_primary_gets_hedged(self):
+        a, b = FakeNode("a"), FakeNode("b", latency=0.02)
+        hedger = Hedger()
+        self.run_requests(hedger, [a, b], 30) # Learn the latencies
+        self.assertEqual(hedger.hedges, 0)
+        self.assertLess(hedger.delay(), 0.1)
+
+        a.latency = 5 # a (the fastest so far) stalls
+        start = time.time()
+        self.assertEqual(self.run_requests(hedger, [a, b], 1), ["b"])
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual((hedger.hedges, hedger.hedge_wins, a.cancelled), (1, 1, 1))
+
+        stats = hedger.stats()
+        self.assertGreater(stats["unhedged_p99_ms"], stats["p50_ms"])
+        self.assertAlmostEqual(stats["extra_load"], 1 / 31)
+
+    def test_budget_caps_extra_load(self):
+        a, b = FakeNode("a", latency=0.05), FakeNode("b", latency=0.05)
+        hedger = Hedger(budget_ratio=0.1, budget_burst=1)
+        with patch("gpuhost.hedging.INITIAL_DELAY", 0.0):
+            self.run_requests(hedger, [a, b], 40)
+        # Every request wanted a hedge; the budget allowed ~10%
+        self.assertLessEqual(hedger.hedges, 1 + 40 * 0.1)
+        self.assertLessEqual(a.calls + b.calls, 40 + hedger.hedges)
+
+    def test_failover(self):
+        a, b = FakeNode("a", fail=True), FakeNode("b")
+        hedger = Hedger(budget_ratio=0)
+        self.assertEqual(self.run_requests(hedger, [a, b], 1), ["b"])
+        self.assertEqual(hedger.failovers, 1)
+        # a is now ranked last
+        self.run_requests(hedger, [a, b], 1)
+        self.assertEqual(a.calls, 1)
+
+        b.fail = True
+        with self.assertRaises(ConnectionError):
+            self.run_requests(hedger, [a, b], 1)
+
+
+class TestHedgedEndpoints(unittest.TestCase):
+
+    def setUp(self):
+        clan.nodes = {}
+        set_auth_token("admin-secret")
+        self.client = TestClient(app)
+        hardware = {"arch": "Ampere", "cuda_capability": "8.6", "memory_total": 8 * 1024 ** 3}
+        with patch("gpuhost.api.get_gpu_info", return_value=hardware):
+            keys = self.client.post("/v2/clan/create?key=admin-secret").json()["keys"]
+        self.client_key = keys["client_key"]
+        for name in ("w1", "w2"):
+            self.client.post("/v2/clan/join", headers={"Authorization": f"Bearer {keys['worker_key']}"}, json={
+                "name": name, "url": f"http://{name}:8848", "hardware": hardware, "token": f"{name}-key"
+            })
+        self.hedger = Hedger()
+        self.call_hedger = Hedger()
+        self.patch = patch.dict(api.hedgers, {"chat": self.hedger, "call": self.call_hedger})
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        clan.nodes = {}
+        clan.clan_id = None
+        clan.host_id = None
+
+    def test_chat_is_hedged_across_workers(self):
+        latency = {"w1": 0.01, "w2": 0.03}
+
+        async def fake_post(node, path, body):
+            self.assertEqual(node.token, f"{node.name}-key")
+            self.assertFalse(body["hedge"]) # Workers answer themselves
+            await asyncio.sleep(latency[node.name])
+            return {"served_by": node.name}
+
+        chat = {"model": "m", "messages": [], "hedge": True}
+        headers = {"Authorization": f"Bearer {self.client_key}"}
+        with patch.object(api, "post_to_node", fake_post):
+            for _ in range(25):
+                self.client.post("/v1/chat/completions", headers=headers, json=chat)
+            latency["w1"] = 5
+            start = time.time()
+            res = self.client.post("/v1/chat/completions", headers=headers, json=chat)
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual(res.json(), {"served_by": "w2"})
+        self.assertEqual(self.hedger.hedge_wins, 1)
+
+        # Without hedge: served by the host as before
+        res = self.client.post("/v1/chat/completions", headers=headers, json={"model": "m", "messages": []})
+        self.assertIn("Mock Response", res.json()["choices"][0]["message"]["content"])
+
+    def test_forwarded_chat(self):
+        chat = {"model": "m", "messages": []}
+        # The agent key isn't a clan client key
+        res = self.client.post("/v1/chat/completions", headers={"Authorization": "Bearer admin-secret"}, json=chat)
+        self.assertEqual(res.status_code, 403)
+        with patch.object(api, "post_to_node") as post:
+            res = self.client.post("/v1/chat/completions", headers={"Authorization": f"Bearer {api.node_key()}"},
+                                   json=dict(chat, hedge=True))
+        post.assert_not_called() # Answered here, not forwarded again
+        self.assertIn("Mock Response", res.json()["choices"][0]["message"]["content"])
+
+    def test_hedged_remote_call(self):
+        sent = []
+        async def worker_down(node, pickle_hex, items, vram_bytes=None):
+            sent.append(vram_bytes)
+            raise ConnectionError("unreachable")
+
+        with patch.object(api, "run_shard_on_node", worker_down):
+            gpu = GPUClient(f"http://testserver/?key={self.client_key}", vram_bytes=1024, session=self.client)
+
+            @gpu.remote(hedge=True)
+            def add(x, y):
+                return x + y
+
+            # Workers are tried first and fail over to the host
+            self.call_hedger.node_latency[clan.host_id] = 1.0
+            self.assertEqual(add(2, 3), 5)
+        self.assertEqual(self.call_hedger.failovers, 2)
+        self.assertEqual(sent, [1024, 1024])
+
+    def test_hedged_call_rejects_job_options(self):
+        gpu = GPUClient(f"http://testserver/?key={self.client_key}", session=self.client)
+        for options in ({"requirements": ["numpy"]}, {"dedupe": True}, {"memo_ttl": 60}):
+            with self.assertRaises(ValueError):
+                gpu.remote(lambda: 1, hedge=True, **options)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+import unittest
+
+# Cumulative import time budgets (microseconds). Generous on purpose: the
+# real guard is that the heavy modules below don't get imported at all.
+BUDGETS = {
+    "gpuhost.client": 150_000,
+    "gpuhost.cli": 400_000,
+}
+
+HEAVY_MODULES = ["requests", "dill", "fastapi", "uvicorn", "pynvml", "pyngrok", "pydantic"]
+
+# The checkout under test, whatever directory the tests are run from
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_times(module: str) -> dict:
+    """Runs `python -X importtime -c 'import module'` and returns {name: cumulative_us}."""
+    pythonpath = os.pathsep.join(p for p in (ROOT, os.environ.get("PYTHONPATH")) if p)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True,
+        cwd=ROOT, env=dict(os.environ, PYTHONPATH=pythonpath)
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+class TestImportTime(unittest.TestCase):
+
+    def check(self, module: str):
+        times = import_times(module)
+        slowest = sorted(times.items(), key=lambda kv: -kv[1])[:10]
+        loaded = [m for m in HEAVY_MODULES if m in times]
+        self.assertEqual(loaded, [], f"`import {module}` pulls in heavy modules. Slowest: {slowest}")
+        self.assertLess(times[module], BUDGETS[module], f"Over budget. Slowest: {slowest}")
+
+    def test_client_import(self):
+        self.check("gpuhost.client")
+
+    def test_cli_import(self):
+        self.check("gpuhost.cli")
+
+
+if __name__ == "__main__":
+    unittest.main()
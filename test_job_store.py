@@ -0,0 +1,135 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+from unittest.mock import patch, AsyncMock
+
+from fastapi.testclient import TestClient
+
+import gpuhost.api as api
+from gpuhost.api import app, set_auth_token
+from gpuhost.job_store import JobStore
+from gpuhost.state import state
+
+client = TestClient(app)
+
+
+class TestJobStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = JobStore(os.path.join(self.tmp, "jobs.db"), retention_seconds=60, max_jobs=3)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_record_and_query(self):
+        self.store.record_submit("job-a", "alice", "code")
+        self.store.record_submit("job-b", "bob", "pickle")
+        self.store.record_result("job-a", {"status": "success", "stdout": "hi\n", "stderr": "", "return_code": 0})
+        self.store.record_result("job-b", {"status": "success", "stdout": "", "stderr": "", "result": b"\x01\x02".hex()})
+        self.store.flush()
+
+        job = self.store.get("job-a")
+        self.assertEqual(job["status"], "success")
+        self.assertEqual(job["return_code"], 0)
+        self.assertEqual(self.store.read_output(job)["stdout"], "hi\n")
+        self.assertEqual(self.store.read_result(self.store.get("job-b")), b"\x01\x02")
+
+        self.assertEqual([j["job_id"] for j in self.store.list(owner_id="bob")], ["job-b"])
+        self.assertEqual(len(self.store.list(status="success")), 2)
+        self.assertEqual(self.store.list(since=time.time() + 10), [])
+
+    def test_reopen_marks_running_jobs_interrupted(self):
+        self.store.record_submit("job-a", "alice", "code")
+        self.store.flush()
+        self.store.close()
+
+        reopened = JobStore(self.store.path)
+        self.assertEqual(reopened.get("job-a")["status"], "interrupted")
+        reopened.close()
+
+    def test_upgrades_old_schema(self):
+        path = os.path.join(self.tmp, "old.db")
+        conn = sqlite3.connect(path)
+        conn.execute(
+            "CREATE TABLE jobs (job_id TEXT PRIMARY KEY, owner_id TEXT NOT NULL, type TEXT NOT NULL, "
+            "status TEXT NOT NULL, submitted_at REAL NOT NULL, started_at REAL, finished_at REAL, "
+            "return_code INTEGER, output_path TEXT, result_path TEXT)"
+        )
+        conn.execute("INSERT INTO jobs (job_id, owner_id, type, status, submitted_at) VALUES ('old', 'alice', 'code', 'success', ?)",
+                     (time.time(),))
+        conn.commit()
+        conn.close()
+
+        store = JobStore(path)
+        store.record_submit("job-a", "alice", "code")
+        store.record_preempted("job-a", 2.5)
+        store.flush()
+        self.assertEqual(store.get("old")["preemptions"], 0)
+        job = store.get("job-a")
+        self.assertEqual((job["status"], job["preemptions"], job["lost_seconds"]), ("preempted", 1, 2.5))
+        store.close()
+
+    def test_duplicate_id_keeps_first_job(self):
+        self.store.record_submit("dup", "owner-1", "code")
+        with self.assertLogs("gpuhost.job_store", "ERROR"):
+            self.store.record_submit("dup", "owner-2", "code")
+            self.store.flush()
+        self.assertEqual(self.store.get("dup")["owner_id"], "owner-1")
+        self.assertTrue(self.store.exists("dup"))
+        self.assertFalse(self.store.exists("other"))
+
+    def test_retention(self):
+        for i in range(5):
+            self.store.record_submit(f"job-{i}", "alice", "code")
+            self.store.record_result(f"job-{i}", {"status": "success", "stdout": str(i)})
+        self.store.prune()
+        self.assertEqual(len(self.store.list()), 3)
+
+        self.store.prune(now=time.time() + 120)
+        self.assertEqual(self.store.list(), [])
+        self.assertEqual(os.listdir(self.store.blob_dir), [])
+
+    def test_fetch_after_submit(self):
+        set_auth_token("secret")
+        state.lock("owner-1")
+        try:
+            with patch.object(api, "job_store", self.store), \
+                 patch.object(api, "run_code", new=AsyncMock(return_value={"status": "success", "stdout": "ok", "stderr": "", "return_code": 0})):
+                resp = client.post(
+                    "/submit?key=secret",
+                    json={"owner_id": "owner-1", "code": "print('ok')", "job_id": "client-chosen"}
+                )
+                self.assertEqual(resp.json()["job_id"], "client-chosen")
+                self.store.flush()
+
+                job = client.get("/jobs/client-chosen?key=secret&owner_id=owner-1").json()
+                self.assertEqual(job["status"], "success")
+                self.assertEqual(job["stdout"], "ok")
+
+                listed = client.get("/jobs?key=secret&owner_id=owner-1").json()["jobs"]
+                self.assertEqual(len(listed), 1)
+
+                # Other owners see nothing
+                self.assertEqual(client.get("/jobs/client-chosen?key=secret&owner_id=owner-2").status_code, 404)
+                self.assertEqual(client.get("/jobs?key=secret&owner_id=owner-2").json()["jobs"], [])
+                self.assertEqual(client.get("/jobs?key=secret").status_code, 422)
+
+                # A job_id can't be reused, even before its row is written
+                again = client.post("/submit?key=secret", json={"owner_id": "owner-1", "code": "x", "job_id": "client-chosen"})
+                self.assertEqual(again.status_code, 409)
+                self.store.record_submit("queued-only", "owner-1", "code")
+                self.assertTrue(self.store.exists("queued-only"))
+
+                bad = client.post("/submit?key=secret", json={"owner_id": "owner-1", "code": "x", "job_id": "../etc"})
+                self.assertEqual(bad.status_code, 400)
+        finally:
+            state.unlock("owner-1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+
+from fastapi.testclient import TestClient
+
+from gpuhost.api import app, set_auth_token
+from gpuhost.clan import Node, clan
+from gpuhost.client import AsyncGPUClient, GPUClient
+from gpuhost.lan import AGENT_ID, NodeRoutes, hello_proof, is_local_url, lan_urls, valid_lan_url, verify_hello
+from gpuhost.state import state
+
+
+def stub_agent(name, agent_id, delay=0.0, lan=(), key="k", keys_seen=None):
+    """A fake agent holding `key`, answering /endpoints, /lan/hello and /info, `delay` seconds per request."""
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            time.sleep(delay)
+            if keys_seen is not None:
+                keys_seen.append(self.headers.get("Authorization"))
+            url = urlparse(self.path)
+            if url.path == "/endpoints":
+                body = {"agent_id": agent_id, "lan_urls": list(lan)}
+            elif url.path == "/lan/hello":
+                nonce = parse_qs(url.query)["nonce"][0]
+                body = {"agent_id": agent_id, "proofs": [hello_proof(key, agent_id, nonce)]}
+            else:
+                body = {"via": name}
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+class TestAdvertisedAddresses(unittest.TestCase):
+
+    def test_endpoints_and_info(self):
+        set_auth_token("secret")
+        with patch.object(state, "lan_urls", ["http://10.0.0.5:8848"]):
+            client = TestClient(app)
+            endpoints = client.get("/endpoints?key=secret").json()
+            self.assertEqual(endpoints, {"agent_id": AGENT_ID, "public_url": state.public_url, "lan_urls": ["http://10.0.0.5:8848"]})
+            self.assertEqual(client.get("/info?key=secret").json()["connection"]["lan_urls"], ["http://10.0.0.5:8848"])
+            self.assertEqual(client.get("/endpoints").status_code, 403)
+
+    def test_local_addresses(self):
+        self.assertTrue(all("127.0.0.1" not in url for url in lan_urls(8848)))
+        with patch.dict(os.environ, {"GPUHOST_LAN_ADDRESSES": "10.1.2.3, 192.168.1.9"}):
+            self.assertEqual(lan_urls(8848), ["http://10.1.2.3:8848", "http://192.168.1.9:8848"])
+        with patch.dict(os.environ, {"GPUHOST_LAN_ADDRESSES": ""}):
+            self.assertEqual(lan_urls(8848), [])
+        self.assertTrue(is_local_url("http://192.168.1.9:8848"))
+        self.assertFalse(is_local_url("https://abcd.ngrok.app"))
+
+    def test_hello_proves_the_key(self):
+        set_auth_token("secret")
+        client = TestClient(app)
+        nonce = "n" * 32
+        body = client.get(f"/lan/hello?nonce={nonce}").json() # No key needed, none given away
+        self.assertEqual(body["agent_id"], AGENT_ID)
+        self.assertNotIn("secret", json.dumps(body))
+        self.assertTrue(verify_hello(body, "secret", nonce, AGENT_ID))
+        self.assertFalse(verify_hello(body, "guess", nonce, AGENT_ID))
+        self.assertFalse(verify_hello(body, "secret", "other" * 8, AGENT_ID)) # Replayed to another probe
+        self.assertFalse(verify_hello(body, "secret", nonce, "agent-b"))
+        self.assertEqual(client.get("/lan/hello?nonce=short").status_code, 422)
+
+    def test_join_validates_lan_urls(self):
+        self.assertTrue(valid_lan_url("http://192.168.1.9:8848"))
+        for url in ["http://127.0.0.1:8848", "http://8.8.8.8:8848", "http://192.168.1.9", "https://10.0.0.5:8848",
+                    "http://10.0.0.5:8848/admin", "http://user@10.0.0.5:8848", "http://169.254.169.254:80",
+                    "http://example.lan:8848"]:
+            self.assertFalse(valid_lan_url(url), url)
+
+        set_auth_token("secret")
+        client = TestClient(app)
+        try:
+            hardware = {"name": "GPU", "arch": "Ampere", "cuda_capability": "8.6", "memory_total": 8 << 30}
+            with patch("gpuhost.api.get_gpu_info", return_value=hardware):
+                keys = client.post("/v2/clan/create?key=secret").json()["keys"]
+            headers = {"Authorization": f"Bearer {keys['worker_key']}"}
+            join = {"name": "w", "url": "http://worker", "hardware": hardware, "token": "wk"}
+            res = client.post("/v2/clan/join", headers=headers, json=dict(join, lan_urls=["http://169.254.169.254:80"]))
+            self.assertEqual(res.status_code, 400)
+            res = client.post("/v2/clan/join", headers=headers, json=dict(join, lan_urls=["http://10.0.0.5:8848"], agent_id="a"))
+            self.assertEqual(res.status_code, 200)
+            node = clan.nodes[res.json()["node_id"]]
+            self.assertEqual((node.lan_urls, node.agent_id), (["http://10.0.0.5:8848"], "a"))
+        finally:
+            clan.nodes = {}
+            clan.clan_id = None
+            clan.key_roles = {}
+
+
+class TestLanFastPath(unittest.TestCase):
+
+    def setUp(self):
+        self.lan_keys = []
+        self.lan, self.lan_url = stub_agent("lan", "agent-a", keys_seen=self.lan_keys)
+        self.impostor, impostor_url = stub_agent("impostor", "agent-b") # Another agent on the same network
+        # Claims to be our agent but doesn't know the key: never gets it
+        self.spoof_keys = []
+        self.spoof, self.spoof_url = stub_agent("spoof", "agent-a", key="guess", keys_seen=self.spoof_keys)
+        self.tunnel, self.tunnel_url = stub_agent(
+            "tunnel", "agent-a", delay=0.05, lan=[impostor_url, self.spoof_url, "http://127.0.0.1:9", self.lan_url]
+        )
+        # The stubs all live on 127.0.0.1: pretend the tunnel is a public URL
+        self.patch = patch("gpuhost.client.client.is_local_url", return_value=False)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        for server in (self.lan, self.impostor, self.spoof, self.tunnel):
+            server.shutdown()
+            server.server_close()
+
+    def test_client_prefers_lan_and_falls_back(self):
+        gpu = GPUClient(f"{self.tunnel_url}/?key=k", lan=True)
+        self.assertEqual(gpu.get_info(), {"via": "lan"})
+        self.assertEqual(gpu.url, self.lan_url)
+        self.assertEqual(self.spoof_keys, [None])
+        self.assertEqual(self.lan_keys, [None, "Bearer k"]) # Probed without the key, used once verified
+
+        # The LAN route goes away (the open keep-alive connection with it)
+        self.lan.shutdown()
+        self.lan.server_close()
+        gpu.session.close()
+        self.assertEqual(gpu.get_info(), {"via": "tunnel"})
+        self.assertEqual(gpu.url, gpu.public_url)
+
+        self.assertEqual(GPUClient(f"{self.tunnel_url}/?key=k").get_info(), {"via": "tunnel"}) # Opt-in
+
+    def test_async_client(self):
+        async def main():
+            async with AsyncGPUClient(f"{self.tunnel_url}/?key=k", lan=True) as gpu:
+                infos = await asyncio.gather(gpu.get_info(), gpu.get_info())
+                return infos, gpu.url
+        infos, url = asyncio.run(main())
+        self.assertEqual(infos, [{"via": "lan"}] * 2)
+        self.assertEqual(url, self.lan_url)
+
+    def test_clan_node_routes(self):
+        routes = NodeRoutes()
+        node = Node(id="w1", role="worker", name="w1", url=self.tunnel_url, hardware={}, token="k",
+                    lan_urls=["http://127.0.0.1:9", self.spoof_url, self.lan_url], agent_id="agent-a")
+        self.assertEqual(asyncio.run(routes.url(node)), self.lan_url)
+        self.assertEqual(self.spoof_keys, [None])
+        routes.failed(node, self.lan_url)
+        self.assertEqual(asyncio.run(routes.url(node)), self.tunnel_url)
+        self.assertEqual(asyncio.run(routes.url(node.model_copy(update={"lan_urls": []}))), self.tunnel_url)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import asyncio
+import json
+import threading
+import unittest
+from unittest.mock import patch
+
+import gpuhost.api as api
+import gpuhost.live as live
+from gpuhost.live import LiveFeed
+
+
+def parse(message: bytes) -> dict:
+    assert message.startswith(b"data: ")
+    return json.loads(message[len(b"data: "):])
+
+
+class TestLiveFeed(unittest.TestCase):
+
+    def setUp(self):
+        self.values = {"status": {"is_locked": False}, "gpu": {"memory_used": 1}}
+        self.gpu_reads = 0
+        self.gpu_threads = set()
+        self.feed = LiveFeed(max_rate=20)
+        self.feed.add_section("status", lambda: self.values["status"])
+        self.feed.add_section("gpu", self.read_gpu, interval=0.3, blocking=True)
+
+    def read_gpu(self):
+        self.gpu_reads += 1
+        self.gpu_threads.add(threading.get_ident())
+        return self.values["gpu"]
+
+    def test_pushes_only_changes_to_all_subscribers(self):
+        async def main():
+            a = await self.feed.subscribe()
+            b = await self.feed.subscribe()
+            self.assertEqual(parse(a.get_nowait()), {"status": {"is_locked": False}, "gpu": {"memory_used": 1}})
+            b.get_nowait()
+
+            # A burst of changes is coalesced into one push
+            for i in range(10):
+                self.values["status"] = {"is_locked": True, "n": i}
+                self.feed.notify()
+                await asyncio.sleep(0)
+            first = await asyncio.wait_for(a.get(), 1)
+            self.assertIs(first, await b.get()) # Encoded once, shared
+            self.assertEqual(parse(first), {"status": {"is_locked": True, "n": 9}})
+
+            # Telemetry is sampled on its own interval, once for everyone
+            self.values["gpu"] = {"memory_used": 2}
+            update = parse(await asyncio.wait_for(a.get(), 2))
+            self.assertEqual(update, {"gpu": {"memory_used": 2}})
+            reads = self.gpu_reads
+            await asyncio.sleep(1)
+            self.assertLessEqual(self.gpu_reads - reads, 4)
+            self.assertTrue(a.empty()) # Nothing changed, nothing sent
+
+            self.feed.unsubscribe(a)
+            self.feed.unsubscribe(b)
+            await asyncio.sleep(0.2)
+            self.assertIsNone(self.feed._producer) # Idle without viewers
+        asyncio.run(main())
+        self.assertNotIn(threading.get_ident(), self.gpu_threads) # NVML reads stay off the loop
+
+    def test_slow_subscriber_is_resynced(self):
+        async def main():
+            with patch.object(live, "SUBSCRIBER_BUFFER", 2):
+                queue = await self.feed.subscribe()
+            for i in range(5):
+                self.values["status"] = {"n": i}
+                self.feed.notify()
+                await asyncio.sleep(0.07)
+            messages = [parse(queue.get_nowait()) for _ in range(queue.qsize())]
+            self.feed.unsubscribe(queue)
+            return messages
+        messages = asyncio.run(main())
+        self.assertLessEqual(len(messages), 2)
+        self.assertEqual(set(messages[0]), {"status", "gpu"}) # Full state again
+        self.assertEqual(messages[-1]["status"], {"n": 4})
+
+    def test_events_endpoint(self):
+        async def main():
+            response = await api.events()
+            self.assertEqual(response.media_type, "text/event-stream")
+            first = await response.body_iterator.__anext__()
+            await response.body_iterator.aclose()
+            return parse(first.encode() if isinstance(first, str) else first)
+        gpu_info = lambda: {"name": "Test GPU", "memory_used": 0}
+        with patch.dict(api.live_feed._sections["gpu"], provider=gpu_info):
+            state = asyncio.run(main())
+        self.assertEqual(state["gpu"]["name"], "Test GPU")
+        self.assertIn("is_locked", state["status"])
+        self.assertNotIn("workload_duration", state["status"])
+        self.assertIn("running_jobs", state["queue"])
+
+
+if __name__ == "__main__":
+    unittest.main()
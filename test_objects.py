@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+import gpuhost.api as api
+from gpuhost.api import app, set_auth_token
+from gpuhost.client import GPUClient, ObjectRef
+from gpuhost.job_store import JobStore
+from gpuhost.objects import ObjectStore
+from gpuhost.state import state
+
+
+class TestObjectRefs(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = ObjectStore(os.path.join(self.tmp, "objects"), ttl=60)
+        self.patches = [
+            patch.object(api, "object_store", self.store),
+            patch.object(api, "job_store", JobStore(os.path.join(self.tmp, "jobs.db"))),
+        ]
+        for p in self.patches:
+            p.start()
+        set_auth_token("secret")
+        self.client = GPUClient("http://testserver/?key=secret", session=TestClient(app))
+        state.lock(self.client.owner_id)
+
+    def tearDown(self):
+        state.unlock(self.client.owner_id)
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_refs_stay_on_host(self):
+        @self.client.remote(return_ref=True)
+        def make(n):
+            return list(range(n))
+
+        @self.client.remote
+        def total(xs, scale=1):
+            return sum(xs) * scale
+
+        ref = make(1000)
+        self.assertIsInstance(ref, ObjectRef)
+        self.assertEqual(self.store.stats()["objects"], 1)
+
+        # Passed as arg/kwarg: resolved host-side
+        self.assertEqual(total(ref, scale=2), 999000)
+        self.assertEqual(total(xs=ref), 499500)
+        self.assertEqual(ref.get()[:3], [0, 1, 2])
+
+        ref.release()
+        self.assertEqual(self.store.stats()["objects"], 0)
+        with self.assertRaises(Exception):
+            total(ref)
+
+        with make(3) as ref:
+            self.assertEqual(ref.get(), [0, 1, 2])
+        self.assertEqual(self.store.stats()["objects"], 0)
+
+    def test_owner_only(self):
+        @self.client.remote(return_ref=True)
+        def make():
+            return "mine"
+
+        ref = make()
+        http = self.client.session
+        headers = {"Authorization": "Bearer secret"}
+        self.assertEqual(http.get(f"/objects/{ref.ref}?owner_id=eve", headers=headers).status_code, 404)
+        self.assertEqual(http.get(f"/objects/{ref.ref}", headers=headers).status_code, 422)
+        res = http.post(f"/objects/{ref.ref}/release", headers=headers, json={"owner_id": "eve"})
+        self.assertEqual(res.status_code, 404)
+        self.assertIsNone(self.store.acquire(ref.ref, "eve")) # Nor pass it to a job
+        self.assertEqual(ref.get(), "mine")
+        ref.release()
+
+    def path(self, data=b"x"):
+        path = self.store.new_path()
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_ttl_expiry(self):
+        path = self.path()
+        ref = self.store.put(path, "owner")
+        self.store.expire(now=time.time() + 120)
+        self.assertIsNone(self.store.read(ref, "owner"))
+        self.assertFalse(os.path.exists(path))
+
+    def test_pinned_objects_outlive_release_and_ttl(self):
+        ref = self.store.put(self.path(), "owner")
+        self.assertIsNotNone(self.store.acquire(ref, "owner")) # A job is using it
+        self.store.expire(now=time.time() + 120)
+        self.assertTrue(self.store.release(ref, "owner"))
+        self.assertTrue(self.store.release(ref, "owner")) # Twice: doesn't drop the job's pin
+        self.assertEqual(self.store.read(ref, "owner"), b"x")
+        self.store.unpin(ref)
+        self.assertIsNone(self.store.info(ref))
+        self.assertFalse(self.store.release(ref, "owner"))
+
+    def test_orphans_removed(self):
+        kept = self.store.put(self.path(), "owner")
+        orphan, fresh = self.path(), self.path()
+        os.utime(orphan, (time.time() - 120, time.time() - 120))
+        os.utime(self.store.info(kept)["path"], (time.time() - 120, time.time() - 120))
+        self.store.remove_orphans()
+        self.assertFalse(os.path.exists(orphan))
+        self.assertTrue(os.path.exists(fresh)) # Maybe a job still writing it
+        self.assertEqual(self.store.read(kept, "owner"), b"x")
+
+
+if __name__ == "__main__":
+    unittest.main()
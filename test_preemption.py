@@ -0,0 +1,208 @@
+import asyncio
+import os
+import shutil
+import signal
+import tempfile
+import textwrap
+import time
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+import gpuhost.api as api
+from gpuhost.api import app, set_auth_token
+from gpuhost.job_manager import run_code
+from gpuhost.job_store import JobStore
+from gpuhost.preemption import Preemption
+from gpuhost.clan import clan
+from gpuhost.state import state
+
+# Counts to 100, picking up from its checkpoint; saves it and exits on SIGTERM
+CHECKPOINTING_JOB = textwrap.dedent("""
+    import os, signal, sys, time
+    path = {path!r}
+    step = int(open(path).read()) if os.path.exists(path) else 0
+    if step:
+        print(f"resumed at {{step}}")
+
+    def save(*_):
+        with open(path, "w") as f:
+            f.write(str(step))
+        sys.exit(1)
+
+    signal.signal(signal.SIGTERM, save)
+    while step < {steps}:
+        time.sleep(0.01)
+        step += 1
+    print("done")
+""")
+
+
+def enabled_preemption(**kwargs) -> Preemption:
+    preemption = Preemption(**kwargs)
+    preemption.enabled = True
+    return preemption
+
+
+class PreemptionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = JobStore(os.path.join(self.tmp, "jobs.db"))
+        self.preemption = enabled_preemption(grace=0.5)
+        self.patches = [
+            patch.object(api, "job_store", self.store),
+            patch.object(api, "preemption", self.preemption),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for owner in ("alice", "bob", "carol"):
+            state.unlock(owner)
+        for p in self.patches:
+            p.stop()
+        self.store.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+class TestPreemptedJobs(PreemptionTestCase):
+
+    def test_checkpoint_and_resume(self):
+        code = CHECKPOINTING_JOB.format(path=os.path.join(self.tmp, "step"), steps=100)
+
+        async def main():
+            self.assertTrue(state.lock("alice", "batch"))
+            job = api._start_job("train", "alice", "code", lambda: run_code(code), None)
+            await asyncio.sleep(0.5)
+
+            stopped = await self.preemption.preempt(state.holder(), "bob", "interactive")
+            self.assertEqual(stopped, ["train"])
+            self.assertEqual(state.owner_id, "bob")
+            self.assertFalse(job.done()) # Requeued, not failed
+            await asyncio.sleep(0.2)
+            self.assertFalse(job.done())
+
+            state.unlock("bob")
+            self.preemption.resume()
+            self.assertEqual(state.owner_id, "alice")
+            return await job
+
+        result = asyncio.run(main())
+        self.assertEqual(result["status"], "success")
+        self.assertRegex(result["stdout"], r"resumed at [1-9]\d*\ndone")
+        self.assertEqual(result["preemptions"], 1)
+        self.assertGreater(result["lost_seconds"], 0.3)
+
+        self.store.flush()
+        record = self.store.get("train")
+        self.assertEqual((record["status"], record["preemptions"]), ("success", 1))
+        self.assertAlmostEqual(record["lost_seconds"], result["lost_seconds"], places=2)
+        stats = self.preemption.stats()
+        self.assertEqual((stats["preemptions"], stats["jobs_preempted"], stats["waiting_owners"]), (1, 1, 0))
+
+    def test_killed_after_grace(self):
+        code = "import signal, time\nsignal.signal(signal.SIGTERM, signal.SIG_IGN)\ntime.sleep(30)"
+
+        async def main():
+            state.lock("alice", "batch")
+            job = api._start_job("stubborn", "alice", "code", lambda: run_code(code), None)
+            await asyncio.sleep(0.3)
+            start = time.monotonic()
+            await self.preemption.preempt(state.holder(), "bob", "interactive")
+            waited = time.monotonic() - start
+            # Alice gives up instead of waiting for the lock
+            self.assertTrue(self.preemption.release("alice"))
+            return waited, await job
+
+        waited, result = asyncio.run(main())
+        self.assertGreaterEqual(waited, 0.5)
+        self.assertLess(waited, 5)
+        self.assertEqual(result["status"], "preempted")
+
+    def test_preempted_before_spawning(self):
+        async def main():
+            state.lock("alice", "batch")
+            job = api._start_job("quick", "alice", "code", lambda: run_code("print('hi')"), None)
+            await asyncio.sleep(0) # Started, process not spawned yet: it's stopped as soon as it is
+            await self.preemption.preempt(state.holder(), "bob", "interactive")
+            state.unlock("bob")
+            self.preemption.resume()
+            return await job
+
+        result = asyncio.run(main())
+        self.assertEqual((result["stdout"], result["preemptions"]), ("hi\n", 1))
+
+
+    def test_preempted_before_starting(self):
+        async def main():
+            state.lock("alice", "batch")
+            await self.preemption.preempt(state.holder(), "bob", "interactive")
+            job = api._start_job("late", "alice", "code", lambda: run_code("print('hi')"), None)
+            await asyncio.sleep(0.3)
+            self.assertFalse(job.done()) # Doesn't run on bob's lock
+            state.unlock("bob")
+            self.preemption.resume()
+            return await job
+
+        result = asyncio.run(main())
+        self.assertEqual(result["stdout"], "hi\n")
+        self.assertNotIn("preemptions", result)
+
+
+class TestLockPriorities(PreemptionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        set_auth_token("secret")
+        self.client = TestClient(app)
+        self.headers = {"Authorization": "Bearer secret"}
+
+    def lock(self, owner, priority=None):
+        body = {"owner_id": owner} if priority is None else {"owner_id": owner, "priority": priority}
+        return self.client.post("/lock", headers=self.headers, json=body)
+
+    def test_higher_class_takes_over(self):
+        self.assertEqual(self.lock("alice", "batch").status_code, 200)
+        self.assertEqual(self.lock("carol", "batch").status_code, 503) # Same class waits its turn
+        res = self.lock("bob")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()["preempted"], {"owner_id": "alice", "jobs": []})
+        self.assertEqual(state.get_status()["priority"], "normal")
+
+        # Alice's lock is waiting to come back: no new jobs meanwhile
+        res = self.client.post("/submit", headers=self.headers, json={"owner_id": "alice", "code": "print(1)"})
+        self.assertEqual(res.status_code, 409)
+
+        self.assertEqual(self.client.post("/unlock", headers=self.headers, json={"owner_id": "bob"}).status_code, 200)
+        self.assertEqual(state.owner_id, "alice")
+        info = self.client.get("/info?key=secret").json()
+        self.assertEqual(info["preemption"]["preemptions"], 1)
+        self.assertEqual(info["status"]["priority"], "batch")
+
+    def test_disabled_or_unknown(self):
+        self.preemption.enabled = False
+        self.lock("alice", "batch")
+        self.assertEqual(self.lock("bob", "interactive").status_code, 503)
+        self.assertEqual(self.lock("bob", "urgent").status_code, 400)
+
+    def test_clan_keys_capped(self):
+        client_key = {"Authorization": "Bearer ck"}
+        with patch.object(clan, "key_roles", {"ck": "client"}):
+            res = self.client.post("/lock", headers=client_key, json={"owner_id": "carol", "priority": "interactive"})
+            self.assertEqual(res.status_code, 403)
+            self.assertEqual(self.lock("alice", "batch").status_code, 200)
+            res = self.client.post("/lock", headers=client_key, json={"owner_id": "carol", "priority": "normal"})
+            self.assertEqual(res.status_code, 200) # Up to the cap
+            self.assertEqual(self.lock("bob", "interactive").status_code, 200) # The agent's own key
+
+            self.preemption.max_priority["client"] = "interactive"
+            self.assertEqual(self.client.post("/lock", headers=client_key, json={"owner_id": "carol", "priority": "interactive"}).status_code, 503)
+
+    def test_signal_name(self):
+        self.assertEqual(Preemption(sig=signal.SIGINT).stats()["signal"], "SIGINT")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+import gpuhost.api as api
+from gpuhost.api import app, set_auth_token
+from gpuhost.clan import clan
+from gpuhost.ratelimit import RateLimited, RateLimiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_key_token_bucket(self):
+        clock = Clock()
+        limiter = RateLimiter(key_rate=2, key_burst=3, clock=clock)
+
+        async def main():
+            for _ in range(3):
+                limiter.release(await limiter.admit("k"))
+            with self.assertRaises(RateLimited) as ctx:
+                await limiter.admit("k")
+            self.assertAlmostEqual(ctx.exception.retry_after, 0.5)
+            limiter.release(await limiter.admit("other")) # Keys are independent
+            clock.now = 0.5
+            limiter.release(await limiter.admit("k"))
+
+        asyncio.run(main())
+        self.assertEqual(limiter.rejected, {"key_rate": 1})
+
+    def test_owner_caps(self):
+        limiter = RateLimiter(owner_concurrency=1)
+
+        async def main():
+            first = await limiter.admit("k")
+            limiter.claim(first, "alice")
+            second = await limiter.admit("k")
+            with self.assertRaises(RateLimited):
+                limiter.claim(second, "alice")
+            limiter.claim(second, "bob")
+            limiter.release(first)
+            third = await limiter.admit("k")
+            limiter.claim(third, "alice")
+
+        asyncio.run(main())
+
+    def test_bounded_fifo_queue(self):
+        limiter = RateLimiter(max_inflight=1, max_queued=2)
+
+        async def main():
+            running = await limiter.admit("a")
+            first = asyncio.ensure_future(limiter.admit("b"))
+            second = asyncio.ensure_future(limiter.admit("c"))
+            gone = asyncio.ensure_future(limiter.admit("d"))
+            await asyncio.sleep(0)
+            self.assertEqual(limiter.stats()["queued"], 2)
+            with self.assertRaises(RateLimited): # Queue full: rejected, not queued
+                await gone
+
+            first.cancel() # Gave up waiting: its place goes to the next in line
+            await asyncio.sleep(0)
+            limiter.release(running)
+            ticket = await asyncio.wait_for(second, 1)
+            self.assertEqual(ticket.key, "c")
+            self.assertEqual(limiter.inflight, 1)
+            limiter.release(ticket)
+            self.assertEqual(limiter.inflight, 0)
+
+        asyncio.run(main())
+
+
+class TestRateLimitedEndpoints(unittest.TestCase):
+
+    def setUp(self):
+        set_auth_token("secret")
+        self.client = TestClient(app)
+        self.limiter = RateLimiter(key_rate=1, key_burst=2)
+        self.patch = patch.object(api, "rate_limiter", self.limiter)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        clan.nodes = {}
+        clan.clan_id = None
+        clan.key_roles = {}
+
+    def test_flood_gets_429(self):
+        keys = self.client.post("/v2/clan/create?key=secret").json()["keys"]
+        headers = {"Authorization": f"Bearer {keys['client_key']}"}
+        chat = {"model": "m", "messages": []}
+        codes = [self.client.post("/v1/chat/completions", headers=headers, json=chat).status_code for _ in range(4)]
+        self.assertEqual(codes[:2], [200, 200])
+        res = self.client.post("/v1/chat/completions", headers=headers, json=chat)
+        self.assertEqual(res.status_code, 429)
+        self.assertGreaterEqual(int(res.headers["Retry-After"]), 1)
+        # Cheap endpoints aren't limited
+        self.assertEqual(self.client.get("/info", headers=headers).status_code, 200)
+        self.assertEqual(self.client.get("/info?key=secret").json()["rate_limits"]["rejected"]["key_rate"], 3)
+
+    def test_key_index(self):
+        keys = self.client.post("/v2/clan/create?key=secret").json()["keys"]
+        for key in (keys["worker_key"], keys["client_key"], "secret"):
+            self.assertEqual(self.client.get("/info", headers={"Authorization": f"Bearer {key}"}).status_code, 200)
+        self.assertEqual(self.client.get("/info", headers={"Authorization": "Bearer nope"}).status_code, 403)
+        # Clan keys only work as bearer tokens, like before
+        self.assertEqual(self.client.get(f"/info?key={keys['client_key']}").status_code, 403)
+
+
+if __name__ == "__main__":
+    unittest.main()
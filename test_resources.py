@@ -0,0 +1,56 @@
+import asyncio
+import os
+import resource
+import unittest
+from unittest.mock import patch
+
+import gpuhost.resources as resources
+from gpuhost.job_manager import run_code
+from gpuhost.resources import ResourceBudget, prepare
+
+
+@unittest.skipUnless(hasattr(os, "sched_setaffinity"), "needs Linux CPU affinity")
+class TestResourceBudgets(unittest.TestCase):
+
+    def test_budget_applied_to_job(self):
+        cpu = sorted(os.sched_getaffinity(0))[0]
+        apply_limits, env = prepare(ResourceBudget(cpus=[cpu], nice=5, max_open_files=64))
+        code = (
+            "import os, resource\n"
+            "print(sorted(os.sched_getaffinity(0)), os.nice(0), "
+            "resource.getrlimit(resource.RLIMIT_NOFILE)[0], os.environ['OMP_NUM_THREADS'])\n"
+        )
+        result = asyncio.run(run_code(code, apply_limits=apply_limits, env=env))
+        self.assertEqual(result["stdout"].strip(), f"[{cpu}] {os.nice(0) + 5} 64 1")
+
+    def test_invalid_budgets_rejected(self):
+        with self.assertRaises(ValueError):
+            prepare(ResourceBudget(cpus=[100000]))
+        with self.assertRaises(ValueError):
+            prepare(ResourceBudget(nice=-5))
+        with self.assertRaises(ValueError):
+            prepare(ResourceBudget(memory_bytes=0))
+
+    def test_memory_limit_is_data_segment(self):
+        apply_limits, env = prepare(ResourceBudget(memory_bytes=1 << 30))
+        code = (
+            "import resource\n"
+            "print(resource.getrlimit(resource.RLIMIT_DATA)[0], resource.getrlimit(resource.RLIMIT_AS)[0])\n"
+        )
+        result = asyncio.run(run_code(code, apply_limits=apply_limits, env=env))
+        self.assertEqual(result["stdout"].split(), [str(1 << 30), str(resource.getrlimit(resource.RLIMIT_AS)[0])])
+
+    def test_default_prefers_gpu_local_cores_minus_reserved(self):
+        with patch.object(resources, "available_cores", return_value=[0, 1, 2, 3, 4, 5, 6, 7]), \
+             patch.object(resources, "RESERVED_CORES", [4]), \
+             patch.object(resources, "get_gpu_cpu_affinity", return_value=[4, 5, 6, 7]):
+            self.assertEqual(resources.default_job_cores(), [5, 6, 7])
+
+        with patch.object(resources, "available_cores", return_value=[0, 1, 2, 3]), \
+             patch.object(resources, "RESERVED_CORES", [0]), \
+             patch.object(resources, "get_gpu_cpu_affinity", return_value=None):
+            self.assertEqual(resources.default_job_cores(), [1, 2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+import httpx
+
+import gpuhost.api as api
+from gpuhost.api import app, set_auth_token
+from gpuhost.job_store import JobStore
+from gpuhost.single_flight import SingleFlight
+from gpuhost.state import state
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_memo_ttl_and_bounds(self):
+        flights = SingleFlight(max_entries=2)
+
+        async def run(key, job_id, ttl):
+            job = asyncio.ensure_future(asyncio.sleep(0, result={"status": "success", "stdout": job_id}))
+            flights.start(key, job_id, job, ttl)
+            await job
+
+        async def main():
+            await run("a", "job-a", 60)
+            await run("b", "job-b", 0.1)
+            self.assertIsNone(flights.recall("a", None)) # Not opted in
+            self.assertEqual(flights.recall("a", 60)["memoized_from"], "job-a")
+            self.assertIsNone(flights.recall("b", 60, now=time.time() + 1)) # Expired
+            await run("c", "job-c", 60)
+            await run("d", "job-d", 60) # Evicts the least recently used
+        asyncio.run(main())
+        self.assertIsNone(flights.recall("a", 60))
+        self.assertIsNotNone(flights.recall("d", 60))
+
+
+class TestDeduplicatedSubmit(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.counter = os.path.join(self.tmp, "runs")
+        self.store = JobStore(os.path.join(self.tmp, "jobs.db"))
+        self.patches = [
+            patch.object(api, "job_store", self.store),
+            patch.object(api, "single_flight", SingleFlight()),
+        ]
+        for p in self.patches:
+            p.start()
+        set_auth_token("secret")
+        state.lock("alice")
+        self.code = f"import time; open({self.counter!r}, 'a').write('x'); time.sleep(1); print('result')"
+
+    def tearDown(self):
+        state.unlock("alice")
+        for p in self.patches:
+            p.stop()
+        self.store.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def runs(self):
+        with open(self.counter) as f:
+            return len(f.read())
+
+    def submit(self, *bodies):
+        async def main():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                responses = await asyncio.gather(*(
+                    client.post("/submit", json=dict({"owner_id": "alice", "code": self.code}, **b),
+                                headers={"Authorization": "Bearer secret"}, timeout=30)
+                    for b in bodies
+                ))
+            return [r.json() for r in responses]
+        return asyncio.run(main())
+
+    def test_identical_jobs_share_one_run(self):
+        results = self.submit(*[{"dedupe": True, "job_id": f"job-{i}"} for i in range(4)])
+        self.assertEqual(self.runs(), 1)
+        self.assertTrue(all(r["stdout"] == "result\n" for r in results))
+        self.assertEqual(sorted(r["job_id"] for r in results), [f"job-{i}" for i in range(4)])
+        self.assertEqual(sum(1 for r in results if "shared_with" in r), 3)
+
+        # Every duplicate has its own record
+        self.store.flush()
+        self.assertEqual(self.store.get("job-3")["status"], "success")
+
+        # Finished and not memoized: runs again
+        self.submit({"dedupe": True})
+        self.assertEqual(self.runs(), 2)
+
+    def test_memoized_result(self):
+        first, = self.submit({"idempotency_key": "eval-1", "memo_ttl": 60})
+        again, = self.submit({"idempotency_key": "eval-1", "memo_ttl": 60})
+        self.assertEqual(self.runs(), 1)
+        self.assertEqual(again["memoized_from"], first["job_id"])
+        self.assertEqual(again["stdout"], "result\n")
+
+        # Opt-in only
+        self.submit({"idempotency_key": "eval-1"})
+        self.assertEqual(self.runs(), 2)
+
+    def test_incompatible_options(self):
+        async def main():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await client.post("/submit", headers={"Authorization": "Bearer secret"}, json={
+                    "owner_id": "alice", "code": self.code, "dedupe": True, "cancel_on_disconnect": True
+                })
+        self.assertEqual(asyncio.run(main()).status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
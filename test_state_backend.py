@@ -0,0 +1,187 @@
+import multiprocessing
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+import gpuhost.api as api
+from gpuhost.api import app, set_auth_token
+from gpuhost.clan import META_KEY, NODE_PREFIX, ClanState, Node
+from gpuhost.state import state
+from gpuhost.state_backend import MemoryBackend, SqliteBackend
+
+
+def count_up(path, times):
+    """Worker process: increments a shared counter with a compare-and-set loop."""
+    backend = SqliteBackend(path)
+    for _ in range(times):
+        while True:
+            current = backend.get("counter")
+            if backend.compare_and_set("counter", current, (current or 0) + 1):
+                break
+    backend.close()
+
+
+def stamp_up(path, times):
+    """count_up with compare_and_stamp."""
+    backend = SqliteBackend(path)
+    for _ in range(times):
+        while True:
+            current = backend.get("counter")
+            if backend.compare_and_stamp("counter", current, (current or 0) + 1) is not None:
+                break
+    backend.close()
+
+
+def node(node_id, role="worker"):
+    hardware = {"arch": "Ampere", "cuda_capability": "8.6", "memory_total": 1000}
+    return Node(id=node_id, role=role, name=node_id, url=f"http://{node_id}", hardware=hardware, token=f"t-{node_id}")
+
+
+class TestBackends(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "state.db")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_compare_and_set(self):
+        for backend in (MemoryBackend(), SqliteBackend(self.path)):
+            self.assertTrue(backend.compare_and_set("k", None, {"a": 1, "b": 2}))
+            self.assertFalse(backend.compare_and_set("k", None, {"a": 2})) # Already there
+            self.assertFalse(backend.compare_and_set("k", {"a": 2}, {"a": 3}))
+            self.assertTrue(backend.compare_and_set("k", {"b": 2, "a": 1}, {"a": 3})) # Key order doesn't matter
+            self.assertEqual(backend.get("k"), {"a": 3})
+            self.assertTrue(backend.compare_and_set("k", {"a": 3}, None))
+            self.assertIsNone(backend.get("k"))
+            backend.set("k", [1])
+            self.assertEqual(backend.get("k"), [1])
+
+            self.assertEqual(backend.compare_and_stamp("s/a", None, {"v": 1}), 1)
+            self.assertIsNone(backend.compare_and_stamp("s/a", None, {"v": 2})) # Already there
+            self.assertEqual(backend.compare_and_stamp("s/b", None, 2), 2)
+            self.assertEqual(backend.compare_and_stamp("s/a", {"v": 1}, None), 3) # Tombstone
+            self.assertEqual(backend.changed_since("s/", 1), [("s/b", 2, 2), ("s/a", None, 3)])
+            self.assertEqual(backend.compare_and_stamp("s/a", None, {"v": 3}), 4)
+            self.assertEqual(backend.last_stamp(), 4)
+            self.assertEqual(backend.changed_since("t/", 0), [])
+            backend.close()
+
+    def test_atomic_across_processes(self):
+        for target in (count_up, stamp_up):
+            with self.subTest(target.__name__):
+                path = os.path.join(self.tmp.name, f"{target.__name__}.db")
+                SqliteBackend(path).close()
+                workers = [multiprocessing.Process(target=target, args=(path, 50)) for _ in range(4)]
+                for p in workers:
+                    p.start()
+                for p in workers:
+                    p.join(60)
+                backend = SqliteBackend(path)
+                self.assertEqual(backend.get("counter"), 200)
+                if target is stamp_up:
+                    self.assertEqual(backend.last_stamp(), 200) # One stamp per successful write
+                backend.close()
+
+    def test_old_sqlite_refused(self):
+        with patch("sqlite3.sqlite_version_info", (3, 22, 0)):
+            with self.assertRaises(RuntimeError):
+                SqliteBackend(self.path)
+
+
+class TestSharedState(unittest.TestCase):
+    """Two backends on one file stand in for two agent worker processes."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp.name, "state.db")
+        self.a, self.b = SqliteBackend(path), SqliteBackend(path)
+
+    def tearDown(self):
+        self.a.close()
+        self.b.close()
+        self.tmp.cleanup()
+
+    def test_gpu_lock(self):
+        set_auth_token("secret")
+        client = TestClient(app)
+        with patch.object(state, "backend", self.a):
+            self.assertTrue(state.lock("alice"))
+        with patch.object(state, "backend", self.b):
+            self.assertEqual(state.owner_id, "alice")
+            self.assertIsNotNone(state.workload_start_time)
+            res = client.post("/lock?key=secret", json={"owner_id": "bob"})
+            self.assertEqual(res.status_code, 503)
+            self.assertFalse(state.unlock("bob"))
+            self.assertTrue(state.unlock("alice"))
+        with patch.object(state, "backend", self.a):
+            self.assertFalse(state.is_locked)
+
+    def test_clan_across_processes(self):
+        first, second = ClanState(self.a), ClanState(self.b)
+        keys = first.create_clan(node("host", "host"), "admin")
+
+        second.sync()
+        self.assertEqual(second.worker_join_key, keys["worker_key"])
+        self.assertTrue(second.add_worker(node("w1")))
+
+        # `first` hasn't seen w1 yet: its join is redone on top of the latest version
+        self.assertTrue(first.add_worker(node("w2")))
+        self.assertEqual(sorted(first.nodes), ["host", "w1", "w2"])
+        self.assertEqual(first.nodes["w1"].token, "t-w1")
+
+        self.assertTrue(second.remove_node("w2"))
+        first.sync()
+        self.assertEqual(sorted(first.nodes), ["host", "w1"])
+        self.assertEqual(first.total_vram, 2000)
+        self.assertEqual(first.status_page()[0], second.status_page()[0]) # Same version, same ETag
+
+    def test_sync_loads_only_changed_rows(self):
+        first, second = ClanState(self.a), ClanState(self.b)
+        first.create_clan(node("host", "host"), "admin")
+        for i in range(5):
+            self.assertTrue(first.add_worker(node(f"w{i}")))
+        second.sync()
+        self.assertEqual(len(second.nodes), 6)
+
+        loaded = []
+        changed_since = self.b.changed_since
+        with patch.object(self.b, "changed_since", lambda *a: loaded.extend(changed_since(*a)) or loaded):
+            second.sync() # Nothing new: one stamp lookup
+            self.assertEqual(loaded, [])
+            self.assertTrue(first.heartbeat("w3", status="busy"))
+            second.sync()
+        self.assertEqual([key for key, _, _ in loaded], [NODE_PREFIX + "w3"])
+        self.assertEqual(second.nodes["w3"].status, "busy")
+        self.assertEqual(second.version, first.version)
+        self.assertEqual(second.total_vram, 6000)
+
+    def test_per_process_features_refused_with_workers(self):
+        set_auth_token("secret")
+        client = TestClient(app)
+        state.lock("alice")
+        try:
+            with patch.object(api, "WORKER_PROCESSES", 2):
+                for body in ({"return_ref": True}, {"refs": ["r"]}, {"idempotency_key": "k"}, {"dedupe": True}):
+                    res = client.post("/submit?key=secret", json=dict({"owner_id": "alice", "code": "print(1)"}, **body))
+                    self.assertEqual(res.status_code, 400)
+                    self.assertIn("--workers", res.json()["detail"])
+                res = client.post("/dag/submit?key=secret", json={"owner_id": "alice", "nodes": [], "outputs": []})
+                self.assertEqual(res.status_code, 400)
+        finally:
+            state.unlock("alice")
+
+    def test_memory_backend_is_not_shared(self):
+        clan = ClanState(MemoryBackend())
+        clan.create_clan(node("host", "host"), "admin")
+        self.assertIsNone(clan.backend.get(META_KEY)) # Nothing to publish to
+        self.assertTrue(clan.add_worker(node("w1")))
+        self.assertEqual(clan.version, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
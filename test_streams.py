@@ -0,0 +1,142 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import uvicorn
+
+import gpuhost.api as api
+from gpuhost.api import app, set_auth_token
+from gpuhost.client import AsyncGPUClient, GPUClient
+from gpuhost.job_store import JobStore
+from gpuhost.state import state
+from gpuhost.streams import END, ITEM, FrameDecoder, encode_frame
+
+
+class TestFraming(unittest.TestCase):
+
+    def test_frames_split_across_chunks(self):
+        data = encode_frame(ITEM, b"abc") + encode_frame(ITEM, b"") + encode_frame(END, b"{}")
+        decoder = FrameDecoder()
+        frames = []
+        for i in range(0, len(data), 4):
+            frames += decoder.feed(data[i:i + 4])
+        self.assertEqual(frames, [(ITEM, b"abc"), (ITEM, b""), (END, b"{}")])
+
+
+class TestStreaming(unittest.TestCase):
+    """Against a real server: TestClient buffers whole responses."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning"))
+        cls.thread = threading.Thread(target=cls.server.run, daemon=True)
+        cls.thread.start()
+        while not cls.server.started:
+            time.sleep(0.01)
+        cls.url = "http://127.0.0.1:%d" % cls.server.servers[0].sockets[0].getsockname()[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.should_exit = True
+        cls.thread.join(10) # Its lifespan restores asyncio's child watcher on the way out
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = JobStore(os.path.join(self.tmp, "jobs.db"))
+        self.patch = patch.object(api, "job_store", self.store)
+        self.patch.start()
+        set_auth_token("secret")
+        self.gpu = GPUClient(f"{self.url}/?key=secret")
+        state.lock(self.gpu.owner_id)
+
+    def tearDown(self):
+        state.unlock(self.gpu.owner_id)
+        self.gpu.close()
+        self.patch.stop()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_items_arrive_as_yielded(self):
+        @self.gpu.remote
+        def slow_squares(n, delay):
+            import time
+            for i in range(n):
+                yield i * i
+                time.sleep(delay)
+
+        start = time.monotonic()
+        items = slow_squares(3, 1.0)
+        self.assertEqual(next(items), 0)
+        self.assertLess(time.monotonic() - start, 1.0) # Didn't wait for the whole function
+        self.assertEqual(list(items), [1, 4])
+        self.store.flush()
+        record = self.store.get(self.gpu.last_job_id)
+        self.assertEqual((record["type"], record["status"]), ("stream", "success"))
+
+    def test_close_early_stops_the_job(self):
+        marker = os.path.join(self.tmp, "progress")
+
+        @self.gpu.remote
+        def forever(path):
+            import time
+            i = 0
+            while True:
+                with open(path, "w") as f:
+                    f.write(str(i))
+                yield i
+                i += 1
+                time.sleep(0.05)
+
+        items = forever(marker)
+        self.assertEqual([next(items) for _ in range(3)], [0, 1, 2])
+        items.close()
+
+        deadline = time.monotonic() + 5
+        while self.store.get(self.gpu.last_job_id)["status"] != "cancelled" and time.monotonic() < deadline:
+            time.sleep(0.1)
+            self.store.flush()
+        self.assertEqual(self.store.get(self.gpu.last_job_id)["status"], "cancelled")
+        with open(marker) as f:
+            stopped_at = f.read()
+        time.sleep(0.3)
+        with open(marker) as f:
+            self.assertEqual(f.read(), stopped_at) # The generator isn't running anymore
+
+    def test_error_after_items(self):
+        @self.gpu.remote
+        def flaky():
+            yield 1
+            raise ValueError("boom")
+
+        items = flaky()
+        self.assertEqual(next(items), 1)
+        with self.assertRaises(RuntimeError) as ctx:
+            next(items)
+        self.assertIn("boom", str(ctx.exception))
+
+        with self.assertRaises(ValueError):
+            self.gpu.remote(flaky, return_ref=True)
+
+    def test_async_client(self):
+        async def main():
+            async with AsyncGPUClient(f"{self.url}/?key=secret") as gpu:
+                gpu.owner_id = self.gpu.owner_id # Same lock holder
+
+                @gpu.remote
+                def count(n):
+                    yield from range(n)
+
+                return [i async for i in count(5)]
+
+        # On another thread: asyncio.run() here would detach the server loop's child watcher
+        with ThreadPoolExecutor(1) as pool:
+            self.assertEqual(pool.submit(asyncio.run, main()).result(), [0, 1, 2, 3, 4])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+import gpuhost.api as api
+from gpuhost.api import app, set_auth_token
+from gpuhost.client import GPUClient
+from gpuhost.job_store import JobStore
+from gpuhost.state import state
+from gpuhost.tracing import (
+    Tracer, collect, current_traceparent, load_trace, parse_traceparent, server_timing, span, tracer
+)
+
+
+class TestSpans(unittest.TestCase):
+
+    def test_nesting_and_propagation(self):
+        with collect() as spans:
+            with span("outer") as outer:
+                with span("inner") as inner:
+                    header = current_traceparent()
+            with span("remote", traceparent=header) as continued:
+                pass
+        self.assertIsNone(current_traceparent())
+        self.assertEqual(inner.parent_id, outer.span_id)
+        self.assertEqual(parse_traceparent(header), (outer.trace_id, inner.span_id))
+        self.assertEqual((continued.trace_id, continued.parent_id), (outer.trace_id, inner.span_id))
+        self.assertEqual([s.name for s in spans], ["inner", "outer", "remote"])
+        self.assertRegex(server_timing(spans), r"^outer;dur=[\d.]+, inner;dur=[\d.]+, remote;dur=[\d.]+$")
+
+        self.assertIsNone(parse_traceparent("00-abc-def-01"))
+        self.assertIsNone(parse_traceparent("00-" + "0" * 32 + "-" + "1" * 16 + "-01"))
+
+    def test_concurrent_tasks_keep_their_parents(self):
+        async def call(name):
+            with span(name) as s:
+                await asyncio.sleep(0.01)
+                return s
+
+        async def main():
+            with span("gather") as root:
+                return root, await asyncio.gather(call("a"), call("b"))
+
+        root, children = asyncio.run(main())
+        self.assertEqual({c.parent_id for c in children}, {root.span_id})
+
+
+class TestEndToEnd(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.trace_path = os.path.join(self.tmp, "trace.json")
+        self.patches = [
+            patch.object(api, "job_store", JobStore(os.path.join(self.tmp, "jobs.db"))),
+            patch.object(tracer, "path", self.trace_path),
+        ]
+        for p in self.patches:
+            p.start()
+        set_auth_token("secret")
+        self.http = TestClient(app)
+
+    def tearDown(self):
+        tracer.close()
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_server_timing_header(self):
+        res = self.http.get("/info?key=secret", headers={"traceparent": "00-" + "a" * 32 + "-" + "b" * 16 + "-01"})
+        self.assertRegex(res.headers["Server-Timing"], r"^auth;dur=[\d.]+, total;dur=[\d.]+$")
+        self.assertEqual(parse_traceparent(res.headers["traceparent"])[0], "a" * 32)
+
+    def test_remote_call_trace(self):
+        gpu = GPUClient("http://testserver/?key=secret", session=self.http)
+        state.lock(gpu.owner_id)
+        try:
+            @gpu.remote
+            def square(x):
+                return x * x
+
+            self.assertEqual(square(7), 49)
+        finally:
+            state.unlock(gpu.owner_id)
+
+        events = load_trace(self.trace_path)
+        names = [e["name"] for e in events]
+        for name in ["serialize", "request", "deserialize", "remote", "POST /submit", "auth", "admit", "lock_check",
+                     "write_input", "spawn", "imports", "unpickle", "user_code", "pickle_result", "hex_encode"]:
+            self.assertIn(name, names)
+        # One trace from the client call down to the job's own process
+        self.assertEqual(len({e["args"]["trace_id"] for e in events}), 1)
+        by_id = {e["args"]["span_id"]: e for e in events}
+        user_code = next(e for e in events if e["name"] == "user_code")
+        self.assertEqual(by_id[user_code["args"]["parent_id"]]["name"], "run_process")
+        request = next(e for e in events if e["name"] == "request")
+        self.assertIn("user_code;dur=", request["args"]["server_timing"])
+
+    def test_trace_file_appends(self):
+        path = os.path.join(self.tmp, "appended.json")
+        for _ in range(2): # e.g. two agent worker processes
+            local = Tracer(path)
+            with patch("gpuhost.tracing.tracer", local), span("step"):
+                pass
+            local.close()
+        self.assertEqual([e["name"] for e in load_trace(path)], ["step", "step"])
+
+
+if __name__ == "__main__":
+    unittest.main()
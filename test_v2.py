@@ -97,5 +97,53 @@ class TestGPUHostV2(unittest.TestCase):
         self.assertEqual(chat_resp.status_code, 200)
         print("[TEST] Client Request Processed:", chat_resp.json())
 
+    @patch("gpuhost.api.get_gpu_info")
+    def test_clan_status_cache(self, mock_gpu):
+        hardware = {"arch": "Ampere", "cuda_capability": "8.6", "memory_total": 8 * 1024 ** 3}
+        mock_gpu.return_value = hardware
+        from gpuhost.api import set_auth_token
+        set_auth_token("admin-secret")
+        keys = client.post("/v2/clan/create?key=admin-secret").json()["keys"]
+        worker = {"Authorization": f"Bearer {keys['worker_key']}"}
+        reader = {"Authorization": f"Bearer {keys['client_key']}"}
+
+        ids, node_secrets = [], []
+        for i in range(5):
+            resp = client.post("/v2/clan/join", headers=worker,
+                               json={"name": f"W{i}", "url": f"http://10.0.0.{i}:8848", "hardware": hardware})
+            ids.append(resp.json()["node_id"])
+            node_secrets.append(resp.json()["node_secret"])
+
+        # Aggregates maintained incrementally
+        first = client.get("/v2/clan/status", headers=reader)
+        self.assertEqual(first.json()["total_vram"], 6 * hardware["memory_total"])
+        self.assertEqual(first.json()["active_nodes"], 6)
+        etag = first.headers["ETag"]
+
+        # Unchanged: 304
+        again = client.get("/v2/clan/status", headers=dict(reader, **{"If-None-Match": etag}))
+        self.assertEqual(again.status_code, 304)
+
+        # A heartbeat right after joining doesn't change what's published
+        client.post("/v2/clan/heartbeat", headers=worker, json={"node_id": ids[0], "node_secret": node_secrets[0]})
+        self.assertEqual(client.get("/v2/clan/status", headers=dict(reader, **{"If-None-Match": etag})).status_code, 304)
+
+        # Another node's secret (or none) doesn't let the worker key speak for a node
+        self.assertEqual(client.post("/v2/clan/heartbeat", headers=worker,
+                                     json={"node_id": ids[0], "node_secret": node_secrets[1]}).status_code, 403)
+        self.assertEqual(client.post("/v2/clan/leave", headers=worker, json={"node_id": ids[0]}).status_code, 403)
+        self.assertNotIn("secret", first.json()["nodes"][1])
+
+        # Leaving does
+        client.post("/v2/clan/leave", headers=worker, json={"node_id": ids[0], "node_secret": node_secrets[0]})
+        changed = client.get("/v2/clan/status", headers=dict(reader, **{"If-None-Match": etag}))
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.json()["total_vram"], 5 * hardware["memory_total"])
+
+        # Pagination & filtering
+        page = client.get("/v2/clan/status?role=worker&offset=1&limit=2", headers=reader).json()
+        self.assertEqual(page["matching_nodes"], 4)
+        self.assertEqual([n["id"] for n in page["nodes"]], ids[2:4])
+
 if __name__ == "__main__":
     unittest.main()